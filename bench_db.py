@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+热点查询微基准：对比普通执行与预编译语句（DB_PREPARE）的单次查询延迟
+
+  DATABASE_URL=postgresql://localhost/bench python bench_db.py
+  python bench_db.py -n 5000 --codes 2000
+
+在 DATABASE_URL 指向的库里建一套临时实例表（默认 bench），跑完删除；不要指向生产库。
+"""
+import argparse
+import statistics
+import time
+from datetime import datetime
+
+import bot
+
+def _role(db: bot.DB, i: int):
+    # 先清掉这个用户的角色缓存，否则测到的是内存命中而不是查询
+    tid = 1000 + i % 50
+    db.forget_roles(tid)
+    return db.get_user_role(tid)
+
+
+# (名称, 调用) —— 与处理器里的调用方式一致
+CASES = [
+    ('role', _role),
+    ('track_user', lambda db, i: db.track_user(1000 + i % 50, f'u{i % 50}', 'bench')),
+    ('stats', lambda db, i: db.stock_stats()),
+    ('user_codes', lambda db, i: db.get_user_codes(1000 + i % 50)),
+    ('assigned_rows', lambda db, i: db.get_assigned_rows(1000 + i % 50)),
+    ('assigned_rows_all', lambda db, i: db.get_assigned_rows(0, all_users=True)),
+    ('code_holders', lambda db, i: db.get_code_holders()),
+    ('claim', lambda db, i: db.assign_codes(1000 + i % 50, 1)),
+]
+
+
+def setup(db: bot.DB, codes: int):
+    db.init_schema()
+    conn = db._conn()
+    try:
+        cur = conn.cursor()
+        cur.execute(f'TRUNCATE {db.tbl_codes}, {db.tbl_users}')
+        now = datetime.now().isoformat()
+        db._bulk_insert(cur, f'INSERT INTO {db.tbl_users} (telegram_id, username, first_name, first_seen) VALUES %s',
+                        [(1000 + i, f'u{i}', 'bench', now) for i in range(50)])
+        # 一半已出库给 50 个用户，一半可领取
+        db._bulk_insert(cur, f'INSERT INTO {db.tbl_codes} (code, status, assigned_to, assigned_at) VALUES %s',
+                        [(f'B{i:07d}', 'assigned' if i % 2 else 'available', 1000 + i % 50 if i % 2 else None,
+                          now if i % 2 else None) for i in range(codes)])
+        conn.commit()
+    finally:
+        db._put(conn)
+
+
+def drop(db: bot.DB):
+    conn = db._conn()
+    try:
+        cur = conn.cursor()
+        for tbl in (db.tbl_users, db.tbl_codes, db.tbl_archive, db.tbl_lease, db.tbl_notices, db.tbl_events,
+                    db.tbl_live):
+            cur.execute(f'DROP TABLE IF EXISTS {tbl}')
+        conn.commit()
+    finally:
+        db._put(conn)
+
+
+def run(db: bot.DB, n: int) -> dict:
+    result = {}
+    for name, call in CASES:
+        for i in range(min(50, n)):  # 预热：建立连接、PREPARE
+            call(db, i)
+        samples = []
+        for i in range(n):
+            t0 = time.perf_counter_ns()
+            call(db, i)
+            samples.append((time.perf_counter_ns() - t0) / 1000)
+        samples.sort()
+        result[name] = (statistics.fmean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99)])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='热点查询微基准（普通执行 vs 预编译语句）')
+    parser.add_argument('-n', type=int, default=2000, help='每个查询的执行次数')
+    parser.add_argument('--codes', type=int, default=1000, help='码池大小')
+    parser.add_argument('--instance', default='bench')
+    args = parser.parse_args(argv)
+    if not bot.DATABASE_URL:
+        parser.error('需要设置 DATABASE_URL（本地 PostgreSQL）')
+
+    db = bot.DB(bot._instance_name(args.instance))
+    results = {}
+    try:
+        for mode, prepare in (('plain', False), ('prepared', True)):
+            bot.DB_PREPARE = prepare
+            setup(db, args.codes + 2 * (args.n + 50))
+            results[mode] = run(db, args.n)
+    finally:
+        drop(db)
+
+    def fmt(r):
+        return f'{r[0]:.0f}/{r[1]:.0f}/{r[2]:.0f}'
+
+    print(f'{"query":<20}{"plain mean/p50/p99 µs":>26}{"prepared mean/p50/p99 µs":>29}{"speedup":>10}')
+    for name, _ in CASES:
+        plain, prep = results['plain'][name], results['prepared'][name]
+        print(f'{name:<20}{fmt(plain):>26}{fmt(prep):>29}{plain[0] / prep[0]:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
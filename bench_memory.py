@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+内存基准：远程状态条目和库存行，逐条 dict 与紧凑记录（CodeStatus / PoolRow）的占用对比
+
+  python bench_memory.py                  # 10k 与 100k 个码
+  python bench_memory.py --sizes 50000
+
+不连数据库和 Meet API，数据按真实字段随机生成；用 tracemalloc 统计构建后仍存活的内存。
+"""
+import argparse
+import gc
+import json
+import random
+import string
+import sys
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import bot
+
+
+def _codes(n: int) -> list:
+    """码预先 intern：进程里它们本来就被快照和库存行共用，驻留表扩容不算进任何一边"""
+    rnd = random.Random(n)
+    alphabet = string.ascii_uppercase + string.digits
+    return [sys.intern(''.join(rnd.choices(alphabet, k=8))) for _ in range(n)]
+
+
+def _api_payload(codes: list) -> str:
+    """模拟 /api/admin-code 的 JSON 响应：约一半使用中，大部分带到期时间"""
+    now = datetime.now(timezone.utc)
+    items = []
+    for i, code in enumerate(codes):
+        in_use = i % 2
+        exp = (now + timedelta(minutes=i % 720 - 120)).isoformat().replace('+00:00', 'Z') if i % 5 else None
+        items.append({'code': code, 'in_use': in_use, 'bound_room': f'room-{i}' if in_use else None,
+                      'expires_at': exp})
+    return json.dumps({'codes': items})
+
+
+def _db_rows(codes: list):
+    """模拟数据库驱动逐行返回的元组（列顺序与 PoolRow 一致），每次调用都是新对象"""
+    now = datetime.now()
+    for i, code in enumerate(codes):
+        at = (now - timedelta(seconds=i)).isoformat()
+        yield (i + 1, code, 'assigned', 1000 + i % 50, at, '', at[:19], f'user{i % 50}', f'u{i % 50}')
+
+
+def _measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    keep = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del keep
+    return after - before
+
+
+def bench(n: int):
+    codes = _codes(n)
+    payload = _api_payload(codes)
+    cols = bot.PoolRow._fields
+
+    def status_dicts():
+        return {c['code']: c for c in json.loads(payload)['codes']}
+
+    def status_records():
+        return {c['code']: bot.CodeStatus.from_api(c) for c in json.loads(payload)['codes']}
+
+    def row_dicts():
+        return [dict(zip(cols, r)) for r in _db_rows(codes)]
+
+    def row_records():
+        return [bot.PoolRow._make(r) for r in _db_rows(codes)]
+
+    results = [
+        ('状态条目 dict', _measure(status_dicts)),
+        ('状态条目 CodeStatus', _measure(status_records)),
+        ('库存行 dict', _measure(row_dicts)),
+        ('库存行 PoolRow', _measure(row_records)),
+    ]
+    print(f'\n{n} 个码')
+    for name, size in results:
+        print(f'  {name:<20}{size / 1024 / 1024:>8.2f} MB{size / n:>8.0f} B/码')
+    print(f'  状态条目节省 {1 - results[1][1] / results[0][1]:.0%}，库存行节省 {1 - results[3][1] / results[2][1]:.0%}'
+          '（CodeStatus 另外保存了解析好的到期时间戳）')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='状态条目 / 库存行内存基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    args = parser.parse_args(argv)
+    for n in args.sizes:
+        bench(n)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,26 +11,50 @@
 克隆机器人不能自己生成授权码！码只来自主机器人下发。
 """
 import asyncio
+import csv
+import functools
+import gzip
+import heapq
+import io
+import json
 import logging
 import os
+import re
+import signal
+import socket
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
+import psycopg2.pool
 import aiohttp
+import aiohttp.web
+from collections import OrderedDict, deque, namedtuple
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from dotenv import load_dotenv
 from telegram import (
+    Bot,
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
 )
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
     ContextTypes,
 )
@@ -45,11 +69,91 @@ OWNER_ID     = int(os.getenv('OWNER_TELEGRAM_ID', '0'))
 ADMIN_IDS    = {int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip().isdigit()}
 ADMIN_IDS.add(OWNER_ID)
 MEET_API_URL = os.getenv('MEET_API_URL', 'https://meet.f13f2f75.org')
+MEET_PAGE_SIZE = int(os.getenv('MEET_PAGE_SIZE', '500'))
+# 授权码有效时长（分钟，由主机器人设定）；用于由 expires_at 反推首次开房时间
+AUTH_CODE_EXPIRES = int(os.getenv('AUTH_CODE_EXPIRES', '720'))
+# 存储后端：postgres（DATABASE_URL，多副本 / 多机器人共用）或 sqlite（单机嵌入式，SQLITE_PATH）
+DB_BACKEND    = os.getenv('DB_BACKEND', 'postgres').strip().lower()
+SQLITE_PATH   = os.getenv('SQLITE_PATH', str(Path(__file__).parent / 'data' / 'cloudmeeting.db'))
 DATABASE_URL  = os.getenv('DATABASE_URL', '')
-# 每个机器人一个实例名，对应远程DB中不同的表名，多个机器人共用同一Neon互不干扰
+DB_POOL_MAX   = int(os.getenv('DB_POOL_MAX', '10'))
+# 后台线程（导出、归档等）连接用尽时最多等待多少秒（事件循环线程有预留连接，从不等待）；空闲超过多少秒的连接借出前先探活
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_POOL_CHECK_IDLE = float(os.getenv('DB_POOL_CHECK_IDLE', '30'))
+# 热点查询使用服务端预编译语句（PREPARE / EXECUTE）；经 PgBouncer 事务池连接时可关掉，检测到不支持也会自动退回
+DB_PREPARE    = os.getenv('DB_PREPARE', '1') not in ('0', 'false', 'no')
+# 每个机器人一个实例名，对应远程DB中不同的表名（users_{x} / auth_code_pool_{x}），多个机器人共用同一Neon互不干扰
 BOT_INSTANCE  = os.getenv('BOT_INSTANCE', 'bot1').strip().lower().replace('-','_')
-TBL_USERS     = f'users_{BOT_INSTANCE}'
-TBL_CODES     = f'auth_code_pool_{BOT_INSTANCE}'
+# 多租户模式：指向一个 JSON 文件，列出多个克隆机器人的 token/owner/admins/instance，一个进程全部托管
+BOTS_CONFIG   = os.getenv('BOTS_CONFIG', '')
+# 远程码状态快照的复用时间（秒），同一进程内所有机器人共用一份
+STATUS_MAX_AGE = float(os.getenv('STATUS_MAX_AGE', '10'))
+# 按码查询：快照不够新时，等待多少秒把并发的查询合并成一次远程请求
+LOOKUP_BATCH_WINDOW = float(os.getenv('LOOKUP_BATCH_WINDOW', '0.05'))
+# Meet API 熔断：连续失败多少次后熔断，熔断多少秒后放一个试探请求
+MEET_BREAKER_FAILURES = int(os.getenv('MEET_BREAKER_FAILURES', '3'))
+MEET_BREAKER_RESET    = float(os.getenv('MEET_BREAKER_RESET', '30'))
+# 出站限速：Telegram 官方限制约为全局 30 条/秒、单个会话 1 条/秒
+TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', '25'))
+TG_CHAT_RATE   = float(os.getenv('TG_CHAT_RATE', '1'))
+TG_CHAT_BURST  = int(os.getenv('TG_CHAT_BURST', '3'))
+# 重复点击合并：同一用户同一操作执行中或刚完成多少秒内的重复点击不再重新计算
+DEBOUNCE_SECONDS = float(os.getenv('DEBOUNCE_SECONDS', '2'))
+# 批量结束会议时同时发往 Meet API 的最大请求数
+BULK_RELEASE_CONCURRENCY = int(os.getenv('BULK_RELEASE_CONCURRENCY', '8'))
+# 码生命周期事件日志：缓冲多少秒 / 多少条写一次库
+EVENT_FLUSH_INTERVAL = float(os.getenv('EVENT_FLUSH_INTERVAL', '2'))
+EVENT_BUFFER_MAX     = int(os.getenv('EVENT_BUFFER_MAX', '10000'))
+# /admin export 每批从数据库取多少行（服务端游标），内存只保留一批
+EXPORT_BATCH = int(os.getenv('EXPORT_BATCH', '2000'))
+# 到期提醒：在到期前多少分钟提醒持码人（逗号分隔，留空关闭）
+EXPIRY_NOTIFY_MINUTES = sorted(
+    {int(x) for x in os.getenv('EXPIRY_NOTIFY_MINUTES', '60,10').split(',') if x.strip().isdigit()},
+    reverse=True,
+)
+# 库存预警：按近期领取速度预测耗尽时间，低于多少小时提醒管理员
+LOW_STOCK_HOURS = float(os.getenv('LOW_STOCK_HOURS', '24'))
+# 领取限速：每个用户每秒恢复多少次领取、最多连续领取几次（令牌桶，内存中判断，被拒绝不访问数据库）
+CLAIM_RATE  = float(os.getenv('CLAIM_RATE', '0.2'))
+CLAIM_BURST = int(os.getenv('CLAIM_BURST', '3'))
+# 领取配额：每个角色在 CLAIM_QUOTA_HOURS 小时滑动窗口内最多领取几个，格式 角色:数量，逗号分隔；未列出的角色不限
+CLAIM_QUOTA = {
+    k.strip(): int(v) for k, v in
+    (x.split(':', 1) for x in os.getenv('CLAIM_QUOTA', 'admin:50').split(',') if ':' in x)
+    if v.strip().isdigit() and int(v) > 0
+}
+CLAIM_QUOTA_HOURS = float(os.getenv('CLAIM_QUOTA_HOURS', '24'))
+# 自动回收：领取超过多少小时仍从未开房（远程没有 bound_room / expires_at）的码退回库存，0 关闭
+RECLAIM_AFTER_HOURS = float(os.getenv('RECLAIM_AFTER_HOURS', '72'))
+# 回收前多少小时提醒持码人，0 不提醒直接回收
+RECLAIM_WARN_HOURS  = float(os.getenv('RECLAIM_WARN_HOURS', '12'))
+# 归档：远程到期超过多少小时、且不在使用中的已出库码移到归档表（auth_code_archive_{实例}），0 关闭
+ARCHIVE_AFTER_HOURS = float(os.getenv('ARCHIVE_AFTER_HOURS', '24'))
+# 角色缓存（秒）：每次交互都要查角色，缓存后绑定 / 解绑在其他副本上最多延迟这么久生效
+ROLE_CACHE_TTL = float(os.getenv('ROLE_CACHE_TTL', '30'))
+# 热启动检查点：状态快照 / 到期提醒排程 / 角色缓存定时写到本地文件，重启后直接恢复
+WARM_STATE_PATH     = os.getenv('WARM_STATE_PATH', str(Path(__file__).parent / 'data' / 'warm_state.bin'))
+WARM_STATE_INTERVAL = float(os.getenv('WARM_STATE_INTERVAL', '60'))
+WARM_STATE_MAX_AGE  = float(os.getenv('WARM_STATE_MAX_AGE', '900'))
+# 健康检查 HTTP 端口（/healthz 存活、/readyz 就绪），0 关闭；依赖探测（数据库 / Meet API）的缓存间隔（秒）
+HEALTH_PORT           = int(os.getenv('HEALTH_PORT', '0'))
+HEALTH_HOST           = os.getenv('HEALTH_HOST', '0.0.0.0')
+HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', '30'))
+# 事件循环延迟超过多少秒判为不健康
+HEALTH_MAX_LAG        = float(os.getenv('HEALTH_MAX_LAG', '5'))
+# Meet API 不可用时是否判为未就绪：所有副本共用同一个 Meet，默认只报告不参与判断（否则会一起被摘掉）
+HEALTH_READY_MEET     = os.getenv('HEALTH_READY_MEET', '0') not in ('0', 'false', 'no')
+# 更新并发处理：同时处理的更新数上限（不同用户并行，同一用户 / 会话严格按顺序），1 为逐条处理
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '16'))
+# 进入处理（含排队等待）的更新总数上限，超过后新更新在外面等；单个用户最多排队多少条，超过的直接丢弃
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', '512'))
+UPDATE_USER_QUEUE  = int(os.getenv('UPDATE_USER_QUEUE', '20'))
+# 实时面板（/admin live）：最快每多少秒编辑一次；有订阅者时远程状态快照最旧允许多少秒
+LIVE_THROTTLE = float(os.getenv('LIVE_THROTTLE', '5'))
+LIVE_MAX_AGE  = float(os.getenv('LIVE_MAX_AGE', '30'))
+# 多副本部署：同一 BOT_INSTANCE 可跑多个进程，只有持有租约的 leader 执行定时任务和预置码
+REPLICA_ID    = os.getenv('REPLICA_ID', '') or f'{socket.gethostname()}:{os.getpid()}'
+LEADER_LEASE_SECONDS = int(os.getenv('LEADER_LEASE_SECONDS', '30'))
 # 主机器人数据库（本地注册用，远端部署时跳过）
 MASTER_DB = Path(os.getenv(
     'MASTER_DB_PATH',
@@ -58,14 +162,15 @@ MASTER_DB = Path(os.getenv(
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
+# 模块加载时刻，用于记录启动耗时
+_BOOT = time.monotonic()
 
 
-def register_to_master():
+def register_to_master(t: 'Tenant'):
     """启动时注册进主机器人（本地SQLite，远端部署时自动跳过）"""
     if not MASTER_DB.exists():
         return
     try:
-        import sqlite3
         conn = sqlite3.connect(str(MASTER_DB))
         cols = {r[1] for r in conn.execute('PRAGMA table_info(agents)').fetchall()}
         if 'local_db_path' not in cols:
@@ -78,10 +183,10 @@ def register_to_master():
                 bot_token = excluded.bot_token,
                 local_db_path = excluded.local_db_path,
                 joined_at = excluded.joined_at
-        ''', (OWNER_ID, '', '自用克隆机器人', now, '', BOT_TOKEN, ''))
+        ''', (t.owner_id, '', '自用克隆机器人', now, '', t.token, ''))
         conn.commit()
         conn.close()
-        logger.info(f'已向主机器人注册: owner={OWNER_ID}')
+        logger.info(f'已向主机器人注册: owner={t.owner_id}')
     except Exception as e:
         logger.warning(f'注册主机器人失败（不影响运行）: {e}')
 
@@ -90,210 +195,625 @@ def register_to_master():
 # ============================================================
 #  远程数据库 (PostgreSQL / Neon)
 # ============================================================
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class _PgConn(psycopg2.extensions.connection):
+    """记录本连接上已 PREPARE 过的语句名（预编译语句只在所属连接上有效）和最近一次归还的时刻"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.idle_since = time.monotonic()
+        self.worker = False  # 由工作线程借出（占用工作线程配额）
+
+    def alive(self) -> bool:
+        try:
+            cur = self.cursor()
+            cur.execute('SELECT 1')
+            self.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+
+def _on_event_loop() -> bool:
+    """当前线程是否正在运行事件循环（处理器 / 定时任务里的同步数据库调用都在这里）"""
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class _BlockingPool(psycopg2.pool.ThreadedConnectionPool):
+    """线程安全连接池：为事件循环线程预留连接，工作线程用尽时排队等待
+
+    - 事件循环线程上的调用（处理器、定时任务、快照订阅者都同步访问数据库）绝不阻塞：
+      预留的 LOOP_RESERVE 个连接只给它用，没有空闲连接时立即抛 PoolError，不会把整个循环停住
+    - asyncio.to_thread 里的调用（导出游标、归档、预置码、建表）最多同时占用 maxconn - LOOP_RESERVE 个，
+      用尽时在各自线程里等待归还（最多 timeout 秒）
+    - 空闲超过 check_idle 秒的连接借出前先探活，已断开的丢弃后换一个（新建的连接不探活）
+    """
+
+    # 事件循环上同一时刻最多嵌套取两个连接
+    LOOP_RESERVE = 2
+
+    def __init__(self, minconn, maxconn, *args, timeout: float = DB_POOL_TIMEOUT,
+                 check_idle: float = DB_POOL_CHECK_IDLE, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._workers = threading.BoundedSemaphore(max(1, maxconn - self.LOOP_RESERVE))
+
+    def getconn(self, key=None):
+        worker = not _on_event_loop()
+        if worker:
+            if not self._workers.acquire(timeout=self.timeout):
+                raise psycopg2.pool.PoolError(f'连接池工作线程配额已满，等待 {self.timeout:g}s 仍无空闲连接')
+            if not self._slots.acquire(timeout=self.timeout):
+                self._workers.release()
+                raise psycopg2.pool.PoolError(f'连接池已满（{self.maxconn}），等待 {self.timeout:g}s 仍无空闲连接')
+        elif not self._slots.acquire(blocking=False):
+            raise psycopg2.pool.PoolError(f'连接池已满（{self.maxconn}）')
+        try:
+            while True:
+                conn = super().getconn(key)
+                if not conn.closed and (time.monotonic() - conn.idle_since < self.check_idle or conn.alive()):
+                    conn.worker = worker
+                    return conn
+                logger.warning('丢弃已断开的数据库连接，重新连接')
+                super().putconn(conn, key, close=True)
+        except BaseException:
+            self._release(worker)
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            conn.idle_since = time.monotonic()
+            super().putconn(conn, key, close)
+        finally:
+            self._release(conn.worker)
+
+    def _release(self, worker: bool):
+        self._slots.release()
+        if worker:
+            self._workers.release()
+
+
+def get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    """进程内共享的连接池，多租户模式下所有机器人共用"""
+    global _pool
+    if _pool is None:
+        # 启动时多个租户在线程里并行建表，只能建一个池
+        with _pool_lock:
+            if _pool is None:
+                _pool = _BlockingPool(1, DB_POOL_MAX, DATABASE_URL, connection_factory=_PgConn)
+    return _pool
+
+
+_POOL_COLS = ('pool_id', 'code', 'status', 'assigned_to', 'assigned_at', 'note', 'added_at')
+
+
+class PoolRow(namedtuple('PoolRow', _POOL_COLS + ('first_name', 'username'), defaults=(None, None))):
+    """库存行：元组存储（没有逐行 dict），码做 intern，与状态快照里的同一个码共用字符串
+
+    仍可 row['code'] 按列名读取；不带用户信息的查询 first_name / username 为 None。
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def _make(cls, values):
+        values = tuple(values)
+        return cls(values[0], sys.intern(values[1]), *values[2:])
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+
 class DB:
+    """绑定到某个 BOT_INSTANCE 表的数据访问层（PostgreSQL）；多个实例共用同一个连接池
+
+    这些公开方法就是存储后端接口，SqliteDB 只替换连接和少数方言相关的方法。
+    用 open_db() 按 DB_BACKEND 选择实现。
+    """
+
+    # 领取时跳过其他副本已锁住的行；SQLite 单写者，不需要
+    _SKIP_LOCKED = ' FOR UPDATE SKIP LOCKED'
+
+    # 热点语句：每个实例格式化一次，在每个连接上第一次用到时 PREPARE，之后只发 EXECUTE。
+    # 参数用 $1..$n，且按顺序各出现一次（退回普通执行时直接换成 %s）
+    _HOT_SQL = {
+        'role': "SELECT role FROM {users} WHERE telegram_id=$1",
+        'track_user': (
+            "INSERT INTO {users} (telegram_id, username, first_name, first_seen) VALUES ($1, $2, $3, $4) "
+            "ON CONFLICT(telegram_id) DO UPDATE SET username=EXCLUDED.username, first_name=EXCLUDED.first_name"
+        ),
+        'claim': (
+            "UPDATE {codes} SET status='assigned', assigned_to=$1, assigned_at=$2 "
+            "WHERE pool_id IN (SELECT pool_id FROM {codes} WHERE status='available' "
+            "ORDER BY pool_id LIMIT $3{skip_locked}) RETURNING pool_id, code"
+        ),
+        'stats': (
+            "SELECT COUNT(*) AS total, COUNT(*) FILTER (WHERE status='available') AS available, "
+            "COUNT(*) FILTER (WHERE status='assigned') AS assigned FROM {codes}"
+        ),
+        'user_codes': "SELECT {pool_cols} FROM {codes} WHERE assigned_to=$1 ORDER BY assigned_at DESC",
+        'assigned_codes': "SELECT code FROM {codes} WHERE status='assigned'",
+        'code_holders': (
+            "SELECT code, assigned_to FROM {codes} "
+            "WHERE status='assigned' AND assigned_to IS NOT NULL AND assigned_to <> 0"
+        ),
+        'assigned_rows_all': (
+            "SELECT {acp_cols}, u.first_name, u.username FROM {codes} acp "
+            "LEFT JOIN {users} u ON acp.assigned_to = u.telegram_id "
+            "WHERE acp.status='assigned' ORDER BY acp.assigned_at DESC"
+        ),
+        'assigned_rows': (
+            "SELECT {acp_cols}, u.first_name, u.username FROM {codes} acp "
+            "LEFT JOIN {users} u ON acp.assigned_to = u.telegram_id "
+            "WHERE acp.assigned_to=$1 AND acp.status='assigned'"
+        ),
+    }
+
     def _conn(self):
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
+        return get_pool().getconn()
+
+    def _put(self, conn):
+        """归还连接：未提交的事务先回滚，已断开的连接直接丢弃"""
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            pass
+        get_pool().putconn(conn, close=bool(conn.closed))
 
     def _cur(self, conn):
         return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    def __init__(self):
+    def _bulk_insert(self, cur, sql: str, rows: list):
+        """sql 里用 VALUES %s 占位，整批一次写入"""
+        psycopg2.extras.execute_values(cur, sql, rows, page_size=500)
+
+    def _execute(self, cur, name: str, params=()):
+        """执行 _HOT_SQL 中的语句：连接上还没准备过就先 PREPARE"""
+        global DB_PREPARE
+        conn = cur.connection
+        if DB_PREPARE:
+            stmt = f'{name}_{self.instance}'
+            try:
+                if stmt not in conn.prepared:
+                    cur.execute(f'PREPARE {stmt} AS {self._sql[name]}')
+                    conn.prepared.add(stmt)
+                args = f" ({', '.join(['%s'] * len(params))})" if params else ''
+                cur.execute(f'EXECUTE {stmt}{args}', params)
+                return
+            except (psycopg2.errors.InvalidSqlStatementName, psycopg2.errors.DuplicatePreparedStatement):
+                # 连接池在事务之间换了后端连接（如 PgBouncer 事务模式），预编译语句不可用：
+                # 本连接准备过的语句在另一个后端上不存在（26000），或另一个客户端已在这个后端准备过同名语句（42P05）
+                conn.rollback()
+                DB_PREPARE = False
+                logger.warning('数据库连接不支持预编译语句，改为普通执行')
+        cur.execute(re.sub(r'\$\d+', '%s', self._sql[name]), params)
+
+    def __init__(self, instance: str = BOT_INSTANCE, owner_id: int = OWNER_ID):
+        self.instance = instance
+        self.owner_id = owner_id
+        self.tbl_users = f'users_{instance}'
+        self.tbl_codes = f'auth_code_pool_{instance}'
+        self.tbl_lease = f'leader_lease_{instance}'
+        self.tbl_notices = f'expiry_notice_{instance}'
+        self.tbl_events = f'code_events_{instance}'
+        self.tbl_archive = f'auth_code_archive_{instance}'
+        self.tbl_live = f'live_viewers_{instance}'
+        self.events = EventLog(self)
+        self._roles = {}  # telegram_id -> (role, 缓存到期时刻)
+        self._sql = {
+            name: sql.format(users=self.tbl_users, codes=self.tbl_codes, skip_locked=self._SKIP_LOCKED,
+                             pool_cols=', '.join(_POOL_COLS), acp_cols=', '.join(f'acp.{c}' for c in _POOL_COLS))
+            for name, sql in self._HOT_SQL.items()
+        }
+
+    def init_schema(self):
+        """建表 / 迁移 / 写入 OWNER；构造 DB 不连数据库，由启动流程（post_init）调用
+
+        全部语句拼成一次 execute，只有一个网络往返。
+        """
         conn = self._conn()
-        cur = conn.cursor()
-        cur.execute(f'''
-            CREATE TABLE IF NOT EXISTS {TBL_USERS} (
-                telegram_id BIGINT PRIMARY KEY,
-                username    TEXT,
-                first_name  TEXT,
-                first_seen  TEXT NOT NULL,
-                role        TEXT DEFAULT NULL
-            )
-        ''')
-        cur.execute(f'''
-            CREATE TABLE IF NOT EXISTS {TBL_CODES} (
-                pool_id     SERIAL PRIMARY KEY,
-                code        TEXT UNIQUE NOT NULL,
-                status      TEXT NOT NULL DEFAULT 'available',
-                assigned_to BIGINT,
-                assigned_at TEXT,
-                note        TEXT DEFAULT '',
-                added_at    TEXT NOT NULL DEFAULT TO_CHAR(NOW(), 'YYYY-MM-DD HH24:MI:SS')
-            )
-        ''')
-        # 迁移：为旧表添加 role 列
-        cur.execute(f"""
-            SELECT column_name FROM information_schema.columns
-            WHERE table_name='{TBL_USERS}' AND column_name='role'
-        """)
-        if not cur.fetchone():
-            cur.execute(f'ALTER TABLE {TBL_USERS} ADD COLUMN role TEXT DEFAULT NULL')
-        # 确保 OWNER 始终是 root
-        if OWNER_ID:
-            cur.execute(
-                f"INSERT INTO {TBL_USERS} (telegram_id, username, first_name, first_seen, role) "
-                "VALUES (%s, '', 'ROOT', %s, 'root') "
-                "ON CONFLICT(telegram_id) DO UPDATE SET role='root'",
-                (OWNER_ID, datetime.now().isoformat())
-            )
-        conn.commit()
-        conn.close()
+        try:
+            cur = conn.cursor()
+            cur.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.tbl_users} (
+                    telegram_id BIGINT PRIMARY KEY,
+                    username    TEXT,
+                    first_name  TEXT,
+                    first_seen  TEXT NOT NULL,
+                    role        TEXT DEFAULT NULL
+                );
+                -- 迁移：为旧表添加 role 列
+                ALTER TABLE {self.tbl_users} ADD COLUMN IF NOT EXISTS role TEXT DEFAULT NULL;
+                CREATE TABLE IF NOT EXISTS {self.tbl_codes} (
+                    pool_id     SERIAL PRIMARY KEY,
+                    code        TEXT UNIQUE NOT NULL,
+                    status      TEXT NOT NULL DEFAULT 'available',
+                    assigned_to BIGINT,
+                    assigned_at TEXT,
+                    note        TEXT DEFAULT '',
+                    added_at    TEXT NOT NULL DEFAULT TO_CHAR(NOW(), 'YYYY-MM-DD HH24:MI:SS')
+                );
+                -- 冷数据：远程到期已久的码从 auth_code_pool 移到这里，主表只留可用和仍有效的码
+                CREATE TABLE IF NOT EXISTS {self.tbl_archive} (
+                    pool_id     BIGINT PRIMARY KEY,
+                    code        TEXT UNIQUE NOT NULL,
+                    status      TEXT NOT NULL DEFAULT 'archived',
+                    assigned_to BIGINT,
+                    assigned_at TEXT,
+                    note        TEXT DEFAULT '',
+                    added_at    TEXT NOT NULL,
+                    expires_at  TEXT,
+                    archived_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS {self.tbl_archive}_user_idx ON {self.tbl_archive} (assigned_to);
+                CREATE TABLE IF NOT EXISTS {self.tbl_lease} (
+                    name        TEXT PRIMARY KEY,
+                    holder      TEXT NOT NULL,
+                    expires_at  TIMESTAMPTZ NOT NULL
+                );
+                -- 实时面板订阅：所有副本共享，由 leader 负责编辑
+                CREATE TABLE IF NOT EXISTS {self.tbl_live} (
+                    chat_id     BIGINT PRIMARY KEY,
+                    message_id  BIGINT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS {self.tbl_notices} (
+                    code        TEXT NOT NULL,
+                    expires_at  TEXT NOT NULL,
+                    offset_min  INTEGER NOT NULL,
+                    sent_at     TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (code, expires_at, offset_min)
+                );
+                -- 只追加不修改的码生命周期日志：added / claimed / released / force_ended / expired / deleted
+                CREATE TABLE IF NOT EXISTS {self.tbl_events} (
+                    id          BIGSERIAL PRIMARY KEY,
+                    ts          TIMESTAMPTZ NOT NULL,
+                    event       TEXT NOT NULL,
+                    code        TEXT NOT NULL,
+                    user_id     BIGINT,
+                    actor_id    BIGINT,
+                    detail      TEXT DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS {self.tbl_events}_ts_idx ON {self.tbl_events} (ts);
+                CREATE INDEX IF NOT EXISTS {self.tbl_events}_code_idx ON {self.tbl_events} (code, ts);
+                CREATE INDEX IF NOT EXISTS {self.tbl_events}_user_idx ON {self.tbl_events} (user_id, ts);
+                CREATE INDEX IF NOT EXISTS {self.tbl_events}_event_idx ON {self.tbl_events} (event, ts);
+                -- 已出库码按领取时间：自动回收、库存预测都按 assigned_at 范围查
+                CREATE INDEX IF NOT EXISTS {self.tbl_codes}_assigned_idx ON {self.tbl_codes} (assigned_at) WHERE status='assigned';
+            ''')
+            # 确保 OWNER 始终是 root
+            if self.owner_id:
+                cur.execute(
+                    f"INSERT INTO {self.tbl_users} (telegram_id, username, first_name, first_seen, role) "
+                    "VALUES (%s, '', 'ROOT', %s, 'root') "
+                    "ON CONFLICT(telegram_id) DO UPDATE SET role='root'",
+                    (self.owner_id, datetime.now().isoformat())
+                )
+            conn.commit()
+        finally:
+            self._put(conn)
 
     # ---- 用户 ----
     def track_user(self, tid: int, username: str = None, first_name: str = None):
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(
-                f'INSERT INTO {TBL_USERS} (telegram_id, username, first_name, first_seen) '
-                'VALUES (%s, %s, %s, %s) '
-                'ON CONFLICT(telegram_id) DO UPDATE SET username=%s, first_name=%s',
-                (tid, username, first_name, datetime.now().isoformat(), username, first_name)
-            )
+            self._execute(cur, 'track_user', (tid, username, first_name, datetime.now().isoformat()))
             conn.commit()
         finally:
-            conn.close()
+            self._put(conn)
 
     def get_all_users(self):
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(f'SELECT * FROM {TBL_USERS} ORDER BY first_seen DESC')
+            cur.execute(f'SELECT * FROM {self.tbl_users} ORDER BY first_seen DESC')
             return cur.fetchall()
         finally:
-            conn.close()
+            self._put(conn)
 
     # ---- 授权码库存 ----
-    def add_code(self, code: str, note: str = '') -> bool:
+    def add_code(self, code: str, note: str = '', actor_id: int = None) -> bool:
         conn = self._conn()
         try:
             cur = self._cur(conn)
+            code = code.strip().upper()
+            # 已归档（到期）的码不再重新入库，否则会被当成可用码再发出去
             cur.execute(
-                f'INSERT INTO {TBL_CODES} (code, note) VALUES (%s, %s) ON CONFLICT DO NOTHING',
-                (code.strip().upper(), note)
+                f'INSERT INTO {self.tbl_codes} (code, note) SELECT %s, %s '
+                f'WHERE NOT EXISTS (SELECT 1 FROM {self.tbl_archive} WHERE code=%s) ON CONFLICT DO NOTHING',
+                (code, note, code)
             )
             conn.commit()
+            if cur.rowcount > 0:
+                self.events.emit('added', code, actor_id=actor_id, detail=note)
             return cur.rowcount > 0
         except Exception:
             conn.rollback()
             return False
         finally:
-            conn.close()
+            self._put(conn)
 
     def assign_code(self, telegram_id: int) -> str | None:
+        codes = self.assign_codes(telegram_id, 1)
+        return codes[0] if codes else None
+
+    def assign_codes(self, telegram_id: int, n: int, actor_id: int = None) -> list:
+        """原子地取出 n 个可用码（SKIP LOCKED，多副本同时领取不会拿到同一个码）"""
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(
-                f"SELECT pool_id, code FROM {TBL_CODES} WHERE status='available' ORDER BY pool_id LIMIT 1"
-            )
-            row = cur.fetchone()
-            if not row:
-                return None
-            cur.execute(
-                f"UPDATE {TBL_CODES} SET status='assigned', assigned_to=%s, assigned_at=%s WHERE pool_id=%s",
-                (telegram_id, datetime.now().isoformat(), row['pool_id'])
-            )
+            self._execute(cur, 'claim', (telegram_id, datetime.now().isoformat(), n))
+            rows = sorted(cur.fetchall(), key=lambda r: r['pool_id'])
             conn.commit()
-            return row['code']
+            for r in rows:
+                self.events.emit('claimed', r['code'], user_id=telegram_id,
+                                 actor_id=telegram_id if actor_id is None else actor_id)
+            return [r['code'] for r in rows]
         finally:
-            conn.close()
+            self._put(conn)
 
-    def get_user_codes(self, telegram_id: int):
+    def get_user_codes(self, telegram_id: int) -> list:
         conn = self._conn()
         try:
-            cur = self._cur(conn)
-            cur.execute(
-                f"SELECT * FROM {TBL_CODES} WHERE assigned_to=%s ORDER BY assigned_at DESC",
-                (telegram_id,)
-            )
-            return cur.fetchall()
+            cur = conn.cursor()
+            self._execute(cur, 'user_codes', (telegram_id,))
+            return [PoolRow._make(r) for r in cur.fetchall()]
         finally:
-            conn.close()
+            self._put(conn)
 
     def assign_code_to(self, telegram_id: int, code: str) -> bool:
         conn = self._conn()
         try:
             cur = self._cur(conn)
             cur.execute(
-                f"UPDATE {TBL_CODES} SET status='assigned', assigned_to=%s, assigned_at=%s WHERE code=%s AND status='available'",
+                f"UPDATE {self.tbl_codes} SET status='assigned', assigned_to=%s, assigned_at=%s WHERE code=%s AND status='available'",
                 (telegram_id, datetime.now().isoformat(), code.upper())
             )
             conn.commit()
+            if cur.rowcount > 0:
+                self.events.emit('claimed', code.upper(), user_id=telegram_id)
             return True
         except Exception:
             conn.rollback()
             return False
         finally:
-            conn.close()
+            self._put(conn)
 
     def stock_stats(self) -> dict:
+        conn = self._conn()
+        try:
+            cur = self._cur(conn)
+            self._execute(cur, 'stats')
+            return dict(cur.fetchone())
+        finally:
+            self._put(conn)
+
+    def get_claims_since(self, after: str) -> list:
+        """assigned_at 晚于 after 的出库时间（升序），供库存预测增量读取"""
         conn = self._conn()
         try:
             cur = conn.cursor()
-            cur.execute(f"SELECT COUNT(*) FROM {TBL_CODES}")
-            total = cur.fetchone()[0]
-            cur.execute(f"SELECT COUNT(*) FROM {TBL_CODES} WHERE status='available'")
-            available = cur.fetchone()[0]
-            cur.execute(f"SELECT COUNT(*) FROM {TBL_CODES} WHERE status='assigned'")
-            assigned = cur.fetchone()[0]
-            return {'total': total, 'available': available, 'assigned': assigned}
+            cur.execute(
+                f"SELECT assigned_at FROM {self.tbl_codes} "
+                "WHERE status='assigned' AND assigned_at > %s ORDER BY assigned_at",
+                (after,)
+            )
+            return [r[0] for r in cur.fetchall()]
         finally:
-            conn.close()
+            self._put(conn)
+
+    def get_user_claims_since(self, since: datetime, before: datetime) -> list:
+        """[since, before) 之间的领取事件 (用户, 时间)，供启动时重建领取配额计数
+
+        按事件日志而不是库存表统计：之后被释放 / 回收 / 归档的领取同样计入（走 (event, ts) 索引）。
+        """
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT user_id, ts FROM {self.tbl_events} "
+                "WHERE event='claimed' AND ts >= %s AND ts < %s AND user_id IS NOT NULL AND user_id <> 0",
+                (since, before)
+            )
+            return cur.fetchall()
+        finally:
+            self._put(conn)
+
+    def get_assigned_before(self, before: str) -> list:
+        """assigned_at 早于 before、有持码人的已出库码（走 assigned_at 部分索引，不扫全表）"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"SELECT {', '.join(_POOL_COLS)} FROM {self.tbl_codes} "
+                "WHERE status='assigned' AND assigned_at < %s AND assigned_to IS NOT NULL AND assigned_to <> 0 "
+                "ORDER BY assigned_at",
+                (before,)
+            )
+            return [PoolRow._make(r) for r in cur.fetchall()]
+        finally:
+            self._put(conn)
+
+    def reclaim_codes(self, rows: list, before: str) -> list:
+        """把 rows（PoolRow）批量退回库存；期间被释放后重新领取的（assigned_at 不早于 before）不动
 
-    def delete_code(self, code: str) -> bool:
+        返回实际退回的行。
+        """
+        reclaimed = set()
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            for i in range(0, len(rows), 500):
+                ids = [r.pool_id for r in rows[i:i + 500]]
+                cur.execute(
+                    f"UPDATE {self.tbl_codes} SET status='available', assigned_to=NULL, assigned_at=NULL "
+                    f"WHERE status='assigned' AND assigned_at < %s AND pool_id IN ({', '.join(['%s'] * len(ids))}) "
+                    "RETURNING pool_id",
+                    [before] + ids
+                )
+                reclaimed.update(r[0] for r in cur.fetchall())
+            conn.commit()
+        finally:
+            self._put(conn)
+        done = [r for r in rows if r.pool_id in reclaimed]
+        for r in done:
+            self.events.emit('reclaimed', r.code, user_id=r.assigned_to, detail=r.assigned_at)
+        return done
+
+    # ---- 归档（冷数据） ----
+    def archive_codes(self, expiry: dict) -> list:
+        """把 expiry（code -> 远程 expires_at）里仍为已出库的码移进归档表，同一事务内删除 + 写入，返回移走的码"""
+        if not expiry:
+            return []
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            codes = list(expiry)
+            cur.execute(
+                f"DELETE FROM {self.tbl_codes} WHERE status='assigned' "
+                f"AND code IN ({', '.join(['%s'] * len(codes))}) RETURNING {', '.join(_POOL_COLS)}",
+                codes
+            )
+            rows = [PoolRow._make(r) for r in cur.fetchall()]
+            now = datetime.now().isoformat()
+            if rows:
+                self._bulk_insert(
+                    cur,
+                    f"INSERT INTO {self.tbl_archive} ({', '.join(_POOL_COLS)}, expires_at, archived_at) VALUES %s "
+                    "ON CONFLICT DO NOTHING",
+                    [(r.pool_id, r.code, 'archived', r.assigned_to, r.assigned_at, r.note, r.added_at,
+                      expiry[r.code], now) for r in rows],
+                )
+            conn.commit()
+        finally:
+            self._put(conn)
+        for r in rows:
+            self.events.emit('archived', r.code, user_id=r.assigned_to, detail=expiry[r.code])
+        return [r.code for r in rows]
+
+    def get_archived(self, code: str = None, user_id: int = None, limit: int = 30) -> list:
+        """按码或持码人查归档表，新归档的在前"""
+        where, params = [], []
+        if code:
+            where.append('a.code=%s')
+            params.append(code.upper())
+        if user_id is not None:
+            where.append('a.assigned_to=%s')
+            params.append(user_id)
+        sql = (f"SELECT a.*, u.first_name, u.username FROM {self.tbl_archive} a "
+               f"LEFT JOIN {self.tbl_users} u ON a.assigned_to = u.telegram_id")
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        conn = self._conn()
+        try:
+            cur = self._cur(conn)
+            cur.execute(sql + ' ORDER BY a.archived_at DESC LIMIT %s', params + [limit])
+            return cur.fetchall()
+        finally:
+            self._put(conn)
+
+    def delete_code(self, code: str, actor_id: int = None) -> bool:
         conn = self._conn()
         try:
             cur = self._cur(conn)
             cur.execute(
-                f"DELETE FROM {TBL_CODES} WHERE code=%s AND status='available'",
+                f"DELETE FROM {self.tbl_codes} WHERE code=%s AND status='available'",
                 (code.upper(),)
             )
             conn.commit()
+            if cur.rowcount > 0:
+                self.events.emit('deleted', code.upper(), actor_id=actor_id)
             return cur.rowcount > 0
         finally:
-            conn.close()
+            self._put(conn)
 
     def release_code(self, pool_id: int, operator_id: int) -> bool:
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            if operator_id == OWNER_ID:
-                cur.execute(
-                    f"UPDATE {TBL_CODES} SET status='available', assigned_to=NULL, assigned_at=NULL WHERE pool_id=%s AND status='assigned'",
-                    (pool_id,)
-                )
+            # 通过自连接拿到释放前的持码人，写进事件日志
+            sql = (
+                f"UPDATE {self.tbl_codes} t SET status='available', assigned_to=NULL, assigned_at=NULL "
+                f"FROM {self.tbl_codes} old WHERE t.pool_id=old.pool_id AND t.pool_id=%s AND t.status='assigned'"
+            )
+            if operator_id == self.owner_id:
+                cur.execute(sql + " RETURNING t.code, old.assigned_to", (pool_id,))
             else:
-                cur.execute(
-                    f"UPDATE {TBL_CODES} SET status='available', assigned_to=NULL, assigned_at=NULL WHERE pool_id=%s AND assigned_to=%s AND status='assigned'",
-                    (pool_id, operator_id)
-                )
+                cur.execute(sql + " AND t.assigned_to=%s RETURNING t.code, old.assigned_to", (pool_id, operator_id))
+            row = cur.fetchone()
             conn.commit()
-            return cur.rowcount > 0
+            if row:
+                self.events.emit('released', row['code'], user_id=row['assigned_to'], actor_id=operator_id)
+            return row is not None
         finally:
-            conn.close()
+            self._put(conn)
 
     def list_codes(self, limit: int = 30):
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(f"SELECT * FROM {TBL_CODES} ORDER BY pool_id DESC LIMIT %s", (limit,))
+            cur.execute(f"SELECT * FROM {self.tbl_codes} ORDER BY pool_id DESC LIMIT %s", (limit,))
             return cur.fetchall()
         finally:
-            conn.close()
+            self._put(conn)
 
     # ---- 绑定 / 角色 ----
     def get_user_role(self, tid: int) -> str | None:
-        if tid == OWNER_ID:
+        if tid == self.owner_id:
             return 'root'
+        hit = self._roles.get(tid)
+        if hit and hit[1] > time.monotonic():
+            return hit[0]
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(f"SELECT role FROM {TBL_USERS} WHERE telegram_id=%s", (tid,))
+            self._execute(cur, 'role', (tid,))
             row = cur.fetchone()
-            return row['role'] if row else None
+            role = row['role'] if row else None
         finally:
-            conn.close()
+            self._put(conn)
+        self._roles[tid] = (role, time.monotonic() + ROLE_CACHE_TTL)
+        return role
+
+    def forget_roles(self, tid: int = None):
+        if tid is None:
+            self._roles.clear()
+        else:
+            self._roles.pop(tid, None)
+
+    def cached_roles(self) -> dict:
+        return {tid: role for tid, (role, _) in self._roles.items()}
+
+    def restore_roles(self, roles: dict):
+        until = time.monotonic() + ROLE_CACHE_TTL
+        for tid, role in roles.items():
+            self._roles[tid] = (role, until)
+
+    def refresh_roles(self):
+        """一次查询重新校验缓存中的所有角色（热启动恢复后在后台调用）"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SELECT telegram_id, role FROM {self.tbl_users} WHERE role IS NOT NULL")
+            current = dict(cur.fetchall())
+        finally:
+            self._put(conn)
+        until = time.monotonic() + ROLE_CACHE_TTL
+        for tid in set(self._roles) | set(current):
+            self._roles[tid] = (current.get(tid), until)
 
     def is_authorized(self, tid: int) -> bool:
         return self.get_user_role(tid) in ('root', 'admin')
@@ -302,55 +822,318 @@ class DB:
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(f"SELECT COUNT(*) as c FROM {TBL_USERS} WHERE role='admin'")
+            cur.execute(f"SELECT COUNT(*) as c FROM {self.tbl_users} WHERE role='admin'")
             if cur.fetchone()['c'] >= 2:
                 return 'max'
-            cur.execute(f"SELECT role FROM {TBL_USERS} WHERE telegram_id=%s", (tid,))
+            cur.execute(f"SELECT role FROM {self.tbl_users} WHERE telegram_id=%s", (tid,))
             existing = cur.fetchone()
             if existing and existing['role'] == 'root':
                 return 'is_root'
             if existing and existing['role'] == 'admin':
                 return 'already'
             cur.execute(
-                f"INSERT INTO {TBL_USERS} (telegram_id, username, first_name, first_seen, role) "
+                f"INSERT INTO {self.tbl_users} (telegram_id, username, first_name, first_seen, role) "
                 "VALUES (%s, %s, %s, %s, 'admin') "
                 f"ON CONFLICT(telegram_id) DO UPDATE SET role='admin', "
-                f"username=COALESCE(EXCLUDED.username, {TBL_USERS}.username), "
-                f"first_name=COALESCE(EXCLUDED.first_name, {TBL_USERS}.first_name)",
+                f"username=COALESCE(EXCLUDED.username, {self.tbl_users}.username), "
+                f"first_name=COALESCE(EXCLUDED.first_name, {self.tbl_users}.first_name)",
                 (tid, username or '', first_name or '', datetime.now().isoformat())
             )
             conn.commit()
+            self.forget_roles(tid)
             return 'ok'
         finally:
-            conn.close()
+            self._put(conn)
 
     def unbind_user(self, tid: int) -> bool:
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(f"UPDATE {TBL_USERS} SET role=NULL WHERE telegram_id=%s AND role='admin'", (tid,))
+            cur.execute(f"UPDATE {self.tbl_users} SET role=NULL WHERE telegram_id=%s AND role='admin'", (tid,))
             conn.commit()
+            self.forget_roles(tid)
             return cur.rowcount > 0
         finally:
-            conn.close()
+            self._put(conn)
 
     def get_bound_admins(self) -> list:
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(f"SELECT * FROM {TBL_USERS} WHERE role='admin' ORDER BY first_seen")
+            cur.execute(f"SELECT * FROM {self.tbl_users} WHERE role='admin' ORDER BY first_seen")
             return cur.fetchall()
         finally:
-            conn.close()
+            self._put(conn)
 
     def get_admin_count(self) -> int:
         conn = self._conn()
         try:
             cur = conn.cursor()
-            cur.execute(f"SELECT COUNT(*) FROM {TBL_USERS} WHERE role='admin'")
+            cur.execute(f"SELECT COUNT(*) FROM {self.tbl_users} WHERE role='admin'")
             return cur.fetchone()[0]
         finally:
-            conn.close()
+            self._put(conn)
+
+    # ---- 多副本 leader 租约 ----
+    def try_acquire_lease(self, name: str, holder: str, ttl: int) -> bool:
+        """抢占或续期租约：租约空闲、已过期或本来就是自己持有时成功"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"INSERT INTO {self.tbl_lease} (name, holder, expires_at) "
+                "VALUES (%s, %s, NOW() + make_interval(secs => %s)) "
+                "ON CONFLICT(name) DO UPDATE SET holder=EXCLUDED.holder, expires_at=EXCLUDED.expires_at "
+                f"WHERE {self.tbl_lease}.holder=EXCLUDED.holder OR {self.tbl_lease}.expires_at < NOW() "
+                "RETURNING holder",
+                (name, holder, ttl)
+            )
+            ok = cur.fetchone() is not None
+            conn.commit()
+            return ok
+        finally:
+            self._put(conn)
+
+    def release_lease(self, name: str, holder: str):
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"DELETE FROM {self.tbl_lease} WHERE name=%s AND holder=%s", (name, holder))
+            conn.commit()
+        finally:
+            self._put(conn)
+
+    # ---- 实时面板订阅 ----
+    def get_live_viewers(self) -> dict:
+        """chat_id -> 面板消息 ID"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SELECT chat_id, message_id FROM {self.tbl_live}")
+            return dict(cur.fetchall())
+        finally:
+            self._put(conn)
+
+    def set_live_viewer(self, chat_id: int, message_id: int) -> int | None:
+        """订阅 / 替换该会话的面板消息，返回之前的消息 ID"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SELECT message_id FROM {self.tbl_live} WHERE chat_id=%s", (chat_id,))
+            row = cur.fetchone()
+            cur.execute(
+                f"INSERT INTO {self.tbl_live} (chat_id, message_id) VALUES (%s, %s) "
+                "ON CONFLICT(chat_id) DO UPDATE SET message_id=EXCLUDED.message_id",
+                (chat_id, message_id)
+            )
+            conn.commit()
+            return row[0] if row else None
+        finally:
+            self._put(conn)
+
+    def delete_live_viewer(self, chat_id: int, message_id: int = None) -> int | None:
+        """取消订阅，返回被删除的消息 ID；给了 message_id 时只在仍是这条消息时删除"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SELECT message_id FROM {self.tbl_live} WHERE chat_id=%s", (chat_id,))
+            row = cur.fetchone()
+            if row is None or (message_id is not None and row[0] != message_id):
+                return None
+            cur.execute(f"DELETE FROM {self.tbl_live} WHERE chat_id=%s AND message_id=%s", (chat_id, row[0]))
+            conn.commit()
+            return row[0]
+        finally:
+            self._put(conn)
+
+    # ---- 到期提醒 ----
+    def get_code_holders(self) -> dict:
+        """已出库且有具体持码人的码：code -> telegram_id"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            self._execute(cur, 'code_holders')
+            return dict(cur.fetchall())
+        finally:
+            self._put(conn)
+
+    def get_sent_notices(self, keep_days: int = 7) -> set:
+        """已发送过的提醒 (code, expires_at, offset_min)，顺带清理过旧的记录"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"DELETE FROM {self.tbl_notices} WHERE sent_at < NOW() - make_interval(days => %s)",
+                (keep_days,)
+            )
+            cur.execute(f"SELECT code, expires_at, offset_min FROM {self.tbl_notices}")
+            rows = {tuple(r) for r in cur.fetchall()}
+            conn.commit()
+            return rows
+        finally:
+            self._put(conn)
+
+    def record_notices(self, keys: list):
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            self._bulk_insert(
+                cur,
+                f"INSERT INTO {self.tbl_notices} (code, expires_at, offset_min) VALUES %s ON CONFLICT DO NOTHING",
+                keys,
+            )
+            conn.commit()
+        finally:
+            self._put(conn)
+
+    # ---- 事件日志 ----
+    def insert_events(self, rows: list):
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            self._bulk_insert(
+                cur,
+                f"INSERT INTO {self.tbl_events} (ts, event, code, user_id, actor_id, detail) VALUES %s",
+                rows,
+            )
+            conn.commit()
+        finally:
+            self._put(conn)
+
+    def get_events(self, code: str = None, user_id: int = None, since: datetime = None,
+                   until: datetime = None, limit: int = 100) -> list:
+        """按码 / 用户 / 时间范围查事件，新的在前"""
+        where, params = [], []
+        if code:
+            where.append('code=%s')
+            params.append(code.upper())
+        if user_id is not None:
+            where.append('user_id=%s')
+            params.append(user_id)
+        if since:
+            where.append('ts >= %s')
+            params.append(since)
+        if until:
+            where.append('ts < %s')
+            params.append(until)
+        sql = f"SELECT * FROM {self.tbl_events}"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ts DESC, id DESC LIMIT %s'
+        conn = self._conn()
+        try:
+            cur = self._cur(conn)
+            cur.execute(sql, params + [limit])
+            return cur.fetchall()
+        finally:
+            self._put(conn)
+
+    # ---- 使用统计（全部在 SQL 里聚合，只取回几行结果） ----
+    def usage_report(self, since: datetime, top: int = 10) -> dict:
+        ev = self.tbl_events
+        conn = self._conn()
+        try:
+            cur = self._cur(conn)
+            # 各用户领取数
+            cur.execute(
+                f"SELECT e.user_id, COUNT(*) AS n, u.first_name, u.username FROM {ev} e "
+                f"LEFT JOIN {self.tbl_users} u ON u.telegram_id = e.user_id "
+                "WHERE e.event='claimed' AND e.ts >= %s "
+                "GROUP BY e.user_id, u.first_name, u.username ORDER BY n DESC LIMIT %s",
+                (since, top)
+            )
+            claims = cur.fetchall()
+            # 领取 → 首次开房
+            cur.execute(
+                f"SELECT COUNT(*) AS claimed, COUNT(f.ts) AS used, "
+                "AVG(EXTRACT(EPOCH FROM f.ts - c.ts)) AS avg_s, "
+                "percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM f.ts - c.ts)) AS p50_s "
+                f"FROM {ev} c LEFT JOIN LATERAL ("
+                f"  SELECT ts FROM {ev} f WHERE f.code=c.code AND f.event='first_used' AND f.ts >= c.ts "
+                "  ORDER BY f.ts LIMIT 1"
+                ") f ON true WHERE c.event='claimed' AND c.ts >= %s",
+                (since,)
+            )
+            first_use = cur.fetchone()
+            # 会议时长：每个 session_start 配对其后第一个结束事件
+            cur.execute(
+                f"SELECT COUNT(*) AS sessions, AVG(EXTRACT(EPOCH FROM e.ts - s.ts)) AS avg_s, "
+                "COUNT(DISTINCT s.code) AS codes "
+                f"FROM {ev} s JOIN LATERAL ("
+                f"  SELECT ts FROM {ev} e WHERE e.code=s.code AND e.ts > s.ts "
+                "  AND e.event IN ('session_end', 'force_ended', 'expired') ORDER BY e.ts LIMIT 1"
+                ") e ON true WHERE s.event='session_start' AND s.ts >= %s",
+                (since,)
+            )
+            sessions = cur.fetchone()
+            # 期间到期的码（first_used 的 detail 记录了 expires_at），以及其中到期时不在会议中的
+            cur.execute(
+                f"WITH fu AS ("
+                f"  SELECT DISTINCT code, CASE WHEN event='first_used' THEN detail::timestamptz END AS exp FROM {ev} "
+                "  WHERE event='first_used' AND detail <> '' AND ts >= %s - make_interval(mins => %s)"
+                ") SELECT COUNT(*) AS expired, "
+                f"COUNT(*) FILTER (WHERE NOT EXISTS (SELECT 1 FROM {ev} x WHERE x.code=fu.code "
+                "  AND x.event='expired' AND x.ts >= fu.exp)) AS expired_idle "
+                "FROM fu WHERE exp >= %s AND exp < NOW()",
+                (since, AUTH_CODE_EXPIRES, since)
+            )
+            expiry = cur.fetchone()
+            # 库存
+            # 已归档的码也算出库
+            cur.execute(
+                f"SELECT COUNT(*) + (SELECT COUNT(*) FROM {self.tbl_archive}) AS total, "
+                f"COUNT(*) FILTER (WHERE status='assigned') + (SELECT COUNT(*) FROM {self.tbl_archive}) AS assigned "
+                f"FROM {self.tbl_codes}"
+            )
+            pool = cur.fetchone()
+            return {'claims': claims, 'first_use': first_use, 'sessions': sessions,
+                    'expiry': expiry, 'pool': pool}
+        finally:
+            self._put(conn)
+
+    # ---- 迁移 ----
+    def copy_rows(self, table: str, cols: list, rows: list):
+        """迁移工具用：按原主键原样写入，已存在的跳过"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            self._bulk_insert(cur, f"INSERT INTO {table} ({', '.join(cols)}) VALUES %s ON CONFLICT DO NOTHING", rows)
+            conn.commit()
+        finally:
+            self._put(conn)
+
+    def reset_sequences(self):
+        """带主键写入后把自增序列推到当前最大值"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            for table, col in ((self.tbl_codes, 'pool_id'), (self.tbl_events, 'id')):
+                top = f"(SELECT MAX({col}) FROM {table})"
+                if table == self.tbl_codes:
+                    # 归档表沿用原 pool_id，不能再分配出去
+                    top = f"GREATEST({top}, (SELECT MAX(pool_id) FROM {self.tbl_archive}))"
+                cur.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', '{col}'), "
+                    f"COALESCE({top}, 0) + 1, false)"
+                )
+            conn.commit()
+        finally:
+            self._put(conn)
+
+    def ping(self):
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.fetchone()
+        finally:
+            self._put(conn)
+
+    def pool_usage(self) -> tuple | None:
+        """连接池 (已借出, 上限)；池还没建时为 None"""
+        if _pool is None:
+            return None
+        return len(_pool._used), _pool.maxconn
 
     def get_user_info(self, tid):
         if not tid:
@@ -358,13 +1141,419 @@ class DB:
         conn = self._conn()
         try:
             cur = self._cur(conn)
-            cur.execute(f"SELECT * FROM {TBL_USERS} WHERE telegram_id=%s", (tid,))
+            cur.execute(f"SELECT * FROM {self.tbl_users} WHERE telegram_id=%s", (tid,))
             return cur.fetchone()
         finally:
-            conn.close()
+            self._put(conn)
+
+    def get_assigned_codes(self) -> set:
+        conn = self._conn()
+        try:
+            cur = self._cur(conn)
+            self._execute(cur, 'assigned_codes')
+            return {r['code'] for r in cur.fetchall()}
+        finally:
+            self._put(conn)
+
+    def get_assigned_rows(self, uid: int, all_users: bool = False) -> list:
+        """已出库的码 + 持码人信息；all_users=True（root）时返回全部"""
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            if all_users:
+                self._execute(cur, 'assigned_rows_all')
+            else:
+                self._execute(cur, 'assigned_rows', (uid,))
+            return [PoolRow._make(r) for r in cur.fetchall()]
+        finally:
+            self._put(conn)
+
+    def _export_sql(self, status: str = None, after_id: bool = False) -> tuple:
+        """整张库存表 + 持码人，按 pool_id 排序；status 为 available / assigned 时只取该状态，archived 时读归档表"""
+        where, params = [], []
+        table = self.tbl_archive if status == 'archived' else self.tbl_codes
+        if status and status != 'archived':
+            where.append('acp.status=%s')
+            params.append(status)
+        if after_id:
+            where.append('acp.pool_id > %s')
+        sql = (
+            f"SELECT {', '.join(f'acp.{c}' for c in _POOL_COLS)}, u.first_name, u.username "
+            f"FROM {table} acp LEFT JOIN {self.tbl_users} u ON acp.assigned_to = u.telegram_id"
+        )
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return sql + ' ORDER BY acp.pool_id', params
+
+    def iter_pool(self, status: str = None, batch: int = EXPORT_BATCH):
+        """逐行产出 PoolRow：服务端命名游标每次只取 batch 行，表多大内存都不变
+
+        生成器存活期间占用一个连接（一个只读事务），用完或中途丢弃时归还。
+        """
+        sql, params = self._export_sql(status)
+        conn = self._conn()
+        try:
+            with conn.cursor(name=f'export_{self.instance}') as cur:
+                cur.itersize = batch
+                cur.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(batch)
+                    if not rows:
+                        break
+                    for r in rows:
+                        yield PoolRow._make(r)
+        finally:
+            self._put(conn)
+
+
+# ============================================================
+#  本地数据库 (SQLite，单机部署)
+# ============================================================
+def _sqlite_param(v):
+    """时间统一存成 UTC ISO 字符串，字符串比较即时间比较"""
+    if isinstance(v, datetime):
+        if v.tzinfo is not None:
+            v = v.astimezone(timezone.utc)
+        return v.isoformat(' ', timespec='microseconds')
+    return v
+
+
+sqlite3.register_converter('TIMESTAMPTZ', lambda b: datetime.fromisoformat(b.decode()))
+
+
+class _SqliteCursor:
+    """让 DB 里的 %s 占位 SQL 原样跑在 sqlite3 上"""
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    def execute(self, sql: str, params=()):
+        self._cur.execute(sql.replace('%s', '?'), [_sqlite_param(v) for v in params])
+        return self
+
+    def executemany(self, sql: str, rows):
+        self._cur.executemany(sql.replace('%s', '?'), ([_sqlite_param(v) for v in r] for r in rows))
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+class _SqliteConn:
+    def __init__(self, raw: sqlite3.Connection):
+        self.raw = raw
+
+    def cursor(self, dict_rows: bool = False):
+        cur = self.raw.cursor()
+        if dict_rows:
+            cur.row_factory = lambda c, row: {d[0]: v for d, v in zip(c.description, row)}
+        return _SqliteCursor(cur)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+
+_sqlite_conns = {}
+_sqlite_lock = threading.RLock()
+
+
+def _sqlite_conn(path: str) -> _SqliteConn:
+    """每个文件一个进程内共享连接（WAL），由 _sqlite_lock 串行化访问"""
+    with _sqlite_lock:
+        conn = _sqlite_conns.get(path)
+        if conn is None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            raw = sqlite3.connect(path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+            raw.execute('PRAGMA journal_mode=WAL')
+            raw.execute('PRAGMA synchronous=NORMAL')
+            raw.execute('PRAGMA busy_timeout=5000')
+            conn = _sqlite_conns[path] = _SqliteConn(raw)
+        return conn
+
+
+class SqliteDB(DB):
+    """嵌入式 SQLite 后端：同一个文件里按实例名分表，表结构与 PostgreSQL 一致
+
+    查询在本进程内完成（亚毫秒级），直接在调用线程里执行，访问由一把锁串行化；
+    领取仍是单条 UPDATE ... RETURNING，同一文件被多个进程打开时也是原子的。
+    """
+
+    _SKIP_LOCKED = ''
+
+    def __init__(self, instance: str = BOT_INSTANCE, owner_id: int = OWNER_ID, path: str = SQLITE_PATH):
+        super().__init__(instance, owner_id)
+        self.path = path
+
+    def _conn(self):
+        _sqlite_lock.acquire()
+        try:
+            return _sqlite_conn(self.path)
+        except Exception:
+            _sqlite_lock.release()
+            raise
+
+    def _put(self, conn):
+        try:
+            if conn.raw.in_transaction:
+                conn.raw.rollback()
+        finally:
+            _sqlite_lock.release()
+
+    def _cur(self, conn):
+        return conn.cursor(dict_rows=True)
+
+    def _execute(self, cur, name: str, params=()):
+        # sqlite3 模块自带语句缓存，$n 换成 ?n 直接执行
+        cur.execute(re.sub(r'\$(\d+)', r'?\1', self._sql[name]), params)
+
+    def _bulk_insert(self, cur, sql: str, rows: list):
+        if rows:
+            cur.executemany(sql.replace('VALUES %s', f"VALUES ({', '.join(['?'] * len(rows[0]))})"), rows)
+
+    def init_schema(self):
+        conn = self._conn()
+        try:
+            conn.raw.executescript(f"""
+                CREATE TABLE IF NOT EXISTS {self.tbl_users} (
+                    telegram_id INTEGER PRIMARY KEY,
+                    username    TEXT,
+                    first_name  TEXT,
+                    first_seen  TEXT NOT NULL,
+                    role        TEXT DEFAULT NULL
+                );
+                CREATE TABLE IF NOT EXISTS {self.tbl_codes} (
+                    pool_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+                    code        TEXT UNIQUE NOT NULL,
+                    status      TEXT NOT NULL DEFAULT 'available',
+                    assigned_to INTEGER,
+                    assigned_at TEXT,
+                    note        TEXT DEFAULT '',
+                    added_at    TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+                );
+                CREATE TABLE IF NOT EXISTS {self.tbl_archive} (
+                    pool_id     INTEGER PRIMARY KEY,
+                    code        TEXT UNIQUE NOT NULL,
+                    status      TEXT NOT NULL DEFAULT 'archived',
+                    assigned_to INTEGER,
+                    assigned_at TEXT,
+                    note        TEXT DEFAULT '',
+                    added_at    TEXT NOT NULL,
+                    expires_at  TEXT,
+                    archived_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS {self.tbl_archive}_user_idx ON {self.tbl_archive} (assigned_to);
+                CREATE TABLE IF NOT EXISTS {self.tbl_lease} (
+                    name        TEXT PRIMARY KEY,
+                    holder      TEXT NOT NULL,
+                    expires_at  TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS {self.tbl_live} (
+                    chat_id     INTEGER PRIMARY KEY,
+                    message_id  INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS {self.tbl_notices} (
+                    code        TEXT NOT NULL,
+                    expires_at  TEXT NOT NULL,
+                    offset_min  INTEGER NOT NULL,
+                    sent_at     TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f+00:00', 'now')),
+                    PRIMARY KEY (code, expires_at, offset_min)
+                );
+                CREATE TABLE IF NOT EXISTS {self.tbl_events} (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts          TIMESTAMPTZ NOT NULL,
+                    event       TEXT NOT NULL,
+                    code        TEXT NOT NULL,
+                    user_id     INTEGER,
+                    actor_id    INTEGER,
+                    detail      TEXT DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS {self.tbl_events}_ts_idx ON {self.tbl_events} (ts);
+                CREATE INDEX IF NOT EXISTS {self.tbl_events}_code_idx ON {self.tbl_events} (code, ts);
+                CREATE INDEX IF NOT EXISTS {self.tbl_events}_user_idx ON {self.tbl_events} (user_id, ts);
+                CREATE INDEX IF NOT EXISTS {self.tbl_events}_event_idx ON {self.tbl_events} (event, ts);
+                -- 已出库码按领取时间：自动回收、库存预测都按 assigned_at 范围查
+                CREATE INDEX IF NOT EXISTS {self.tbl_codes}_assigned_idx ON {self.tbl_codes} (assigned_at) WHERE status='assigned';
+            """)
+            if self.owner_id:
+                conn.cursor().execute(
+                    f"INSERT INTO {self.tbl_users} (telegram_id, username, first_name, first_seen, role) "
+                    "VALUES (%s, '', 'ROOT', %s, 'root') "
+                    "ON CONFLICT(telegram_id) DO UPDATE SET role='root'",
+                    (self.owner_id, datetime.now().isoformat())
+                )
+            conn.commit()
+        finally:
+            self._put(conn)
+
+    def release_code(self, pool_id: int, operator_id: int) -> bool:
+        # SQLite 的 RETURNING 拿不到 UPDATE ... FROM 里的旧值，先查后改（同一把锁内）
+        conn = self._conn()
+        try:
+            cur = self._cur(conn)
+            sql = f"SELECT code, assigned_to FROM {self.tbl_codes} WHERE pool_id=%s AND status='assigned'"
+            if operator_id == self.owner_id:
+                cur.execute(sql, (pool_id,))
+            else:
+                cur.execute(sql + " AND assigned_to=%s", (pool_id, operator_id))
+            row = cur.fetchone()
+            if row:
+                cur.execute(
+                    f"UPDATE {self.tbl_codes} SET status='available', assigned_to=NULL, assigned_at=NULL "
+                    "WHERE pool_id=%s",
+                    (pool_id,)
+                )
+                conn.commit()
+                self.events.emit('released', row['code'], user_id=row['assigned_to'], actor_id=operator_id)
+            return row is not None
+        finally:
+            self._put(conn)
+
+    def try_acquire_lease(self, name: str, holder: str, ttl: int) -> bool:
+        now = datetime.now(timezone.utc)
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"INSERT INTO {self.tbl_lease} (name, holder, expires_at) VALUES (%s, %s, %s) "
+                "ON CONFLICT(name) DO UPDATE SET holder=EXCLUDED.holder, expires_at=EXCLUDED.expires_at "
+                f"WHERE {self.tbl_lease}.holder=EXCLUDED.holder OR {self.tbl_lease}.expires_at < %s "
+                "RETURNING holder",
+                (name, holder, now + timedelta(seconds=ttl), now)
+            )
+            ok = cur.fetchone() is not None
+            conn.commit()
+            return ok
+        finally:
+            self._put(conn)
+
+    def reset_sequences(self):
+        # AUTOINCREMENT 自动取 MAX(rowid) 之后的值；归档表沿用原 pool_id，也要跳过
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(f"SELECT MAX(pool_id) FROM {self.tbl_archive}")
+            top = cur.fetchone()[0]
+            cur.execute("SELECT seq FROM sqlite_sequence WHERE name=%s", (self.tbl_codes,))
+            row = cur.fetchone()
+            if top is not None and (row is None or row[0] < top):
+                cur.execute("DELETE FROM sqlite_sequence WHERE name=%s", (self.tbl_codes,))
+                cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", (self.tbl_codes, top))
+            conn.commit()
+        finally:
+            self._put(conn)
+
+    def pool_usage(self) -> tuple | None:
+        # 进程内一个共享连接，没有连接池
+        return None
+
+    def iter_pool(self, status: str = None, batch: int = EXPORT_BATCH):
+        # 连接是进程内共享的，不能整个导出期间占着锁：按 pool_id 分批（keyset），每批之间放开
+        sql, params = self._export_sql(status, after_id=True)
+        sql += ' LIMIT %s'
+        last = 0
+        while True:
+            conn = self._conn()
+            try:
+                cur = conn.cursor()
+                cur.execute(sql, params + [last, batch])
+                rows = cur.fetchall()
+            finally:
+                self._put(conn)
+            for r in rows:
+                yield PoolRow._make(r)
+            if len(rows) < batch:
+                break
+            last = rows[-1][0]
+
+    def get_sent_notices(self, keep_days: int = 7) -> set:
+        conn = self._conn()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                f"DELETE FROM {self.tbl_notices} WHERE sent_at < %s",
+                (datetime.now(timezone.utc) - timedelta(days=keep_days),)
+            )
+            cur.execute(f"SELECT code, expires_at, offset_min FROM {self.tbl_notices}")
+            rows = {tuple(r) for r in cur.fetchall()}
+            conn.commit()
+            return rows
+        finally:
+            self._put(conn)
+
+    def usage_report(self, since: datetime, top: int = 10) -> dict:
+        """与 PostgreSQL 版口径相同；没有 LATERAL / percentile_cont，改用相关子查询和窗口函数"""
+        ev = self.tbl_events
+        secs = "(julianday({}) - julianday({})) * 86400"
+        conn = self._conn()
+        try:
+            cur = self._cur(conn)
+            cur.execute(
+                f"SELECT e.user_id, COUNT(*) AS n, u.first_name, u.username FROM {ev} e "
+                f"LEFT JOIN {self.tbl_users} u ON u.telegram_id = e.user_id "
+                "WHERE e.event='claimed' AND e.ts >= %s "
+                "GROUP BY e.user_id, u.first_name, u.username ORDER BY n DESC LIMIT %s",
+                (since, top)
+            )
+            claims = cur.fetchall()
+            cur.execute(
+                f"WITH d AS ("
+                f"  SELECT (SELECT MIN(f.ts) FROM {ev} f WHERE f.code=c.code AND f.event='first_used' "
+                "    AND f.ts >= c.ts) AS fts, c.ts AS cts "
+                f"  FROM {ev} c WHERE c.event='claimed' AND c.ts >= %s"
+                f"), s AS (SELECT {secs.format('fts', 'cts')} AS v FROM d WHERE fts IS NOT NULL), "
+                "r AS (SELECT v, ROW_NUMBER() OVER (ORDER BY v) AS i, COUNT(*) OVER () AS n FROM s) "
+                "SELECT (SELECT COUNT(*) FROM d) AS claimed, (SELECT COUNT(*) FROM s) AS used, "
+                "(SELECT AVG(v) FROM s) AS avg_s, "
+                "(SELECT AVG(v) FROM r WHERE i IN ((n + 1) / 2, (n + 2) / 2)) AS p50_s",
+                (since,)
+            )
+            first_use = cur.fetchone()
+            cur.execute(
+                f"WITH p AS ("
+                f"  SELECT s.code, s.ts AS sts, (SELECT MIN(e.ts) FROM {ev} e WHERE e.code=s.code AND e.ts > s.ts "
+                "    AND e.event IN ('session_end', 'force_ended', 'expired')) AS ets "
+                f"  FROM {ev} s WHERE s.event='session_start' AND s.ts >= %s"
+                f") SELECT COUNT(*) AS sessions, AVG({secs.format('ets', 'sts')}) AS avg_s, "
+                "COUNT(DISTINCT code) AS codes FROM p WHERE ets IS NOT NULL",
+                (since,)
+            )
+            sessions = cur.fetchone()
+            cur.execute(
+                f"WITH fu AS ("
+                f"  SELECT DISTINCT code, julianday(detail) AS exp FROM {ev} "
+                "  WHERE event='first_used' AND detail <> '' AND ts >= %s"
+                ") SELECT COUNT(*) AS expired, "
+                f"COUNT(*) FILTER (WHERE NOT EXISTS (SELECT 1 FROM {ev} x WHERE x.code=fu.code "
+                "  AND x.event='expired' AND julianday(x.ts) >= fu.exp)) AS expired_idle "
+                "FROM fu WHERE exp >= julianday(%s) AND exp < julianday('now')",
+                (since - timedelta(minutes=AUTH_CODE_EXPIRES), since)
+            )
+            expiry = cur.fetchone()
+            # 已归档的码也算出库
+            cur.execute(
+                f"SELECT COUNT(*) + (SELECT COUNT(*) FROM {self.tbl_archive}) AS total, "
+                f"COUNT(*) FILTER (WHERE status='assigned') + (SELECT COUNT(*) FROM {self.tbl_archive}) AS assigned "
+                f"FROM {self.tbl_codes}"
+            )
+            pool = cur.fetchone()
+            return {'claims': claims, 'first_use': first_use, 'sessions': sessions,
+                    'expiry': expiry, 'pool': pool}
+        finally:
+            self._put(conn)
 
 
-db = DB()
+def open_db(instance: str = BOT_INSTANCE, owner_id: int = OWNER_ID, backend: str = None) -> DB:
+    """按 DB_BACKEND 打开存储后端"""
+    backend = backend or DB_BACKEND
+    if backend == 'sqlite':
+        return SqliteDB(instance, owner_id)
+    if backend == 'postgres':
+        return DB(instance, owner_id)
+    raise ValueError(f'未知的 DB_BACKEND: {backend}')
+
 
 # 45个预置授权码，每次启动时检查并补入（部署不会丢失）
 _PRESET_CODES = [
@@ -398,7 +1587,57 @@ _EXTERNAL_CODES = {
     '5H6QLY8X': 5719382437,
     'PAPQEJR4': 5719382437,
 }
-def seed_codes():
+class EventLog:
+    """码生命周期事件的缓冲写入器
+
+    除 added / claimed / released / force_ended / expired / deleted 外，
+    UsageTracker 还会根据快照变化写入 first_used / session_start / session_end，供 /admin report 统计。
+
+    emit() 只往内存缓冲里追加一条，不碰数据库，处理器不会因此多等；
+    flush() 由定时任务每 EVENT_FLUSH_INTERVAL 秒调用一次，整批 INSERT。
+    写库失败时保留缓冲下次重试，超过 EVENT_BUFFER_MAX 条时丢弃最旧的并告警。
+    emit() 也会在 to_thread 的后台线程里调用，缓冲的追加 / 截断 / 换批都在 _lock 下进行。
+    """
+
+    def __init__(self, db: 'DB', max_buffer: int = EVENT_BUFFER_MAX):
+        self.db = db
+        self.max_buffer = max_buffer
+        self._buf = []
+        self._lock = threading.Lock()
+        self.listeners = []  # 每条事件调用 listener(event)，如实时面板据此判断库存变化
+
+    def emit(self, event: str, code: str, user_id: int = None, actor_id: int = None, detail: str = '',
+             ts: datetime = None):
+        drop = 0
+        with self._lock:
+            self._buf.append((ts or datetime.now(timezone.utc), event, code, user_id, actor_id, detail or ''))
+            if len(self._buf) > self.max_buffer:
+                drop = len(self._buf) - self.max_buffer
+                del self._buf[:drop]
+        for listener in self.listeners:
+            listener(event)
+        if drop:
+            logger.warning(f'[{self.db.instance}] 事件缓冲已满，丢弃最旧的 {drop} 条')
+
+    def flush(self):
+        with self._lock:
+            if not self._buf:
+                return
+            batch, self._buf = self._buf, []
+        try:
+            self.db.insert_events(batch)
+        except Exception as e:
+            with self._lock:
+                # 写库期间新进来的事件排在这批后面
+                self._buf[:0] = batch
+                pending = len(self._buf)
+            logger.warning(f'[{self.db.instance}] 事件日志写入失败，{pending} 条待重试: {e}')
+
+    async def flush_job(self, context=None):
+        self.flush()
+
+
+def seed_codes(db: DB):
     added = 0
     for code in _PRESET_CODES:
         if db.add_code(code, note='预置码'):
@@ -412,65 +1651,1098 @@ def seed_codes():
         # 标记已发出的码
         for code in _ISSUED_CODES:
             cur.execute(
-                f"UPDATE {TBL_CODES} SET status='assigned', assigned_to=0, "
+                f"UPDATE {db.tbl_codes} SET status='assigned', assigned_to=0, "
                 "assigned_at=COALESCE(assigned_at, %s) WHERE code=%s AND status='available'",
                 (now_str, code)
             )
         # 导入外部码
         for code, uid in _EXTERNAL_CODES.items():
             cur.execute(
-                f"INSERT INTO {TBL_USERS}(telegram_id, username, first_name, first_seen, role) "
+                f"INSERT INTO {db.tbl_users}(telegram_id, username, first_name, first_seen, role) "
                 "VALUES(%s, '', %s, %s, 'admin') ON CONFLICT DO NOTHING",
                 (uid, f'用户{uid}', now_str)
             )
             cur.execute(
-                f"INSERT INTO {TBL_CODES}(code, status, assigned_to, assigned_at) "
-                "VALUES(%s, 'assigned', %s, %s) ON CONFLICT DO NOTHING",
-                (code, uid, now_str)
+                f"INSERT INTO {db.tbl_codes}(code, status, assigned_to, assigned_at) "
+                f"SELECT %s, 'assigned', %s, %s WHERE NOT EXISTS (SELECT 1 FROM {db.tbl_archive} WHERE code=%s) "
+                "ON CONFLICT DO NOTHING",
+                (code, uid, now_str, code)
             )
         conn.commit()
+        db.forget_roles()
     finally:
-        conn.close()
-seed_codes()
+        db._put(conn)
 
 
-async def api_get_all_codes_status() -> dict:
-    """一次性拉取所有授权码实时状态，返回以 code 为 key 的 dict"""
+# ============================================================
+#  多副本 leader 选举（基于数据库租约行）
+# ============================================================
+class LeaderElector:
+    """同一 BOT_INSTANCE 的多个副本通过租约表中的一行选出唯一 leader。
+
+    leader 每 ttl/3 秒续期一次；进程挂掉后租约最多 ttl 秒过期，其他副本自动接管。
+    续期失败（包括数据库异常）时本地立即视为失去 leader，宁可短暂无人执行也不双跑。
+    用户交互处理器不受影响，所有副本都正常响应。
+    """
+
+    def __init__(self, tenant: 'Tenant', name: str = 'scheduler', holder: str = REPLICA_ID,
+                 ttl: int = LEADER_LEASE_SECONDS):
+        self.tenant = tenant
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self._valid_until = 0.0
+        self._was_leader = False
+        # 每次（重新）成为 leader 加一；本地缓存了 leader 状态的任务据此判断期间是否换过人
+        self.term = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    async def tick(self, context=None):
+        """定时任务：抢占 / 续期租约，并在成为 leader 时执行一次性工作"""
+        started = time.monotonic()
+        try:
+            ok = self.tenant.db.try_acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            logger.warning(f'leader 租约续期失败: {e}')
+            ok = False
+        # 以发起请求的时刻计算有效期，留出 1 秒余量
+        self._valid_until = started + self.ttl - 1 if ok else 0.0
+        if ok and not self._was_leader:
+            self.term += 1
+            logger.info(f'[{self.tenant.instance}] 成为 leader: {self.holder}')
+            if self.tenant.seed:
+                try:
+                    await asyncio.to_thread(seed_codes, self.tenant.db)
+                except Exception as e:
+                    logger.error(f'预置码写入失败: {e}')
+        elif not ok and self._was_leader:
+            logger.warning(f'[{self.tenant.instance}] 失去 leader: {self.holder}')
+        self._was_leader = ok
+
+    def resign(self):
+        """退出时主动释放租约，其他副本无需等待过期即可接管"""
+        if not self._was_leader:
+            return
+        self._valid_until = 0.0
+        self._was_leader = False
+        try:
+            self.tenant.db.release_lease(self.name, self.holder)
+            logger.info(f'已释放 leader 租约: {self.holder}')
+        except Exception as e:
+            logger.warning(f'释放 leader 租约失败: {e}')
+
+
+# ============================================================
+#  租户（一个克隆机器人 = token + owner + admins + 实例表）
+# ============================================================
+_INSTANCE_RE = re.compile(r'^[a-z0-9_]+$')
+
+
+def _instance_name(raw: str) -> str:
+    name = str(raw).strip().lower().replace('-', '_')
+    if not _INSTANCE_RE.match(name):
+        raise ValueError(f'非法的实例名: {raw!r}')
+    return name
+
+
+class Tenant:
+    def __init__(self, token: str, owner_id: int, admin_ids=(), instance: str = BOT_INSTANCE, seed: bool = False):
+        self.token = token
+        self.owner_id = owner_id
+        self.admin_ids = set(admin_ids) | {owner_id}
+        self.instance = instance
+        self.seed = seed
+        self.db = open_db(instance, owner_id)
+        self.leader = LeaderElector(self)
+        self.notifier = ExpiryNotifier(self)
+        self.forecast = StockForecast(self)
+        self.limiter = ClaimLimiter()
+        self.reclaimer = Reclaimer(self)
+        self.archiver = Archiver(self)
+        self.live = LiveDashboard(self)
+        self.usage = UsageTracker(self)
+        status_snapshot.listeners.append(self.usage)
+
+
+def load_tenants() -> list:
+    """设置了 BOTS_CONFIG 时从 JSON 文件加载多个机器人，否则按环境变量只跑一个
+
+    BOTS_CONFIG 格式：
+      [{"token": "...", "owner": 123, "admins": [456], "instance": "bot2", "seed": false}, ...]
+    """
+    if not BOTS_CONFIG:
+        if not BOT_TOKEN:
+            raise RuntimeError('BOT_TOKEN 未设置')
+        return [Tenant(BOT_TOKEN, OWNER_ID, ADMIN_IDS, _instance_name(BOT_INSTANCE), seed=True)]
+    items = json.loads(Path(BOTS_CONFIG).read_text(encoding='utf-8'))
+    tenants, seen = [], set()
+    for item in items:
+        instance = _instance_name(item.get('instance', 'bot1'))
+        if instance in seen:
+            raise ValueError(f'BOTS_CONFIG 中实例名重复: {instance}')
+        seen.add(instance)
+        if not item.get('token'):
+            raise RuntimeError(f'BOTS_CONFIG 中 {instance} 缺少 token')
+        tenants.append(Tenant(
+            token=item['token'],
+            owner_id=int(item.get('owner') or 0),
+            admin_ids={int(x) for x in item.get('admins', [])},
+            instance=instance,
+            seed=bool(item.get('seed', False)),
+        ))
+    if not tenants:
+        raise RuntimeError('BOTS_CONFIG 为空')
+    return tenants
+
+
+# 本进程托管的全部租户，由 main() 填充
+tenants = []
+
+
+def tenant_of(context) -> Tenant:
+    return context.application.bot_data['tenant']
+
+
+class MeetUnavailable(Exception):
+    """Meet API 不可用（熔断中或请求失败）"""
+
+
+class CircuitBreaker:
+    """Meet API 熔断器
+
+    closed：正常放行，连续失败 failures 次后转为 open；
+    open：直接失败不发请求，reset_after 秒后转为 half_open；
+    half_open：只放行一个试探请求，成功则恢复 closed，失败重新 open。
+    """
+
+    def __init__(self, failures: int = MEET_BREAKER_FAILURES, reset_after: float = MEET_BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._count = 0
+        self._opened_at = None
+        self._probe_at = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset_after:
+            return 'open'
+        return 'half_open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'open':
+            return False
+        now = time.monotonic()
+        # 试探请求被取消时不会回调 success/failure，超时后允许再试一次
+        if self._probe_at is not None and now - self._probe_at < self.reset_after:
+            return False
+        self._probe_at = now
+        return True
+
+    def success(self):
+        if self._opened_at is not None:
+            logger.info('Meet API 已恢复，熔断关闭')
+        self._count = 0
+        self._opened_at = None
+        self._probe_at = None
+
+    def failure(self):
+        self._count += 1
+        self._probe_at = None
+        if self._opened_at is not None or self._count >= self.failures:
+            if self._opened_at is None:
+                logger.warning(f'Meet API 连续失败 {self._count} 次，熔断 {self.reset_after:.0f} 秒')
+            self._opened_at = time.monotonic()
+
+
+meet_breaker = CircuitBreaker()
+
+
+_http = None
+
+
+def meet_session() -> aiohttp.ClientSession:
+    """进程内共享的 Meet API 客户端（复用连接）；必须在事件循环内调用"""
+    global _http
+    if _http is None or _http.closed:
+        _http = aiohttp.ClientSession()
+    return _http
+
+
+async def close_meet_session():
+    global _http
+    if _http is not None and not _http.closed:
+        await _http.close()
+    _http = None
+
+
+async def _api_list_page(limit: int, offset: int) -> list:
+    if not meet_breaker.allow():
+        raise MeetUnavailable('熔断中')
+    started = time.monotonic()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f'{MEET_API_URL}/api/admin-code',
-                params={'action': 'list', 'limit': '500'},
-                timeout=aiohttp.ClientTimeout(total=15),
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    codes = data.get('codes', [])
-                    return {c['code']: c for c in codes if c.get('code')}
+        async with meet_session().get(
+            f'{MEET_API_URL}/api/admin-code',
+            params={'action': 'list', 'limit': str(limit), 'offset': str(offset)},
+            timeout=aiohttp.ClientTimeout(total=15),
+        ) as resp:
+            if resp.status != 200:
+                raise MeetUnavailable(f'HTTP {resp.status}')
+            data = await resp.json()
     except Exception as e:
-        logger.debug(f'查询码状态失败: {e}')
-    return {}
+        meet_breaker.failure()
+        logger.warning(f'查询码状态失败: {e}')
+        health.observe('meet', False, time.monotonic() - started, str(e))
+        if isinstance(e, MeetUnavailable):
+            raise
+        raise MeetUnavailable(str(e)) from e
+    meet_breaker.success()
+    # 正常请求的耗时直接作为探测结果，健康检查不必另发请求
+    health.observe('meet', True, time.monotonic() - started)
+    return data.get('codes', [])
+
+
+async def api_iter_codes(page_size: int = MEET_PAGE_SIZE):
+    """分页拉取远程码状态，逐页产出 [detail, ...]；失败或熔断中抛 MeetUnavailable
+
+    服务端若忽略 offset 会重复返回同一页，遇到整页都是已见过的码即停止。
+    """
+    seen, offset = set(), 0
+    while True:
+        page = await _api_list_page(page_size, offset)
+        fresh = [c for c in page if c.get('code') and c['code'] not in seen]
+        if fresh:
+            seen.update(c['code'] for c in fresh)
+            yield fresh
+        if len(page) < page_size or not fresh:
+            return
+        offset += page_size
+
+
+async def api_get_all_codes_status() -> dict:
+    """拉取所有授权码实时状态，返回 code -> CodeStatus；失败或熔断中抛 MeetUnavailable"""
+    result = {}
+    async for page in api_iter_codes():
+        for c in page:
+            result[c['code']] = CodeStatus.from_api(c)
+    return result
+
+
+def _parse_expires(ea) -> datetime | None:
+    """解析远程返回的 expires_at（ISO 字符串，可能以 Z 结尾），无效时返回 None"""
+    if not ea:
+        return None
+    try:
+        return datetime.fromisoformat(str(ea).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+class CodeStatus:
+    """远程码状态的紧凑记录
+
+    每个码一个 __slots__ 对象代替整份 JSON dict；code 做 intern，
+    expires_at 拉取时解析一次存成时间戳 exp_ts（不带时区的按本机时区），视图和定时任务不再重复解析。
+    expires_at 原文保留：到期提醒以它为去重键。仍支持 get() / [] 按 dict 方式读取。
+    """
+
+    __slots__ = ('code', 'in_use', 'bound_room', 'expires_at', 'exp_ts')
+
+    def __init__(self, code: str, in_use=0, bound_room=None, expires_at=None):
+        self.code = sys.intern(code)
+        self.in_use = int(in_use or 0) == 1
+        self.bound_room = bound_room or ''
+        self.expires_at = str(expires_at) if expires_at else ''
+        exp = _parse_expires(expires_at)
+        self.exp_ts = exp.timestamp() if exp is not None else None
+
+    @property
+    def expires(self) -> datetime | None:
+        return datetime.fromtimestamp(self.exp_ts).astimezone() if self.exp_ts is not None else None
+
+    @classmethod
+    def from_api(cls, d: dict) -> 'CodeStatus':
+        return cls(d['code'], d.get('in_use'), d.get('bound_room'), d.get('expires_at'))
+
+    def replace(self, **changes) -> 'CodeStatus':
+        fields = {'in_use': self.in_use, 'bound_room': self.bound_room, 'expires_at': self.expires_at}
+        fields.update(changes)
+        return CodeStatus(self.code, **fields)
+
+    def expired(self, now: float) -> bool:
+        """now 为 time.time()"""
+        return self.exp_ts is not None and self.exp_ts <= now
+
+    def to_list(self) -> list:
+        return [int(self.in_use), self.bound_room, self.expires_at]
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ or key == 'expires' else None
+        if key == 'in_use':
+            return int(value)
+        return default if value in (None, '') else value
+
+    def __getitem__(self, key: str):
+        return self.get(key)
+
+
+# 快照里没有的码
+_NO_STATUS = CodeStatus('')
+
+
+class StatusSnapshot:
+    """远程码状态的进程内共享快照
+
+    Meet 的 /api/admin-code 返回的是全部码，与是哪个克隆机器人无关，
+    因此同一进程内所有租户、所有视图和定时任务共用一份：
+    max_age 秒内直接复用，过期后并发的请求合并成一次远程拉取。
+    拉取失败或熔断中时返回最后一次成功的数据并标记为 stale，
+    从未成功拉取过时才抛 MeetUnavailable —— 绝不拿空数据冒充「全部空闲」。
+    """
+
+    def __init__(self, max_age: float = STATUS_MAX_AGE):
+        self.max_age = max_age
+        self.data = {}
+        self.fetched_at = 0.0
+        self.fetched_wall = None
+        self.stale = False
+        self._dirty = False
+        self._inflight = None
+        self._revalidating = False
+        self.listeners = []
+
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at if self.fetched_at else float('inf')
+
+    async def get(self, max_age: float = None) -> dict:
+        max_age = self.max_age if max_age is None else max_age
+        if self.fetched_at and not self._dirty and self.age() <= max_age:
+            return self.data
+        if self._revalidating and max_age > 0:
+            # 热启动恢复的数据先用着，后台校验完成前不让用户等；标记为旧数据，依赖新鲜数据的任务据此跳过。
+            # 明确要求最新数据（max_age=0）的调用方往下走，与后台校验共用同一次拉取
+            self.stale = True
+            return self.data
+        if self.fetched_at and meet_breaker.state == 'open':
+            # 熔断期间不等待，直接用旧快照
+            self.stale = True
+            return self.data
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+        try:
+            # shield：某个调用方被取消不影响其他等待同一次拉取的调用方
+            return await asyncio.shield(self._inflight)
+        except MeetUnavailable:
+            if not self.fetched_at:
+                raise
+            self.stale = True
+            return self.data
+
+    def restore(self, data: dict, fetched_wall: datetime):
+        """从热启动检查点恢复；立即可读，随后由 revalidate() 在后台刷新"""
+        self.data = data
+        self.fetched_wall = fetched_wall
+        age = max(0.0, (datetime.now() - fetched_wall).total_seconds())
+        self.fetched_at = max(time.monotonic() - age, 1e-6)
+        self._revalidating = True
+
+    async def revalidate(self):
+        """重新拉取一次；冷启动时即首次拉取"""
+        try:
+            if self._inflight is None:
+                self._inflight = asyncio.ensure_future(self._refresh())
+            await asyncio.shield(self._inflight)
+        except MeetUnavailable:
+            if not self.fetched_at:
+                raise
+            self.stale = True
+        finally:
+            self._revalidating = False
+
+    def invalidate(self):
+        """释放等操作改变了远程状态后调用，下一次读取会重新拉取"""
+        self._dirty = True
+
+    def apply(self, code: str, **changes):
+        """把本地已确认的远程变更（如结束会议）直接写进快照，省去一次全量拉取"""
+        if code in self.data:
+            self.data[code] = self.data[code].replace(**changes)
+
+    def merge(self, details: dict):
+        """把按页补拉到的部分码状态写进快照（不刷新整体时间戳），订阅者同样收到差异"""
+        prev = {c: self.data[c] for c in details if c in self.data}
+        self.data.update(details)
+        if prev:
+            for listener in self.listeners:
+                try:
+                    listener(prev, details)
+                except Exception as e:
+                    logger.error(f'快照订阅者异常: {e}')
+
+    def stale_note(self) -> str:
+        """视图底部的过期提示；数据新鲜时返回空串"""
+        if not self.stale or self.fetched_wall is None:
+            return ''
+        mins = int((datetime.now() - self.fetched_wall).total_seconds() // 60)
+        when = f'{mins} 分钟前' if mins else '刚才'
+        return f'\n\n⚠️ 会议服务暂时无法连接，以下为{when}的数据'
+
+    async def _refresh(self) -> dict:
+        try:
+            data = await api_get_all_codes_status()
+            prev, had_prev = self.data, bool(self.fetched_at)
+            self.data = data
+            if had_prev:
+                # 通知订阅者前后两份快照的差异（第一次拉取没有基线，跳过）
+                for listener in self.listeners:
+                    try:
+                        listener(prev, data)
+                    except Exception as e:
+                        logger.error(f'快照订阅者异常: {e}')
+            self.fetched_at = time.monotonic()
+            self.fetched_wall = datetime.now()
+            self.stale = False
+            self._dirty = False
+            return data
+        finally:
+            self._inflight = None
+
+
+status_snapshot = StatusSnapshot()
+
+
+class StatusLookup:
+    """按码查询远程状态
+
+    快照在 max_age 内直接返回；否则把 LOOKUP_BATCH_WINDOW 内到达的所有查询合并成一批：
+    远程没有按码查询的接口，但快照记着每个码在列表里的位置，
+    一批只补拉涉及到的那几页（并发），结果写回共享快照；
+    从未拉取过、码不在快照里或位置已变时退回一次全量刷新。
+    补拉到的码各自记下拉取时间，max_age 内再查同一个码不再访问远程（快照被置脏时除外）。
+    查询越多，每个码分摊到的远程请求越少。领取成功后核对码的远程状态走这里。
+    """
+
+    def __init__(self, snapshot: StatusSnapshot, window: float = LOOKUP_BATCH_WINDOW,
+                 page_size: int = MEET_PAGE_SIZE):
+        self.snapshot = snapshot
+        self.window = window
+        self.page_size = page_size
+        self._pending = set()
+        self._batch = None
+        self._pos = {}
+        self._pos_at = None
+        # code -> 按页补拉到它的时刻（monotonic）；整体快照的 fetched_at 不因补拉而前移
+        self._fresh = {}
+
+    def _is_fresh(self, code: str, max_age: float) -> bool:
+        fetched = self._fresh.get(code)
+        return fetched is not None and time.monotonic() - fetched <= max_age
+
+    async def get(self, codes, max_age: float = None) -> dict:
+        codes = [c.upper() for c in codes]
+        snap = self.snapshot
+        max_age = snap.max_age if max_age is None else max_age
+        if snap.fetched_at and not snap._dirty and (
+                snap.age() <= max_age or all(self._is_fresh(c, max_age) for c in codes)):
+            return {c: snap.data.get(c, _NO_STATUS) for c in codes}
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+            asyncio.get_running_loop().call_later(self.window, lambda: asyncio.ensure_future(self._flush()))
+        self._pending.update(codes)
+        data = await asyncio.shield(self._batch)
+        return {c: data.get(c, _NO_STATUS) for c in codes}
+
+    def _positions(self) -> dict:
+        snap = self.snapshot
+        if self._pos_at != snap.fetched_at:
+            self._pos = {c: i for i, c in enumerate(snap.data)}
+            self._pos_at = snap.fetched_at
+        return self._pos
+
+    async def _fetch_pages(self, codes: set) -> bool:
+        """只补拉 codes 所在的页；有码找不到时返回 False"""
+        pos = self._positions()
+        offsets = {pos[c] // self.page_size * self.page_size for c in codes}
+        pages = await asyncio.gather(*(_api_list_page(self.page_size, off) for off in sorted(offsets)))
+        found = {c['code']: CodeStatus.from_api(c) for page in pages for c in page if c.get('code') in codes}
+        if len(found) < len(codes):
+            return False
+        self.snapshot.merge(found)
+        now = time.monotonic()
+        self._fresh.update((c, now) for c in found)
+        return True
+
+    async def _flush(self):
+        fut, codes = self._batch, self._pending
+        self._batch, self._pending = None, set()
+        snap = self.snapshot
+        try:
+            pos = self._positions()
+            total_pages = len(snap.data) // self.page_size + 1
+            partial = (
+                snap.fetched_at and meet_breaker.state != 'open' and all(c in pos for c in codes)
+                and len({pos[c] // self.page_size for c in codes}) < total_pages
+            )
+            if not (partial and await self._fetch_pages(codes)):
+                await snap.get(max_age=0)
+            fut.set_result(snap.data)
+        except MeetUnavailable as e:
+            if snap.fetched_at:
+                snap.stale = True
+                fut.set_result(snap.data)
+            else:
+                fut.set_exception(e)
+        except Exception as e:
+            fut.set_exception(e)
+        # 调用方全部被取消时，避免「异常未被读取」的告警
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+status_lookup = StatusLookup(status_snapshot)
+
+
+async def api_get_codes_status(codes, max_age: float = None) -> dict:
+    """批量查询授权码实时状态：code -> CodeStatus（远程没有的码 in_use 为 False、无到期时间）"""
+    return await status_lookup.get(codes, max_age)
 
 
-async def api_get_code_status(code: str) -> dict:
-    """查询单个授权码实时状态（兼容旧调用）"""
-    all_status = await api_get_all_codes_status()
-    return all_status.get(code, {})
+async def api_get_code_status(code: str, max_age: float = None) -> dict:
+    """查询单个授权码实时状态"""
+    return (await status_lookup.get([code], max_age))[code.upper()]
+
+
+async def _claimed_note(code: str) -> str:
+    """领取成功后按码核对远程状态，返回领取消息里的计时提示
+
+    正常的新码远程应当空闲且未开始计时；不一致时如实告诉用户。
+    查询慢或会议服务不可用时不阻塞领取，退回默认提示。
+    """
+    default = '⏰ 第一次开设房间后开始计时'
+    try:
+        # 快照新鲜时直接命中；否则与同一时刻的其他查询合并补拉，最多等 3 秒
+        detail = await asyncio.wait_for(api_get_code_status(code), 3)
+    except (MeetUnavailable, asyncio.TimeoutError):
+        return default
+    if detail is _NO_STATUS:
+        logger.warning(f'领取的码 {code} 在会议服务中不存在')
+        return '⚠️ 会议服务中暂未查到该授权码，如无法使用请联系管理员'
+    if detail.in_use or detail.bound_room:
+        logger.warning(f'领取的码 {code} 远程显示正在使用: {detail.bound_room}')
+        return '⚠️ 该授权码在会议服务中显示正在使用，如无法开房请联系管理员'
+    if detail.exp_ts is not None:
+        if detail.expired(time.time()):
+            return '⚠️ 该授权码在会议服务中已到期，如无法使用请联系管理员'
+        return f'⏰ 已开始计时，到期时间：{detail.expires.strftime("%m-%d %H:%M")}'
+    return default
 
 
 async def api_release_code(code: str) -> bool:
-    """强制释放授权码（结束会议，码还归用户，可重新开房间）"""
+    """强制释放授权码（结束会议，码还归用户，可重新开房间）；熔断中直接返回 False"""
+    if not meet_breaker.allow():
+        return False
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f'{MEET_API_URL}/api/leave',
-                json={'authCode': code, 'force': True},
-                timeout=aiohttp.ClientTimeout(total=10),
-            ) as resp:
-                return resp.status == 200
+        async with meet_session().post(
+            f'{MEET_API_URL}/api/leave',
+            json={'authCode': code, 'force': True},
+            timeout=aiohttp.ClientTimeout(total=10),
+        ) as resp:
+            # 4xx 说明服务本身是通的，只有 5xx / 网络异常才计入熔断
+            if resp.status >= 500:
+                meet_breaker.failure()
+            else:
+                meet_breaker.success()
+            return resp.status == 200
     except Exception as e:
+        meet_breaker.failure()
         logger.error(f'释放码异常: {e}')
     return False
+
+
+# ============================================================
+#  出站消息队列（限速 + 优先级 + 合并编辑）
+# ============================================================
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+
+    def _fill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def delay(self, now: float) -> float:
+        """距离下一个令牌可用还需等待的秒数，0 表示立即可用"""
+        self._fill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._fill(now)
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._fill(now)
+        return self.tokens >= self.burst
+
+
+class _Outgoing:
+    __slots__ = ('chat_id', 'call', 'priority', 'edit_key', 'futures', 'attempts', 'errbacks')
+
+    def __init__(self, chat_id, call, priority, edit_key=None):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.edit_key = edit_key
+        self.futures = []
+        self.attempts = 0
+        self.errbacks = []
+
+
+class Outbox:
+    """每个机器人一个出站调度器，所有 send/edit 都经由这里发出
+
+    - 全局令牌桶 + 每个会话一个令牌桶，遇到 429 按 retry_after 整体暂停后重试
+    - 两条优先级通道：交互回复（INTERACTIVE）优先于批量消息（BULK）
+    - 同一条消息还在排队的多次 edit_message_text 只发最后一次
+    - 调用方拿到一个 Future（结果为 Message，失败为 None），不关心结果时无需 await；
+      需要区分失败原因的调用方（如实时面板）传 on_error，Telegram 拒绝请求（BadRequest / Forbidden）时以异常回调
+    """
+    INTERACTIVE = 0
+    BULK = 1
+    MAX_ATTEMPTS = 3
+    MAX_TRACKED_EDITS = 5000
+
+    def __init__(self, bot: Bot, global_rate: float = TG_GLOBAL_RATE,
+                 chat_rate: float = TG_CHAT_RATE, chat_burst: int = TG_CHAT_BURST):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._lanes = ([], [])
+        self._edits = {}
+        self._last_edit = OrderedDict()
+        self._paused_until = 0.0
+        self._wake = asyncio.Event()
+        self._task = None
+        self._inflight = set()
+
+    # ---- 提交 ----
+    def send(self, chat_id: int, text: str, priority: int = INTERACTIVE, **kwargs) -> asyncio.Future:
+        return self._submit(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs), priority)
+
+    def send_document(self, chat_id: int, document, priority: int = BULK, **kwargs) -> asyncio.Future:
+        """document 为已写好的文件对象；每次（含 429 重试）都从头上传，关闭由调用方负责"""
+        def call():
+            document.seek(0)
+            return self.bot.send_document(chat_id, document, **kwargs)
+        return self._submit(chat_id, call, priority)
+
+    def edit(self, chat_id: int, message_id: int, text: str, priority: int = INTERACTIVE, on_error=None,
+             **kwargs) -> asyncio.Future:
+        call = lambda: self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)  # noqa: E731
+        key = (chat_id, message_id)
+        markup = kwargs.get('reply_markup')
+        sig = (text, kwargs.get('parse_mode'), markup.to_json() if markup is not None else None)
+        if self._last_edit.get(key) == sig:
+            # 内容与消息当前（或即将发出的）内容完全相同，不必再请求
+            fut = asyncio.get_running_loop().create_future()
+            fut.set_result(None)
+            return fut
+        self._last_edit[key] = sig
+        self._last_edit.move_to_end(key)
+        if len(self._last_edit) > self.MAX_TRACKED_EDITS:
+            self._last_edit.popitem(last=False)
+        pending = self._edits.get(key)
+        if pending is not None:
+            # 前一次编辑还没发出去：直接替换内容，两个调用方共享同一个结果
+            pending.call = call
+            fut = asyncio.get_running_loop().create_future()
+            pending.futures.append(fut)
+            if on_error is not None:
+                pending.errbacks.append(on_error)
+            return fut
+        return self._submit(chat_id, call, priority, edit_key=key, on_error=on_error)
+
+    def _submit(self, chat_id, call, priority, edit_key=None, on_error=None) -> asyncio.Future:
+        item = _Outgoing(chat_id, call, priority, edit_key)
+        fut = asyncio.get_running_loop().create_future()
+        item.futures.append(fut)
+        if on_error is not None:
+            item.errbacks.append(on_error)
+        if edit_key is not None:
+            self._edits[edit_key] = item
+        self._lanes[priority].append(item)
+        self._wake.set()
+        return fut
+
+    # ---- 调度 ----
+    def _bucket(self, chat_id) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            b = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return b
+
+    def _next_ready(self):
+        """返回 (可立即发送的条目, None) 或 (None, 需要等待的秒数/None 表示队列为空)"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return None, self._paused_until - now
+        wait = self._global.delay(now)
+        if wait > 0:
+            return None, wait
+        wait = None
+        for lane in self._lanes:
+            for i, item in enumerate(lane):
+                d = self._bucket(item.chat_id).delay(now)
+                if d == 0:
+                    del lane[i]
+                    if item.edit_key is not None and self._edits.get(item.edit_key) is item:
+                        del self._edits[item.edit_key]
+                    self._global.take(now)
+                    self._bucket(item.chat_id).take(now)
+                    return item, None
+                wait = d if wait is None else min(wait, d)
+        if len(self._chats) > 1000:
+            self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+        return None, wait
+
+    async def _run(self):
+        while True:
+            item, wait = self._next_ready()
+            if item is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self._deliver(item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, item: _Outgoing):
+        result = None
+        try:
+            result = await item.call()
+        except RetryAfter as e:
+            item.attempts += 1
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else float(e.retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            logger.warning(f'Telegram 限流，暂停发送 {delay:.1f} 秒')
+            if item.attempts < self.MAX_ATTEMPTS:
+                lane = self._lanes[item.priority]
+                if item.edit_key is not None:
+                    newer = self._edits.get(item.edit_key)
+                    if newer is not None:
+                        # 排队期间已有更新的编辑，旧内容不必重发
+                        newer.futures.extend(item.futures)
+                        newer.errbacks.extend(item.errbacks)
+                        return
+                    self._edits[item.edit_key] = item
+                lane.insert(0, item)
+                self._wake.set()
+                return
+        except (BadRequest, Forbidden) as e:
+            if 'not modified' not in str(e).lower():
+                logger.warning(f'发送失败 chat={item.chat_id}: {e}')
+                self._last_edit.pop(item.edit_key, None)
+                for errback in item.errbacks:
+                    try:
+                        errback(e)
+                    except Exception as cb_err:
+                        logger.error(f'发送失败回调异常: {cb_err}')
+        except Exception as e:
+            logger.warning(f'发送失败 chat={item.chat_id}: {e}')
+            self._last_edit.pop(item.edit_key, None)
+        for fut in item.futures:
+            if not fut.done():
+                fut.set_result(result)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """停机前尽量把队列里的消息发完"""
+        deadline = time.monotonic() + timeout
+        while (any(self._lanes) or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class Coalescer:
+    """合并同一作用域内的重复操作（双击、卡顿时连点）
+
+    scope 一般是 (chat_id, message_id) 或用户 ID；同一 scope 上同一 action
+    正在执行，或刚执行完不到 window 秒且之后没有执行过别的 action 时，
+    重复请求直接挂靠到那一次结果上，不再重新查库 / 拉取远程状态。
+
+    同一用户的更新由 KeyedUpdateProcessor（或 PTB 默认的逐条处理）依次处理，同一用户的重复点击到达时前一次已经结束，
+    按用户 / 私聊消息划分的 scope 实际只会命中「刚执行完不到 window 秒」的复用；
+    「正在执行」的挂靠只在不同用户同时点击群里同一条消息时出现。
+    """
+
+    def __init__(self, window: float = DEBOUNCE_SECONDS):
+        self.window = window
+        self._runs = {}
+
+    async def run(self, scope, action: str, factory):
+        now = time.monotonic()
+        entry = self._runs.get(scope)
+        if entry is not None:
+            last_action, fut, finished = entry
+            if last_action == action and (finished is None or now - finished < self.window):
+                return await asyncio.shield(fut)
+        fut = asyncio.ensure_future(factory())
+        self._runs[scope] = (action, fut, None)
+
+        def _done(f):
+            cur = self._runs.get(scope)
+            if cur is None or cur[1] is not f:
+                return
+            if f.cancelled() or f.exception() is not None:
+                # 失败的结果不复用，下一次点击重新执行
+                del self._runs[scope]
+            else:
+                self._runs[scope] = (action, f, time.monotonic())
+
+        fut.add_done_callback(_done)
+        if len(self._runs) > 1000:
+            self._runs = {k: v for k, v in self._runs.items()
+                          if v[2] is None or now - v[2] < self.window}
+        return await asyncio.shield(fut)
+
+
+class _ReleaseJob:
+    __slots__ = ('codes', 'tenant', 'outbox', 'chat_id', 'message_id', 'uid')
+
+    def __init__(self, codes, tenant, outbox, chat_id, message_id, uid):
+        self.codes = codes
+        self.tenant = tenant
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.uid = uid
+
+
+class ReleaseWorker:
+    """「结束会议」后台流水线
+
+    回调只负责入队和应答；worker 调用 Meet API 后把结果直接写进共享快照，
+    再用快照原地刷新发起操作的那条列表消息，不需要再全量拉取一次。
+    一次可提交多个码（结束全部过期 / 多选），并发释放后只回一条汇总消息。
+    同一个码在队列中 / 执行中时重复提交会被忽略。进程内所有租户共用。
+    """
+
+    def __init__(self, concurrency: int = 4, bulk_concurrency: int = BULK_RELEASE_CONCURRENCY):
+        self.concurrency = concurrency
+        self.bulk_concurrency = bulk_concurrency
+        self.pending = set()
+        self._queue = None
+        self._tasks = []
+
+    def submit(self, codes, tenant, outbox, chat_id: int, message_id: int, uid: int) -> int:
+        """提交一个或多个码，返回实际入队的数量（已在处理中的码被跳过）"""
+        if isinstance(codes, str):
+            codes = [codes]
+        codes = [c for c in dict.fromkeys(codes) if c not in self.pending]
+        if not codes:
+            return 0
+        self.pending.update(codes)
+        self._queue.put_nowait(_ReleaseJob(codes, tenant, outbox, chat_id, message_id, uid))
+        return len(codes)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+
+    async def stop(self, timeout: float = 10.0):
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'停机时仍有 {self._queue.qsize()} 个结束会议请求未处理')
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.error(f'结束会议 {job.codes} 异常: {e}')
+            finally:
+                self.pending.difference_update(job.codes)
+                self._queue.task_done()
+
+    async def _process(self, job: _ReleaseJob):
+        released, failed = await release_many(job.codes, self.bulk_concurrency)
+        if released:
+            holders = job.tenant.db.get_code_holders()
+            for code in released:
+                job.tenant.db.events.emit('force_ended', code, user_id=holders.get(code), actor_id=job.uid)
+        self.pending.difference_update(job.codes)
+        msg, kb = await _inuse_view(job.tenant.db, job.uid, max_age=float('inf'))
+        job.outbox.edit(job.chat_id, job.message_id, msg, parse_mode='HTML', reply_markup=kb)
+        if len(job.codes) == 1:
+            if released:
+                job.outbox.send(job.chat_id, f'✅ 授权码 <code>{released[0]}</code> 已释放，可重新使用。',
+                                parse_mode='HTML', reply_markup=main_kb('admin'))
+            else:
+                job.outbox.send(job.chat_id, '❌ 释放失败，请稍后再试。', reply_markup=main_kb('admin'))
+            return
+        lines = [f'🧹 <b>批量结束会议</b>：成功 <b>{len(released)}</b> 个 / 失败 <b>{len(failed)}</b> 个']
+        if failed:
+            lines.append('❌ 失败：' + ', '.join(f'<code>{c}</code>' for c in failed))
+        job.outbox.send(job.chat_id, '\n'.join(lines), parse_mode='HTML', reply_markup=main_kb('admin'))
+
+
+async def release_many(codes, concurrency: int = BULK_RELEASE_CONCURRENCY) -> tuple:
+    """并发（最多 concurrency 个）结束多个码的会议，成功的直接写入共享快照；返回 (released, failed)"""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def _one(code):
+        async with sem:
+            return await api_release_code(code)
+
+    results = await asyncio.gather(*(_one(c) for c in codes))
+    released, failed = [], []
+    for code, ok in zip(codes, results):
+        if ok:
+            status_snapshot.apply(code, in_use=0, bound_room='')
+            released.append(code)
+        else:
+            failed.append(code)
+    return released, failed
+
+
+release_worker = ReleaseWorker()
+
+
+# ============================================================
+#  更新调度（不同用户并行，同一用户保序）
+# ============================================================
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """按用户（没有用户时按会话）分队列的并发更新处理器
+
+    - 同一用户的更新严格按到达顺序一条一条处理：多步操作的 user_data、领取 / 释放的先后不受并发影响
+    - 不同用户并行，同时运行的最多 concurrency 条；排队中的更新不占运行名额。
+      并行的只是各处理器里的等待（Meet API、Telegram 请求）：处理器中的数据库调用仍在事件循环线程上同步执行，
+      执行期间会挡住所有用户，并发不会让它们变快
+    - 背压：基类信号量限制进入处理（运行 + 排队）的总数 max_pending；单个用户排队超过 per_user 条时丢弃新更新
+    depths() 给出各用户当前的排队深度（含正在处理的那条），健康检查和管理面板展示。
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_MAX_PENDING,
+                 per_user: int = UPDATE_USER_QUEUE):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self.per_user = per_user
+        self._slots = asyncio.Semaphore(concurrency)
+        self._locks = {}
+        self._depth = {}
+        self.running = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        depth = self._depth.get(key, 0)
+        if depth >= self.per_user:
+            coroutine.close()
+            self.dropped += 1
+            logger.warning(f'用户 {key} 排队更新过多（{depth}），丢弃一条')
+            return
+        self._depth[key] = depth + 1
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        try:
+            # asyncio.Lock 按等待先后唤醒，同一用户的更新保持到达顺序
+            async with lock, self._slots:
+                self.running += 1
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+        except asyncio.CancelledError:
+            # 排队时被取消（停机），处理协程从未开始
+            coroutine.close()
+            raise
+        finally:
+            self._depth[key] -= 1
+            if not self._depth[key]:
+                del self._depth[key]
+                del self._locks[key]
+
+    def depths(self, top: int = 10) -> dict:
+        """排队最深的 top 个用户：{telegram_id: 深度}"""
+        return dict(sorted(self._depth.items(), key=lambda kv: -kv[1])[:top])
+
+    def stats(self) -> dict:
+        return {'running': self.running, 'concurrency': self.concurrency,
+                'pending': sum(self._depth.values()), 'users': len(self._depth),
+                'dropped': self.dropped, 'top_depths': self.depths()}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def updates_summary(app: Application) -> dict | None:
+    p = app.update_processor
+    return p.stats() if isinstance(p, KeyedUpdateProcessor) else None
+
+
+def coalescer_of(context) -> Coalescer:
+    return context.application.bot_data['coalescer']
+
+
+def outbox_of(context) -> Outbox:
+    return context.application.bot_data['outbox']
+
+
+def reply(context, message, text: str, priority: int = Outbox.INTERACTIVE, **kwargs) -> asyncio.Future:
+    """经出站队列回复到 message 所在会话"""
+    return outbox_of(context).send(message.chat_id, text, priority=priority, **kwargs)
+
+
+def edit_query(context, query, text: str, **kwargs) -> asyncio.Future:
+    """经出站队列编辑回调按钮所在的消息"""
+    m = query.message
+    return outbox_of(context).edit(m.chat_id, m.message_id, text, **kwargs)
+
+
 # ============================================================
 def main_kb(role=None):
     if role in ('root', 'admin'):
@@ -489,13 +2761,14 @@ def main_kb(role=None):
 #  处理器
 # ============================================================
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    db = tenant_of(context).db
     user = update.effective_user
     db.track_user(user.id, user.username, user.first_name)
     context.user_data['action'] = None
 
     role = db.get_user_role(user.id)
     if not role:
-        await update.message.reply_text(
+        reply(context, update.message,
             '☁️ <b>云际会议</b>\n'
             '━━━━━━━━━━━━━━━\n\n'
             f'👋 你好，{user.first_name}！\n\n'
@@ -530,16 +2803,25 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif role == 'admin':
         welcome += '\n\n🔓 /unbind — 解除自己的绑定'
 
-    await update.message.reply_text(welcome, parse_mode='HTML', reply_markup=main_kb(role))
+    reply(context, update.message, welcome, parse_mode='HTML', reply_markup=main_kb(role))
 
 
 async def claim_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """从本地库存分配一个授权码"""
+    t = tenant_of(context)
+    db = t.db
     user = update.effective_user
+    # 先按令牌桶限速（只在内存里判断），被限速拒绝的连点不访问数据库；放行后再按角色检查配额
+    denied = t.limiter.throttle(user.id)
+    if not denied:
+        denied, reserved = t.limiter.reserve(user.id, db.get_user_role(user.id))
+    if denied:
+        reply(context, update.message, denied)
+        return
     db.track_user(user.id, user.username, user.first_name)
 
     if not db.is_authorized(user.id):
-        await update.message.reply_text(
+        reply(context, update.message,
             '⛔ 您尚未被授权，请联系管理员绑定您的 ID：\n'
             f'<code>{user.id}</code>',
             parse_mode='HTML',
@@ -548,7 +2830,8 @@ async def claim_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     code = db.assign_code(user.id)
     if not code:
-        await update.message.reply_text(
+        t.limiter.refund(user.id, reserved)
+        reply(context, update.message,
             '❌ <b>暂无可用授权码</b>\n\n'
             '请联系管理员补充库存。',
             parse_mode='HTML',
@@ -557,14 +2840,15 @@ async def claim_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     stats = db.stock_stats()
-    await update.message.reply_text(
+    note = await _claimed_note(code)
+    reply(context, update.message,
         '✅ <b>领取成功！</b>\n'
         '━━━━━━━━━━━━━━━\n\n'
         f'🔑 授权码：<code>{code}</code>\n\n'
         '📌 <b>使用方法：</b>\n'
         '🟢 创建会议：<code>授权码 + 房间号</code>\n'
         '🔵 加入会议：<code>创建者授权码 + 房间号</code>\n\n'
-        '⏰ 第一次开设房间后开始计时\n'
+        f'{note}\n'
         '⚠️ 请勿将授权码分享给他人',
         parse_mode='HTML',
         reply_markup=main_kb('admin'),
@@ -573,28 +2857,27 @@ async def claim_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def query_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """查询授权码 —— 弹出两个分类按钮"""
+    db = tenant_of(context).db
     user = update.effective_user
     db.track_user(user.id, user.username, user.first_name)
 
     if not db.is_authorized(user.id):
-        await update.message.reply_text(
+        reply(context, update.message,
             '⛔ 您尚未被授权，请联系管理员绑定您的 ID：\n'
             f'<code>{user.id}</code>',
             parse_mode='HTML',
         )
         return
 
-    # 全部从 Vercel 实时拉取，数字统一来源
-    total, v_avail, idle_count, in_use_count, expired_count = await _overview_stats()
-    msg = _overview_msg(total, v_avail, idle_count, in_use_count, expired_count)
-    kb = InlineKeyboardMarkup([[
-        InlineKeyboardButton('🔴 使用中', callback_data='query_inuse'),
-        InlineKeyboardButton('🟢 未使用', callback_data='query_idle'),
-    ]])
-    await update.message.reply_text(msg, parse_mode='HTML', reply_markup=kb)
+    async def _run():
+        msg, kb = await _overview_view(db)
+        reply(context, update.message, msg, parse_mode='HTML', reply_markup=kb)
+
+    # 连点「查询授权码」只出一条总览
+    await coalescer_of(context).run(('user', user.id), 'query_codes', _run)
 
 
-async def _overview_stats() -> tuple:
+async def _overview_stats(db: DB) -> tuple:
     """统计本bot管理的码，返回 (total, available, idle, in_use, expired)
     总数/未出库/出库 来自本地DB，使用中/到期 从Vercel实时查本bot的码"""
     local = db.stock_stats()
@@ -603,34 +2886,20 @@ async def _overview_stats() -> tuple:
     assigned  = local['assigned']
 
     # 只查本bot出库的码在Vercel的状态
-    all_status = await api_get_all_codes_status()
-    now = datetime.now().astimezone()
+    all_status = await status_snapshot.get()
+    now = time.time()
     in_use_count = 0
     expired_count = 0
 
     # 获取本bot出库的码列表
-    my_codes = set()
-    conn = db._conn()
-    try:
-        cur = db._cur(conn)
-        cur.execute(f"SELECT code FROM {TBL_CODES} WHERE status='assigned'")
-        my_codes = {r['code'] for r in cur.fetchall()}
-    finally:
-        conn.close()
+    my_codes = db.get_assigned_codes()
 
     for code, detail in all_status.items():
         if code not in my_codes:
             continue
-        ea = detail.get('expires_at') or ''
-        if ea:
-            try:
-                exp = datetime.fromisoformat(str(ea).replace('Z', '+00:00'))
-                if exp <= now:
-                    expired_count += 1
-                    continue
-            except Exception:
-                pass
-        if int(detail.get('in_use') or 0) == 1:
+        if detail.expired(now):
+            expired_count += 1
+        elif detail.in_use:
             in_use_count += 1
 
     idle_count = max(0, assigned - in_use_count - expired_count)
@@ -642,9 +2911,37 @@ def _overview_msg(total, v_avail, idle_count, in_use_count, expired_count) -> st
         f'📋 <b>授权码总览</b>\n'
         f'总数（<b>{total}</b>）\n'
         f'未出库（<b>{v_avail}</b>）/ 出库未使用（<b>{idle_count}</b>）/ 使用中（<b>{in_use_count}</b>）/ 到期（<b>{expired_count}</b>）'
+        + status_snapshot.stale_note()
     )
 
 
+_UNAVAILABLE_MSG = '⚠️ 会议服务暂时无法连接，无法获取使用状态，请稍后再试'
+
+
+async def _overview_view(db: DB) -> tuple:
+    """总览消息 + 按钮；远程状态完全不可用时只给本地数量，不编造使用中/到期"""
+    try:
+        total, v_avail, idle_count, in_use_count, expired_count = await _overview_stats(db)
+    except MeetUnavailable:
+        local = db.stock_stats()
+        msg = (
+            f'📋 <b>授权码总览</b>\n'
+            f'总数（<b>{local["total"]}</b>）\n'
+            f'未出库（<b>{local["available"]}</b>）/ 出库（<b>{local["assigned"]}</b>）\n\n'
+            + _UNAVAILABLE_MSG
+        )
+        return msg, InlineKeyboardMarkup([[InlineKeyboardButton('🔄 重试', callback_data='query_back')]])
+    msg = _overview_msg(total, v_avail, idle_count, in_use_count, expired_count)
+    kb = InlineKeyboardMarkup([[
+        InlineKeyboardButton('🔴 使用中', callback_data='query_inuse'),
+        InlineKeyboardButton('🟢 未使用', callback_data='query_idle'),
+    ]])
+    return msg, kb
+
+
+_BACK_KB = InlineKeyboardMarkup([[InlineKeyboardButton('« 返回', callback_data='query_back')]])
+
+
 def _get_who(row) -> str:
     """从数据库行取持码人名称"""
     if not row['assigned_to'] or row['assigned_to'] == 0:
@@ -654,69 +2951,50 @@ def _get_who(row) -> str:
     return f'{fname}{("@"+uname) if uname else ""}'
 
 
-async def _cb_query_inuse(query, uid: int):
-    """回调：使用中的码 —— 只显示到期倒计时，不显示码本身"""
+async def _inuse_lists(db: DB, uid: int, max_age: float = None) -> tuple:
+    """使用中的码分成 (active, expired)：active 为 [(row, detail, remaining)]，expired 为 [(row, detail)]"""
     role = db.get_user_role(uid)
-    conn = db._conn()
-    try:
-        cur = db._cur(conn)
-        if role == 'root':
-            cur.execute(
-                f"SELECT acp.*, u.first_name, u.username FROM {TBL_CODES} acp "
-                f"LEFT JOIN {TBL_USERS} u ON acp.assigned_to = u.telegram_id "
-                "WHERE acp.status='assigned' ORDER BY acp.assigned_at DESC"
-            )
-        else:
-            cur.execute(
-                f"SELECT acp.*, u.first_name, u.username FROM {TBL_CODES} acp "
-                f"LEFT JOIN {TBL_USERS} u ON acp.assigned_to = u.telegram_id "
-                "WHERE acp.assigned_to=%s AND acp.status='assigned'",
-                (uid,)
-            )
-        rows = cur.fetchall()
-    finally:
-        conn.close()
-
-    all_status = await api_get_all_codes_status()
+    rows = db.get_assigned_rows(uid, all_users=(role == 'root'))
+    all_status = await status_snapshot.get(max_age)
 
+    now = time.time()
     active, expired_list = [], []
     for row in rows:
-        detail = all_status.get(row['code'], {})
-        if int(detail.get('in_use') or 0) != 1:
+        detail = all_status.get(row.code, _NO_STATUS)
+        if not detail.in_use:
             continue
-        expires_at = detail.get('expires_at') or ''
-        remaining = None
-        is_expired = False
-        if expires_at:
-            try:
-                exp = datetime.fromisoformat(str(expires_at).replace('Z', '+00:00'))
-                rem = exp - datetime.now(exp.tzinfo)
-                if rem.total_seconds() > 0:
-                    remaining = rem
-                else:
-                    is_expired = True
-            except Exception:
-                pass
-        if is_expired:
+        if detail.expired(now):
             expired_list.append((row, detail))
         else:
+            remaining = timedelta(seconds=detail.exp_ts - now) if detail.exp_ts is not None else None
             active.append((row, detail, remaining))
+    return active, expired_list
+
+
+async def _inuse_view(db: DB, uid: int, max_age: float = None, selected: set = None) -> tuple:
+    """使用中的码列表（消息 + 按钮）；正在结束的码显示为「结束中」
+
+    selected 不为 None 时进入多选模式：每行可勾选，底部为「结束所选」。
+    """
+    try:
+        active, expired_list = await _inuse_lists(db, uid, max_age)
+    except MeetUnavailable:
+        return _UNAVAILABLE_MSG, _BACK_KB
 
     if not active and not expired_list:
-        await query.edit_message_text(
-            '🟢 当前没有使用中的授权码',
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton('« 返回', callback_data='query_back')
-            ]])
-        )
-        return
+        return '🟢 当前没有使用中的授权码' + status_snapshot.stale_note(), _BACK_KB
+
+    def action_button(code_val):
+        if selected is not None and code_val not in release_worker.pending:
+            mark = '☑️' if code_val in selected else '⬜'
+            return InlineKeyboardButton(mark, callback_data=f'bulk_toggle_{code_val}')
+        return _release_button(code_val)
 
-    total = len(active) + len(expired_list)
     msg = f'🔴 <b>使用中 {len(active)} 个 / 已过期 {len(expired_list)} 个</b>'
     buttons = []
     for row, detail, remaining in active:
-        code_val = row['code']
-        bound_room = detail.get('bound_room') or ''
+        code_val = row.code
+        bound_room = detail.bound_room
         label = code_val
         if bound_room:
             label += f'  {bound_room}'
@@ -726,70 +3004,122 @@ async def _cb_query_inuse(query, uid: int):
             label += f'  ⏱{h}时{m}分'
         buttons.append([
             InlineKeyboardButton(f'🔴 {label}', callback_data='noop'),
-            InlineKeyboardButton('结束会议', callback_data=f'release_{code_val}'),
+            action_button(code_val),
         ])
 
     if expired_list:
         for row, detail in expired_list:
-            code_val = row['code']
-            bound_room = detail.get('bound_room') or ''
+            code_val = row.code
+            bound_room = detail.bound_room
             label = f'⚠️ {code_val}'
             if bound_room:
                 label += f'  {bound_room}'
             buttons.append([
                 InlineKeyboardButton(label, callback_data='noop'),
-                InlineKeyboardButton('结束会议', callback_data=f'release_{code_val}'),
+                action_button(code_val),
             ])
 
+    msg += status_snapshot.stale_note()
+    if selected is not None:
+        msg += f'\n\n☑️ 多选模式：已选 <b>{len(selected)}</b> 个'
+        buttons.append([
+            InlineKeyboardButton(f'结束所选（{len(selected)}）', callback_data='bulk_submit'),
+            InlineKeyboardButton('取消', callback_data='query_inuse'),
+        ])
+        return msg, InlineKeyboardMarkup(buttons)
+
+    bulk_row = [InlineKeyboardButton('☑️ 多选', callback_data='bulk_select')]
+    expired_left = [r['code'] for r, _ in expired_list if r['code'] not in release_worker.pending]
+    if expired_left:
+        bulk_row.insert(0, InlineKeyboardButton(f'🧹 结束全部过期（{len(expired_left)}）', callback_data='bulk_expired'))
+    buttons.append(bulk_row)
     buttons.append([InlineKeyboardButton('« 返回', callback_data='query_back')])
-    await query.edit_message_text(msg, parse_mode='HTML',
-        reply_markup=InlineKeyboardMarkup(buttons))
+    return msg, InlineKeyboardMarkup(buttons)
+
+
+def _release_button(code: str) -> InlineKeyboardButton:
+    if code in release_worker.pending:
+        return InlineKeyboardButton('⏳ 结束中', callback_data='noop')
+    return InlineKeyboardButton('结束会议', callback_data=f'release_{code}')
+
+
+async def _cb_query_inuse(context, query, uid: int):
+    """回调：使用中的码 —— 只显示到期倒计时，不显示码本身"""
+    msg, kb = await _inuse_view(tenant_of(context).db, uid)
+    edit_query(context, query, msg, parse_mode='HTML', reply_markup=kb)
+
+
+async def _cb_bulk(context, query, data: str, uid: int):
+    """批量结束会议：bulk_expired 一键结束全部过期；bulk_select / bulk_toggle_ / bulk_submit 为多选模式"""
+    t = tenant_of(context)
+    if not t.db.is_authorized(uid) or not query.message:
+        await query.answer('⛔ 无权操作')
+        return
+    m = query.message
+    sel_state = context.user_data.get('bulk_sel')
+    selected = sel_state[1] if sel_state and sel_state[0] == m.message_id else None
+
+    if data == 'bulk_expired':
+        try:
+            _, expired_list = await _inuse_lists(t.db, uid, max_age=float('inf'))
+        except MeetUnavailable:
+            await query.answer('⚠️ 会议服务暂时无法连接')
+            return
+        codes = [row['code'] for row, _ in expired_list]
+        n = release_worker.submit(codes, t, outbox_of(context), m.chat_id, m.message_id, uid) if codes else 0
+        await query.answer(f'⏳ 已提交 {n} 个，正在结束…' if n else '没有需要结束的过期会议')
+        selected = None
+    elif data == 'bulk_select':
+        selected = set()
+        context.user_data['bulk_sel'] = (m.message_id, selected)
+        await query.answer('请勾选要结束的会议')
+    elif data.startswith('bulk_toggle_'):
+        if selected is None:
+            selected = set()
+            context.user_data['bulk_sel'] = (m.message_id, selected)
+        code = data[len('bulk_toggle_'):]
+        selected.symmetric_difference_update({code})
+        await query.answer()
+    elif data == 'bulk_submit':
+        context.user_data.pop('bulk_sel', None)
+        # 勾选的码来自回调数据，只结束当前用户有权操作的码（root 可操作全部已出库码）
+        mine = {row['code'] for row in t.db.get_assigned_rows(uid, all_users=(t.db.get_user_role(uid) == 'root'))}
+        codes = sorted((selected or set()) & mine)
+        n = release_worker.submit(codes, t, outbox_of(context), m.chat_id, m.message_id, uid) if codes else 0
+        await query.answer(f'⏳ 已提交 {n} 个，正在结束…' if n else '未选择任何会议')
+        selected = None
+    else:
+        await query.answer()
+        return
 
+    msg, kb = await _inuse_view(t.db, uid, max_age=float('inf'), selected=selected)
+    edit_query(context, query, msg, parse_mode='HTML', reply_markup=kb)
 
-async def _cb_query_idle(query, uid: int):
+
+async def _cb_query_idle(context, query, uid: int):
     """回调：未使用 —— 已出库显示码值，未出库只显示数量"""
+    db = tenant_of(context).db
     role = db.get_user_role(uid)
     stats = db.stock_stats()
+    rows = db.get_assigned_rows(uid, all_users=(role == 'root'))
 
-    conn = db._conn()
     try:
-        cur = db._cur(conn)
-        if role == 'root':
-            cur.execute(
-                f"SELECT acp.*, u.first_name, u.username FROM {TBL_CODES} acp "
-                f"LEFT JOIN {TBL_USERS} u ON acp.assigned_to = u.telegram_id "
-                "WHERE acp.status='assigned' ORDER BY acp.assigned_at DESC"
-            )
-        else:
-            cur.execute(
-                f"SELECT acp.*, u.first_name, u.username FROM {TBL_CODES} acp "
-                f"LEFT JOIN {TBL_USERS} u ON acp.assigned_to = u.telegram_id "
-                "WHERE acp.assigned_to=%s AND acp.status='assigned'",
-                (uid,)
-            )
-        rows = cur.fetchall()
-    finally:
-        conn.close()
-
-    all_status = await api_get_all_codes_status()
-    now = datetime.now().astimezone()
+        all_status = await status_snapshot.get()
+    except MeetUnavailable:
+        edit_query(context, query, _UNAVAILABLE_MSG, reply_markup=_BACK_KB)
+        return
+    now = time.time()
 
     # 分类：未使用的已出库码
     idle_valid = []   # 可用的（未过期）
     idle_expired = 0  # 已过期报废的数量
     for row in rows:
-        detail = all_status.get(row['code'], {})
-        if int(detail.get('in_use') or 0) == 1:
+        detail = all_status.get(row.code, _NO_STATUS)
+        if detail.in_use:
+            continue
+        if detail.expired(now):
+            idle_expired += 1
             continue
-        ea = detail.get('expires_at') or ''
-        if ea:
-            try:
-                exp = datetime.fromisoformat(str(ea).replace('Z', '+00:00'))
-                if exp <= now:
-                    idle_expired += 1
-                    continue
-            except Exception:
-                pass
         idle_valid.append((row, detail))
 
     total_idle = len(idle_valid) + idle_expired
@@ -800,7 +3130,7 @@ async def _cb_query_idle(query, uid: int):
     if idle_valid:
         msg += f'<b>可用 {len(idle_valid)} 个：</b>\n'
         for i, (row, detail) in enumerate(idle_valid, 1):
-            code_val = row['code']
+            code_val = row.code
             if role == 'root':
                 msg += f'{i}. <code>{code_val}</code> → {_get_who(row)}\n'
             else:
@@ -810,8 +3140,9 @@ async def _cb_query_idle(query, uid: int):
 
     # 未出库 —— 只显示数量
     msg += f'\n📦 未出库库存：<b>{stats["available"]}</b> 个\n'
+    msg += status_snapshot.stale_note()
 
-    await query.edit_message_text(msg, parse_mode='HTML',
+    edit_query(context, query, msg, parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup([[
             InlineKeyboardButton('« 返回', callback_data='query_back')
         ]])
@@ -823,9 +3154,10 @@ async def _cb_query_idle(query, uid: int):
 # ============================================================
 async def bind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """ROOT 绑定 Admin：/bind <telegram_id>"""
+    db = tenant_of(context).db
     user = update.effective_user
     if db.get_user_role(user.id) != 'root':
-        await update.message.reply_text('⛔ 仅 ROOT 可执行此命令')
+        reply(context, update.message, '⛔ 仅 ROOT 可执行此命令')
         return
 
     args = context.args or []
@@ -839,13 +3171,13 @@ async def bind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             msg += '暂无绑定用户\n\n'
         msg += '📌 用法：/bind &lt;Telegram ID&gt;'
-        await update.message.reply_text(msg, parse_mode='HTML')
+        reply(context, update.message, msg, parse_mode='HTML')
         return
 
     try:
         target_id = int(args[0])
     except ValueError:
-        await update.message.reply_text('❌ 请输入有效的 Telegram ID（数字）')
+        reply(context, update.message, '❌ 请输入有效的 Telegram ID（数字）')
         return
 
     target_info = db.get_user_info(target_id)
@@ -856,69 +3188,71 @@ async def bind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if result == 'ok':
         admins = db.get_bound_admins()
         display = f'{target_name} {target_uname}'.strip() or str(target_id)
-        await update.message.reply_text(
+        reply(context, update.message,
             f'✅ 已绑定 <b>{display}</b> 为 Admin\n'
             f'👥 当前已绑定：{len(admins)}/2',
             parse_mode='HTML',
         )
     elif result == 'max':
-        await update.message.reply_text('❌ 已达到最大绑定数量（2个），请先踢出再绑定。')
+        reply(context, update.message, '❌ 已达到最大绑定数量（2个），请先踢出再绑定。')
     elif result == 'already':
-        await update.message.reply_text('⚠️ 该用户已经是 Admin')
+        reply(context, update.message, '⚠️ 该用户已经是 Admin')
     elif result == 'is_root':
-        await update.message.reply_text('⚠️ 不能绑定 ROOT')
+        reply(context, update.message, '⚠️ 不能绑定 ROOT')
 
 
 async def unbind_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin 自行解绑：/unbind"""
+    db = tenant_of(context).db
     user = update.effective_user
     role = db.get_user_role(user.id)
     if role == 'root':
-        await update.message.reply_text('⚠️ ROOT 无法解绑自己')
+        reply(context, update.message, '⚠️ ROOT 无法解绑自己')
         return
     if role != 'admin':
-        await update.message.reply_text('⛔ 您未被绑定')
+        reply(context, update.message, '⛔ 您未被绑定')
         return
 
     ok = db.unbind_user(user.id)
     if ok:
-        await update.message.reply_text(
+        reply(context, update.message,
             '✅ 已解除绑定，您将无法继续使用本机器人功能。\n'
             '如需重新绑定，请联系管理员。',
         )
     else:
-        await update.message.reply_text('❌ 解绑失败')
+        reply(context, update.message, '❌ 解绑失败')
 
 
 async def kick_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """ROOT 踢出 Admin：/kick <telegram_id>"""
+    db = tenant_of(context).db
     user = update.effective_user
     if db.get_user_role(user.id) != 'root':
-        await update.message.reply_text('⛔ 仅 ROOT 可执行此命令')
+        reply(context, update.message, '⛔ 仅 ROOT 可执行此命令')
         return
 
     args = context.args or []
     if not args:
         admins = db.get_bound_admins()
         if not admins:
-            await update.message.reply_text('当前无已绑定的 Admin')
+            reply(context, update.message, '当前无已绑定的 Admin')
             return
         msg = '👥 <b>可踢出的 Admin</b>\n━━━━━━━━━━━━━━━\n\n'
         for i, a in enumerate(admins, 1):
             uname = f"@{a['username']}" if a['username'] else '无用户名'
             msg += f'{i}. {a["first_name"] or ""} {uname}\n   ID: <code>{a["telegram_id"]}</code>\n\n'
         msg += '📌 用法：/kick &lt;Telegram ID&gt;'
-        await update.message.reply_text(msg, parse_mode='HTML')
+        reply(context, update.message, msg, parse_mode='HTML')
         return
 
     try:
         target_id = int(args[0])
     except ValueError:
-        await update.message.reply_text('❌ 请输入有效的 Telegram ID（数字）')
+        reply(context, update.message, '❌ 请输入有效的 Telegram ID（数字）')
         return
 
     if target_id == user.id:
-        await update.message.reply_text('⚠️ 不能踢出自己')
+        reply(context, update.message, '⚠️ 不能踢出自己')
         return
 
     target_info = db.get_user_info(target_id)
@@ -928,85 +3262,95 @@ async def kick_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     ok = db.unbind_user(target_id)
     if ok:
-        await update.message.reply_text(
+        reply(context, update.message,
             f'✅ 已踢出 <b>{display}</b>（<code>{target_id}</code>）',
             parse_mode='HTML',
         )
     else:
-        await update.message.reply_text('❌ 该用户不是已绑定的 Admin')
+        reply(context, update.message, '❌ 该用户不是已绑定的 Admin')
 
 
 async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    t = tenant_of(context)
+    db = t.db
     query = update.callback_query
-    await query.answer()
     data = query.data or ''
     uid = query.from_user.id
 
+    if data.startswith('release_'):
+        # 结束会议：入队后立即应答，列表原地标记为「结束中」，结果由后台 worker 回填
+        code = data[8:]
+        if not db.is_authorized(uid) or not query.message:
+            await query.answer('⛔ 无权操作')
+            return
+        m = query.message
+        if not release_worker.submit(code, t, outbox_of(context), m.chat_id, m.message_id, uid):
+            await query.answer('⏳ 正在结束中，请稍候')
+            return
+        await query.answer('⏳ 已提交，正在结束会议…')
+        msg, kb = await _inuse_view(db, uid, max_age=float('inf'))
+        edit_query(context, query, msg, parse_mode='HTML', reply_markup=kb)
+        return
+
+    if data.startswith('bulk_'):
+        await _cb_bulk(context, query, data, uid)
+        return
+
+    await query.answer()
+
     if data == 'noop':
         return
 
+    # 同一条消息上的重复点击合并为一次计算
+    scope = (query.message.chat_id, query.message.message_id) if query.message else ('user', uid)
+
     if data == 'query_inuse':
-        await _cb_query_inuse(query, uid)
+        context.user_data.pop('bulk_sel', None)
+        await coalescer_of(context).run(scope, data, lambda: _cb_query_inuse(context, query, uid))
         return
 
     if data == 'query_idle':
-        await _cb_query_idle(query, uid)
+        await coalescer_of(context).run(scope, data, lambda: _cb_query_idle(context, query, uid))
         return
 
     if data == 'query_back':
-        total, v_avail, idle_count, in_use_count, expired_count = await _overview_stats()
-        msg = _overview_msg(total, v_avail, idle_count, in_use_count, expired_count)
-        kb = InlineKeyboardMarkup([[
-            InlineKeyboardButton('🔴 使用中', callback_data='query_inuse'),
-            InlineKeyboardButton('🟢 未使用', callback_data='query_idle'),
-        ]])
-        await query.edit_message_text(msg, parse_mode='HTML', reply_markup=kb)
-        return
+        async def _back():
+            msg, kb = await _overview_view(db)
+            edit_query(context, query, msg, parse_mode='HTML', reply_markup=kb)
 
-    if data.startswith('release_'):
-        code = data[8:]
-        ok = await api_release_code(code)
-        if ok:
-            await query.message.reply_text(
-                f'✅ 授权码 <code>{code}</code> 已释放，可重新使用。',
-                parse_mode='HTML', reply_markup=main_kb('admin'),
-            )
-        else:
-            await query.message.reply_text(
-                f'❌ 释放失败，请稍后再试。',
-                reply_markup=main_kb('admin'),
-            )
+        await coalescer_of(context).run(scope, data, _back)
         return
 
     if data.startswith('release:'):
         try:
             pool_id = int(data.split(':')[1])
         except (IndexError, ValueError):
-            await query.edit_message_text('❌ 无效操作')
+            edit_query(context, query, '❌ 无效操作')
             return
         ok = db.release_code(pool_id, uid)
         if ok:
             stats = db.stock_stats()
-            await query.edit_message_text(
+            edit_query(context, query,
                 f'✅ <b>释放成功</b>\n📦 库存可用：<b>{stats["available"]}</b> 个',
                 parse_mode='HTML'
             )
         else:
-            await query.edit_message_text('❌ 释放失败（该码不属于您或已释放）')
+            edit_query(context, query, '❌ 释放失败（该码不属于您或已释放）')
 
 
 async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    t = tenant_of(context)
+    db = t.db
     uid  = update.effective_user.id
     text = (update.message.text or '').strip()
 
     # 管理员将主机器人下发的入库消息转发/粘贴过来，自动识别 #YUNJICODE:XXXX 并入库
-    if uid in ADMIN_IDS and '#YUNJICODE:' in text:
-        import re
+    if uid in t.admin_ids and '#YUNJICODE:' in text:
         found = re.findall(r'#YUNJICODE:([A-Za-z0-9_\-]+)', text)
         if found:
             ok_list, dup_list = [], []
             for code in found:
-                if db.add_code(code.upper(), note='主机器人下发'):
+                if db.add_code(code.upper(), note='主机器人下发', actor_id=uid):
                     ok_list.append(code.upper())
                 else:
                     dup_list.append(code.upper())
@@ -1017,7 +3361,7 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if dup_list:
                 lines.append(f'⚠️ 重复跳过 {len(dup_list)} 个：' + ', '.join(f'<code>{c}</code>' for c in dup_list))
             lines.append(f'📦 当前可分发：<b>{stats["available"]}</b> 个')
-            await update.message.reply_text('\n'.join(lines), parse_mode='HTML')
+            reply(context, update.message, '\n'.join(lines), parse_mode='HTML')
             return
 
     if text == '🎫 领取授权码':
@@ -1027,9 +3371,9 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         role = db.get_user_role(uid)
         if role:
-            await update.message.reply_text('请使用下方按钮操作 👇', reply_markup=main_kb(role))
+            reply(context, update.message, '请使用下方按钮操作 👇', reply_markup=main_kb(role))
         else:
-            await update.message.reply_text(
+            reply(context, update.message,
                     '⛔ 您尚未被授权，请将您的 ID 发给管理员进行绑定：\n\n'
                     f'<code>{uid}</code>',
                     parse_mode='HTML',
@@ -1037,9 +3381,11 @@ async def on_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    t = tenant_of(context)
+    db = t.db
     uid = update.effective_user.id
-    if uid not in ADMIN_IDS:
-        await update.message.reply_text('⛔ 权限不足')
+    if uid not in t.admin_ids:
+        reply(context, update.message, '⛔ 权限不足')
         return
 
     args = context.args or []
@@ -1061,18 +3407,26 @@ async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f'👥 用户总数：{len(users)}\n'
             f'📦 库存总量：{stats["total"]}\n'
             f'🟢 可分发：{stats["available"]}\n'
-            f'📤 已分发：{stats["assigned"]}\n\n'
+            f'📤 已分发：{stats["assigned"]}\n'
+            f'{t.forecast.summary()}\n'
+            f'{t.limiter.summary()}\n'
+            f'{_updates_line(context.application)}\n\n'
             '📌 <b>命令：</b>\n'
             '/bind &lt;ID&gt; — 绑定 Admin\n'
             '/kick &lt;ID&gt; — 踢出 Admin\n'
             '/admin getcodes &lt;数量&gt; — 批量取码发放\n'
             '/admin codes — 查看库存列表\n'
+            '/admin export [available|assigned|archived] [gz] — 导出全部库存为 CSV 文件\n'
+            '/admin archive &lt;码|ID&gt; — 查询已归档（到期）的码\n'
+            '/admin live [off] — 置顶实时面板，自动更新（仅 Owner）\n'
             '/admin delcode &lt;码&gt; — 删除未分发的码\n'
             '/admin users — 查看用户列表\n'
+            '/admin history &lt;码|ID&gt; — 查看码 / 用户的领取释放记录\n'
+            '/admin report [day|week|month] — 使用统计\n'
             '/admin addcode &lt;码&gt; [备注] — 手动录入\n\n'
             '💡 <b>自动入库：</b>将主机器人发来的购买成功消息直接转发给本机器人即可自动入库\n'
         )
-        await update.message.reply_text(msg, parse_mode='HTML')
+        reply(context, update.message, msg, parse_mode='HTML')
         return
 
     sub = args[0].lower()
@@ -1081,61 +3435,46 @@ async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if sub == 'getcodes':
         n = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
         n = min(n, 50)  # 最多一次取50个
-        conn = db._conn()
-        try:
-            cur = db._cur(conn)
-            cur.execute(
-                f"SELECT pool_id, code FROM {TBL_CODES} WHERE status='available' ORDER BY pool_id LIMIT %s", (n,)
-            )
-            rows = cur.fetchall()
-            if not rows:
-                await update.message.reply_text('❌ 库存为空')
-                conn.close()
-                return
-            ids = [r['pool_id'] for r in rows]
-            placeholders = ','.join(['%s'] * len(ids))
-            cur.execute(
-                f"UPDATE {TBL_CODES} SET status='assigned', assigned_to=0, assigned_at=%s WHERE pool_id IN ({placeholders})",
-                [datetime.now().isoformat()] + ids
-            )
-            conn.commit()
-        finally:
-            conn.close()
+        codes = db.assign_codes(0, n, actor_id=uid)
+        if not codes:
+            reply(context, update.message, '❌ 库存为空')
+            return
         stat = db.stock_stats()
-        code_lines = '\n'.join(f'<code>{r["code"]}</code>' for r in rows)
-        await update.message.reply_text(
-            f'✅ <b>已取出 {len(rows)} 个授权码</b>\n'
+        code_lines = '\n'.join(f'<code>{c}</code>' for c in codes)
+        reply(context, update.message,
+            f'✅ <b>已取出 {len(codes)} 个授权码</b>\n'
             f'📦 库存剩余可用：<b>{stat["available"]}</b>\n'
             f'━━━━━━━━━━━━━━━\n\n'
             f'{code_lines}',
-            parse_mode='HTML'
+            parse_mode='HTML',
+            priority=Outbox.BULK,
         )
         return
 
     # /admin addcode <码> [备注]
     if sub == 'addcode':
         if len(args) < 2:
-            await update.message.reply_text('用法：/admin addcode <授权码> [备注]')
+            reply(context, update.message, '用法：/admin addcode <授权码> [备注]')
             return
         code = args[1].strip().upper()
         note = ' '.join(args[2:]) if len(args) > 2 else ''
-        ok = db.add_code(code, note)
+        ok = db.add_code(code, note, actor_id=uid)
         if ok:
             stats = db.stock_stats()
-            await update.message.reply_text(
+            reply(context, update.message,
                 f'✅ 授权码 <code>{code}</code> 已存入库存\n'
                 f'📦 当前可分发：<b>{stats["available"]}</b> 个',
                 parse_mode='HTML',
             )
         else:
-            await update.message.reply_text(f'⚠️ 授权码 <code>{code}</code> 已存在，未重复添加', parse_mode='HTML')
+            reply(context, update.message, f'⚠️ 授权码 <code>{code}</code> 已存在，未重复添加', parse_mode='HTML')
         return
 
     # /admin codes
     if sub == 'codes':
         rows = db.list_codes(30)
         if not rows:
-            await update.message.reply_text('📦 库存为空')
+            reply(context, update.message, '📦 库存为空')
             return
         msg = '📦 <b>授权码库存（最近30条）</b>\n━━━━━━━━━━━━━━━\n\n'
         for r in rows:
@@ -1150,73 +3489,1205 @@ async def admin_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     st = f'📤 已分发→{r["assigned_to"]}'
             note = f' <i>{r["note"]}</i>' if r['note'] else ''
             msg += f'<code>{r["code"]}</code> {st}{note}\n'
-        await update.message.reply_text(msg, parse_mode='HTML')
+        reply(context, update.message, msg, parse_mode='HTML')
         return
 
     # /admin delcode <码>
     if sub == 'delcode':
         if len(args) < 2:
-            await update.message.reply_text('用法：/admin delcode <授权码>')
+            reply(context, update.message, '用法：/admin delcode <授权码>')
             return
         code = args[1].strip().upper()
-        ok = db.delete_code(code)
+        ok = db.delete_code(code, actor_id=uid)
         if ok:
-            await update.message.reply_text(f'✅ 已删除 <code>{code}</code>', parse_mode='HTML')
+            reply(context, update.message, f'✅ 已删除 <code>{code}</code>', parse_mode='HTML')
         else:
-            await update.message.reply_text(f'❌ 未找到可删除的码（已分发的码不可删除）', parse_mode='HTML')
+            reply(context, update.message, f'❌ 未找到可删除的码（已分发的码不可删除）', parse_mode='HTML')
         return
 
     # /admin users
     if sub == 'users':
         users = db.get_all_users()
         if not users:
-            await update.message.reply_text('暂无用户')
+            reply(context, update.message, '暂无用户')
             return
         msg = '👥 <b>用户列表</b>\n━━━━━━━━━━━━━━━\n\n'
         for u in users[:50]:
-            if u['telegram_id'] == OWNER_ID:
+            if u['telegram_id'] == t.owner_id:
                 continue  # ROOT 不显示
             uname = f"@{u['username']}" if u['username'] else '无用户名'
             role_tag = ' 🔑Admin' if u['role'] == 'admin' else ''
             msg += f'• <code>{u["telegram_id"]}</code>  {u["first_name"] or ""}  {uname}{role_tag}\n'
-        await update.message.reply_text(msg, parse_mode='HTML')
+        reply(context, update.message, msg, parse_mode='HTML')
+        return
+
+    # /admin report [day|week|month]
+    if sub == 'report':
+        period = args[1].lower() if len(args) > 1 else 'week'
+        days = {'day': 1, 'week': 7, 'month': 30}.get(period)
+        if days is None:
+            reply(context, update.message, '用法：/admin report [day|week|month]')
+            return
+        since = datetime.now(timezone.utc) - timedelta(days=days)
+        reply(context, update.message, _report_msg(db.usage_report(since), period), parse_mode='HTML')
+        return
+
+    # /admin export [available|assigned|archived] [gz] — 整张库存表（或归档表）导出为 CSV 文件
+    if sub == 'export':
+        opts = [a.lower() for a in args[1:]]
+        if any(o not in ('available', 'assigned', 'archived', 'gz', 'csv') for o in opts):
+            reply(context, update.message, '用法：/admin export [available|assigned|archived] [gz]')
+            return
+        status = next((o for o in opts if o in ('available', 'assigned', 'archived')), None)
+        gz = 'gz' in opts
+        try:
+            all_status = await status_snapshot.get()
+            note = '⚠️ 远程状态为缓存数据' if status_snapshot.stale else ''
+        except MeetUnavailable:
+            all_status, note = {}, '⚠️ 会议服务无法连接，远程状态列为空'
+        tmp, n = await asyncio.to_thread(_export_pool, db, all_status, status, gz)
+        if not n:
+            tmp.close()
+            reply(context, update.message, '📦 没有符合条件的码')
+            return
+        name = f'pool_{t.instance}{"_" + status if status else ""}_{datetime.now():%Y%m%d_%H%M}.csv'
+        caption = f'📦 共 {n} 条' + (f'\n{note}' if note else '')
+        fut = outbox_of(context).send_document(
+            update.message.chat_id, tmp, filename=name + ('.gz' if gz else ''), caption=caption,
+        )
+        fut.add_done_callback(lambda _: tmp.close())
+        return
+
+    # /admin live [off] — 置顶一条自动更新的面板
+    if sub == 'live':
+        if uid != t.owner_id:
+            reply(context, update.message, '⛔ 仅 Owner 可用')
+            return
+        chat_id = update.message.chat_id
+        if len(args) > 1 and args[1].lower() == 'off':
+            old = t.live.unsubscribe(chat_id)
+            if old:
+                try:
+                    await context.bot.unpin_chat_message(chat_id, old)
+                except Exception as e:
+                    logger.warning(f'取消置顶失败: {e}')
+            reply(context, update.message, '✅ 实时面板已关闭' if old else '当前没有实时面板')
+            return
+        body, footer = await t.live.render()
+        msg = await reply(context, update.message, body + footer, parse_mode='HTML')
+        if msg is None:
+            return
+        old = t.live.subscribe(chat_id, msg.message_id)
+        try:
+            if old:
+                await context.bot.unpin_chat_message(chat_id, old)
+            await context.bot.pin_chat_message(chat_id, msg.message_id, disable_notification=True)
+        except Exception as e:
+            logger.warning(f'置顶实时面板失败: {e}')
+        return
+
+    # /admin archive <码|ID>
+    if sub == 'archive':
+        if len(args) < 2:
+            reply(context, update.message, '用法：/admin archive <授权码|Telegram ID>\n' + _TARGET_HINT)
+            return
+        target = args[1].strip()
+        code, uid = _admin_target(target)
+        rows = []
+        if code:
+            rows += db.get_archived(code=code)
+        if uid is not None:
+            rows += db.get_archived(user_id=uid)
+        if code and uid is not None:
+            rows = sorted({r['pool_id']: r for r in rows}.values(), key=lambda r: r['archived_at'], reverse=True)[:30]
+        if not rows:
+            reply(context, update.message, '归档中没有记录')
+            return
+        msg = f'🗄 <b>归档：</b><code>{target}</code>（最近 {len(rows)} 条）\n━━━━━━━━━━━━━━━\n\n'
+        for r in rows:
+            exp = _parse_expires(r['expires_at'])
+            exp = exp.astimezone().strftime('%m-%d %H:%M') if exp else '—'
+            msg += f'<code>{r["code"]}</code> {_get_who(r)}  领取 {(r["assigned_at"] or "")[:16]}  到期 {exp}\n'
+        reply(context, update.message, msg, parse_mode='HTML')
+        return
+
+    # /admin history <码|ID>
+    if sub == 'history':
+        if len(args) < 2:
+            reply(context, update.message, '用法：/admin history <授权码|Telegram ID>\n' + _TARGET_HINT)
+            return
+        target = args[1].strip()
+        code, uid = _admin_target(target)
+        events = []
+        if code:
+            events += db.get_events(code=code, limit=30)
+        if uid is not None:
+            events += db.get_events(user_id=uid, limit=30)
+        if code and uid is not None:
+            # 纯数字两种都查：按 id 去重后合并
+            events = sorted({e['id']: e for e in events}.values(), key=lambda e: (e['ts'], e['id']), reverse=True)[:30]
+        if not events:
+            reply(context, update.message, '暂无记录')
+            return
+        names = {'added': '入库', 'claimed': '领取', 'released': '释放回库', 'force_ended': '结束会议',
+                 'expired': '到期释放', 'deleted': '删除', 'reclaimed': '未使用回收', 'archived': '归档'}
+        msg = f'🗂 <b>记录：</b><code>{target}</code>（最近 {len(events)} 条）\n━━━━━━━━━━━━━━━\n\n'
+        for e in events:
+            ts = e['ts'].astimezone().strftime('%m-%d %H:%M')
+            who = f' → {e["user_id"]}' if e['user_id'] else ''
+            by = f' (by {e["actor_id"]})' if e['actor_id'] and e['actor_id'] != e['user_id'] else ''
+            msg += f'{ts} {names.get(e["event"], e["event"])} <code>{e["code"]}</code>{who}{by}\n'
+        reply(context, update.message, msg, parse_mode='HTML')
         return
 
-    await update.message.reply_text('❓ 未知命令，发送 /admin 查看帮助')
+    reply(context, update.message, '❓ 未知命令，发送 /admin 查看帮助')
+
+
+_TARGET_HINT = '纯数字同时按 Telegram ID 和授权码查询，可用 id:123 / code:ABC 明确指定'
+
+
+def _admin_target(target: str) -> tuple:
+    """/admin 查询参数 → (code, user_id)：id: / code: 前缀明确指定；纯数字两者都查，其余按码"""
+    head, sep, rest = target.partition(':')
+    if sep and head.lower() == 'id' and rest.strip().isdigit():
+        return None, int(rest)
+    if sep and head.lower() == 'code' and rest.strip():
+        return rest.strip(), None
+    if target.isdigit():
+        return target, int(target)
+    return target, None
+
+
+EXPORT_FIELDS = ['pool_id', 'code', 'status', 'holder_id', 'holder_name', 'username', 'assigned_at', 'added_at',
+                 'note', 'in_use', 'bound_room', 'expires_at', 'remote_state']
+
+
+_CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_text(value) -> str:
+    """用户 / 远程可控的文本列：以公式字符开头的加 ' 前缀，防止表格软件当作公式执行"""
+    value = str(value or '')
+    return "'" + value if value.startswith(_CSV_FORMULA_PREFIXES) else value
+
+
+def _export_pool(db: DB, all_status: dict, status: str = None, gz: bool = False) -> tuple:
+    """把库存表流式写成 CSV（可 gzip）到临时文件，返回 (文件, 行数)；在线程里执行
+
+    逐行读、逐行编码、直接写盘，内存只有数据库一批行和编码缓冲。
+    远程状态取自调用方传入的快照；快照里没有的码远程列留空。
+    文本列经 _csv_text 转义，防止 CSV 公式注入。
+    """
+    tmp = tempfile.TemporaryFile()
+    raw = gzip.GzipFile(fileobj=tmp, mode='wb') if gz else tmp
+    # utf-8-sig：Excel 直接打开中文名不乱码
+    out = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_FIELDS)
+    now = time.time()
+    n = 0
+    try:
+        for r in db.iter_pool(status):
+            d = all_status.get(r.code, _NO_STATUS)
+            if d is _NO_STATUS:
+                remote = ''
+            elif d.expired(now):
+                remote = 'expired'
+            else:
+                remote = 'in_use' if d.in_use else 'idle'
+            assigned = r.status != 'available'
+            writer.writerow([
+                r.pool_id, _csv_text(r.code), r.status,
+                r.assigned_to if r.assigned_to is not None else '',
+                _csv_text(_get_who(r)) if assigned else '', _csv_text(r.username),
+                r.assigned_at or '', r.added_at or '', _csv_text(r.note),
+                int(d.in_use) if d is not _NO_STATUS else '', _csv_text(d.bound_room), _csv_text(d.expires_at), remote,
+            ])
+            n += 1
+        out.flush()
+        out.detach()
+        if gz:
+            raw.close()  # 写 gzip 尾部，不关闭 tmp
+    except BaseException:
+        tmp.close()
+        raise
+    return tmp, n
+
+
+def _updates_line(app: Application) -> str:
+    u = updates_summary(app)
+    if u is None:
+        return '⚙️ 更新处理：逐条'
+    line = f'⚙️ 更新处理：运行 {u["running"]}/{u["concurrency"]}，排队 {u["pending"]}（{u["users"]} 人）'
+    if u['top_depths']:
+        uid, depth = next(iter(u['top_depths'].items()))
+        line += f'，最深 <code>{uid}</code> {depth} 条'
+    if u['dropped']:
+        line += f'，已丢弃 {u["dropped"]}'
+    return line
+
+
+def _fmt_secs(secs) -> str:
+    if secs is None:
+        return '—'
+    secs = int(secs)
+    if secs >= 3600:
+        return f'{secs // 3600}时{secs % 3600 // 60}分'
+    return f'{secs // 60}分'
+
+
+def _report_msg(r: dict, period: str) -> str:
+    title = {'day': '近 24 小时', 'week': '近 7 天', 'month': '近 30 天'}[period]
+    fu, ss, ex, pool = r['first_use'], r['sessions'], r['expiry'], r['pool']
+    msg = f'📊 <b>使用统计（{title}）</b>\n━━━━━━━━━━━━━━━\n\n'
+    msg += '🎫 <b>领取排行：</b>\n'
+    if r['claims']:
+        for row in r['claims']:
+            if not row['user_id']:
+                who = '管理员发放'
+            else:
+                uname = f"@{row['username']}" if row['username'] else ''
+                who = f"{row['first_name'] or row['user_id']}{uname}"
+            msg += f'  • {who}：{row["n"]}\n'
+    else:
+        msg += '  暂无\n'
+    msg += (
+        f'\n⏳ 领取→首次开房：已用 {fu["used"]}/{fu["claimed"]}，'
+        f'平均 {_fmt_secs(fu["avg_s"])}，中位 {_fmt_secs(fu["p50_s"])}\n'
+        f'🎙 会议：{ss["sessions"]} 场 / {ss["codes"]} 个码，平均时长 {_fmt_secs(ss["avg_s"])}\n'
+    )
+    used_pct = f'{ss["codes"] * 100 // pool["assigned"]}%' if pool['assigned'] else '—'
+    out_pct = f'{pool["assigned"] * 100 // pool["total"]}%' if pool['total'] else '—'
+    msg += (
+        f'📦 库存出库率：{pool["assigned"]}/{pool["total"]}（{out_pct}），'
+        f'期间开过会的码占出库 {used_pct}\n'
+        f'⌛ 期间到期：{ex["expired"]} 个，其中到期时未在使用 {ex["expired_idle"]} 个'
+    )
+    return msg
 
 
 async def auto_release_expired(context):
-    """定时任务：自动释放 Vercel 侧已过期但仍标记为 in_use 的授权码"""
+    """定时任务：自动释放 Vercel 侧已过期但仍标记为 in_use 的授权码（仅 leader 执行）
+
+    远程码状态与租户无关，多租户模式下只挂在第一个机器人上执行一次。
+    """
+    if not tenant_of(context).leader.is_leader:
+        return
+    warm_state.last_auto_release = time.time()
     try:
-        all_status = await api_get_all_codes_status()
-        now = datetime.now().astimezone()
-        released, failed = [], []
+        all_status = await status_snapshot.get(max_age=0)
+        if status_snapshot.stale:
+            logger.info('Meet API 不可用，跳过本轮自动释放')
+            return
+        now = time.time()
+        expired = []
         for code, detail in all_status.items():
-            if int(detail.get('in_use') or 0) != 1:
-                continue
-            expires_at = detail.get('expires_at') or ''
-            if not expires_at:
-                continue
-            try:
-                exp = datetime.fromisoformat(str(expires_at).replace('Z', '+00:00'))
-                if exp > now:
-                    continue  # 还没过期
-            except Exception:
-                continue
-            # 已过期，尝试释放
-            ok = await api_release_code(code)
-            if ok:
-                released.append(code)
-            else:
-                failed.append(code)
+            if detail.in_use and detail.expired(now):
+                expired.append(code)
+        # 已过期，并发释放
+        released, failed = await release_many(expired)
         if released:
+            # 远程码不区分租户，按各自库存归属记到对应租户的事件日志
+            for t in tenants:
+                holders = t.db.get_code_holders()
+                mine = t.db.get_assigned_codes()
+                for code in released:
+                    if code in mine:
+                        t.db.events.emit('expired', code, user_id=holders.get(code), detail='auto_release')
             logger.info(f'自动释放过期码 {len(released)} 个：{released}')
         if failed:
             logger.warning(f'自动释放失败 {len(failed)} 个：{failed}')
+        health.last_auto_release = time.time()
     except Exception as e:
         logger.error(f'auto_release_expired 异常: {e}')
 
 
+class ExpiryNotifier:
+    """到期提醒：在 EXPIRY_NOTIFY_MINUTES 指定的时间点主动告诉持码人「授权码 X 还剩 N 分钟」
+
+    每次运行用共享状态快照的 expires_at 和本地 assigned_to 计算出提醒时间，
+    放进按时间排序的堆里；到点的条目按持码人合并成一条消息，经出站队列的批量通道发送。
+    发送过的 (code, expires_at, offset) 写入数据库，重启后不会重复提醒；
+    码被重新开房（expires_at 变化）后会重新计算。仅 leader 执行。
+    """
+
+    def __init__(self, tenant: 'Tenant', offsets: list = EXPIRY_NOTIFY_MINUTES):
+        self.tenant = tenant
+        self.offsets = offsets
+        self._heap = []
+        self._queued = set()
+        self._sent = None
+        self._term = None
+
+    def export(self) -> list:
+        return [[when.isoformat(), *key, uid] for when, key, uid in self._heap]
+
+    def restore(self, items: list):
+        for when, code, ea, off, uid in items:
+            key = (code, ea, off)
+            if key not in self._queued:
+                heapq.heappush(self._heap, (datetime.fromisoformat(when), key, uid))
+                self._queued.add(key)
+
+    def _schedule(self, holders: dict, all_status: dict, now: datetime):
+        for code, uid in holders.items():
+            detail = all_status.get(code, _NO_STATUS)
+            exp = detail.expires
+            if exp is None or exp <= now:
+                continue
+            for off in self.offsets:
+                key = (code, detail.expires_at, off)
+                if key in self._sent or key in self._queued:
+                    continue
+                heapq.heappush(self._heap, (exp - timedelta(minutes=off), key, uid))
+                self._queued.add(key)
+
+    async def run(self, context):
+        t = self.tenant
+        if not self.offsets or not t.leader.is_leader:
+            return
+        if self._term is not None and self._term != t.leader.term:
+            # 失去 leader 期间由其他副本发送过提醒，本地的已发送记录和待发堆都已过时
+            self._sent = None
+            self._heap.clear()
+            self._queued.clear()
+        self._term = t.leader.term
+        try:
+            if self._sent is None:
+                self._sent = t.db.get_sent_notices()
+            holders = t.db.get_code_holders()
+            all_status = await status_snapshot.get()
+            now = datetime.now().astimezone()
+            self._schedule(holders, all_status, now)
+
+            # 取出所有到点的提醒，按持码人合并；同一个码只报最近的一档
+            due, sent_keys = {}, []
+            while self._heap and self._heap[0][0] <= now:
+                _, key, uid = heapq.heappop(self._heap)
+                self._queued.discard(key)
+                code, ea, _ = key
+                # 排队期间码已被释放 / 换人 / 重新开房，作废
+                detail = all_status.get(code, _NO_STATUS)
+                if holders.get(code) != uid or detail.expires_at != ea:
+                    continue
+                sent_keys.append(key)
+                due.setdefault(uid, {})[code] = detail.expires
+            if not sent_keys:
+                return
+
+            outbox = outbox_of(context)
+            for uid, codes in due.items():
+                lines = []
+                for code, exp in sorted(codes.items(), key=lambda kv: kv[1]):
+                    mins = max(1, round((exp - now).total_seconds() / 60))
+                    lines.append(f'🔑 <code>{code}</code> 将在 <b>{mins}</b> 分钟后到期')
+                outbox.send(uid, '⏰ <b>授权码到期提醒</b>\n━━━━━━━━━━━━━━━\n\n' + '\n'.join(lines),
+                            priority=Outbox.BULK, parse_mode='HTML')
+            t.db.record_notices(sent_keys)
+            self._sent.update(sent_keys)
+            logger.info(f'[{t.instance}] 已发送到期提醒 {len(sent_keys)} 条 / {len(due)} 人')
+        except Exception as e:
+            logger.error(f'到期提醒异常: {e}')
+
+
+class Reclaimer:
+    """自动回收：领取超过 RECLAIM_AFTER_HOURS 小时、远程仍没有 bound_room / expires_at（从未开过房）的码退回库存
+
+    候选只按 assigned_at 部分索引取出领取时间已到提醒点的码，再与共享状态快照比对；
+    快照不可用或是旧数据时整轮跳过，快照里没有的码、管理员批量发放（无持码人）的码都不回收。
+    回收前 RECLAIM_WARN_HOURS 小时提醒持码人一次（去重记录与到期提醒共用一张表），
+    没收到过提醒的码先补发提醒、下一轮再回收。仅 leader 执行。
+    """
+
+    INTERVAL = 600
+    # 提醒去重键 (code, assigned_at, NOTICE)，与到期提醒的分钟档区分开
+    NOTICE = -1
+
+    def __init__(self, tenant: 'Tenant', after_hours: float = RECLAIM_AFTER_HOURS,
+                 warn_hours: float = RECLAIM_WARN_HOURS):
+        self.tenant = tenant
+        self.after = after_hours * 3600
+        self.warn = min(warn_hours * 3600, self.after)
+        self._sent = None
+        self._term = None
+
+    async def run(self, context):
+        t = self.tenant
+        if self.after <= 0 or not t.leader.is_leader:
+            return
+        if self._term != t.leader.term:
+            # 失去 leader 期间其他副本可能已发过回收提醒，重新加载
+            self._sent = None
+            self._term = t.leader.term
+        try:
+            now = time.time()
+            rows = t.db.get_assigned_before(datetime.fromtimestamp(now - self.after + self.warn).isoformat())
+            if not rows:
+                return
+            all_status = await status_snapshot.get()
+            if status_snapshot.stale:
+                logger.info(f'[{t.instance}] Meet API 不可用，跳过本轮自动回收')
+                return
+            if self._sent is None:
+                self._sent = t.db.get_sent_notices()
+            before = datetime.fromtimestamp(now - self.after).isoformat()
+            due, warn = [], []
+            for r in rows:
+                d = all_status.get(r.code, _NO_STATUS)
+                if d is _NO_STATUS or d.in_use or d.bound_room or d.expires_at:
+                    continue
+                warned = not self.warn or (r.code, r.assigned_at, self.NOTICE) in self._sent
+                if r.assigned_at < before and warned:
+                    due.append(r)
+                elif not warned:
+                    warn.append(r)
+
+            outbox = outbox_of(context)
+            if warn:
+                by_user = {}
+                for r in warn:
+                    left = max(datetime.fromisoformat(r.assigned_at).timestamp() + self.after - now, self.INTERVAL)
+                    by_user.setdefault(r.assigned_to, []).append(
+                        f'🔑 <code>{r.code}</code> 约 {_fmt_secs(left)}后回收')
+                for uid, lines in by_user.items():
+                    outbox.send(uid, '⚠️ <b>授权码即将回收</b>\n━━━━━━━━━━━━━━━\n\n' + '\n'.join(lines) +
+                                '\n\n以上授权码领取后一直未使用，如需保留请在回收前开设一次会议',
+                                priority=Outbox.BULK, parse_mode='HTML')
+                keys = [(r.code, r.assigned_at, self.NOTICE) for r in warn]
+                t.db.record_notices(keys)
+                self._sent.update(keys)
+                logger.info(f'[{t.instance}] 已发送回收提醒 {len(warn)} 条 / {len(by_user)} 人')
+            if due:
+                done = t.db.reclaim_codes(due, before)
+                by_user = {}
+                for r in done:
+                    by_user.setdefault(r.assigned_to, []).append(f'🔑 <code>{r.code}</code>')
+                for uid, lines in by_user.items():
+                    outbox.send(uid, '♻️ <b>授权码已回收</b>\n━━━━━━━━━━━━━━━\n\n' + '\n'.join(lines) +
+                                f'\n\n领取超过 {self.after / 3600:g} 小时未使用，已退回库存',
+                                priority=Outbox.BULK, parse_mode='HTML')
+                if done:
+                    logger.info(f'[{t.instance}] 自动回收未使用的码 {len(done)} 个：{[r.code for r in done]}')
+        except Exception as e:
+            logger.error(f'自动回收异常: {e}')
+
+
+class Archiver:
+    """冷热分离：远程已到期超过 ARCHIVE_AFTER_HOURS 小时、且不在使用中的已出库码移到归档表
+
+    主表只留可用码和仍有效的已出库码，使用中 / 未使用视图、到期提醒等按 status='assigned' 扫的地方不再随时间变慢。
+    每小时一轮，按 BATCH 个码一个事务分批移动（删除与写入归档在同一事务内）；快照不可用或是旧数据时跳过。
+    归档表仍可查：/admin archive、/admin export archived，使用统计的库存数也计入归档。仅 leader 执行。
+    """
+
+    INTERVAL = 3600
+    BATCH = 500
+
+    def __init__(self, tenant: 'Tenant', after_hours: float = ARCHIVE_AFTER_HOURS):
+        self.tenant = tenant
+        self.after = after_hours * 3600
+
+    async def run(self, context=None):
+        t = self.tenant
+        if self.after <= 0 or not t.leader.is_leader:
+            return
+        try:
+            all_status = await status_snapshot.get()
+            if status_snapshot.stale:
+                logger.info(f'[{t.instance}] Meet API 不可用，跳过本轮归档')
+                return
+            cutoff = time.time() - self.after
+            expiry = {}
+            for code in t.db.get_assigned_codes():
+                d = all_status.get(code, _NO_STATUS)
+                if d is not _NO_STATUS and not d.in_use and d.exp_ts is not None and d.exp_ts < cutoff:
+                    expiry[code] = d.expires_at
+            if not expiry:
+                return
+            codes = sorted(expiry)
+            moved = 0
+            for i in range(0, len(codes), self.BATCH):
+                batch = {c: expiry[c] for c in codes[i:i + self.BATCH]}
+                moved += len(await asyncio.to_thread(t.db.archive_codes, batch))
+            logger.info(f'[{t.instance}] 已归档到期的码 {moved} 个')
+        except Exception as e:
+            logger.error(f'归档异常: {e}')
+
+
+class UsageTracker:
+    """订阅共享快照的变化，把本租户码的开房 / 结束写进事件日志（仅 leader 写，避免多副本重复）
+
+    - in_use 0→1：session_start；1→0：session_end（机器人自己结束的会议已有 force_ended）
+    - expires_at 从无到有（或换了新值）：first_used，时间按 expires_at - AUTH_CODE_EXPIRES 估算
+    订阅回调跑在快照刷新里（用户点击正等着这次刷新），只在内存里记下变化和发现时刻；
+    按持码人归属过滤、写事件由每 INTERVAL 秒一次的定时任务完成，数据库查询放到线程里。
+    精度取决于快照刷新频率（到期提醒任务保证至少每分钟一次）。
+    """
+
+    INTERVAL = 10
+
+    def __init__(self, tenant: 'Tenant'):
+        self.tenant = tenant
+        self._pending = []  # (code, was, now_in, expires, 发现时刻)
+
+    def __call__(self, prev: dict, new: dict):
+        if not self.tenant.leader.is_leader:
+            return
+        seen = datetime.now(timezone.utc)
+        for code, d in new.items():
+            p = prev.get(code)
+            if p is None:
+                continue
+            was, now_in = p.in_use, d.in_use
+            ea_old, ea_new = p.expires_at, d.expires_at
+            renewed = bool(ea_new) and ea_new != ea_old
+            if was != now_in or renewed:
+                self._pending.append((code, was, now_in, d.expires if renewed else None, seen))
+
+    async def flush(self, context=None):
+        """定时任务：把攒下的变化按本租户的持码关系写成事件"""
+        t = self.tenant
+        changes, self._pending = self._pending, []
+        if not changes or not t.leader.is_leader:
+            return
+        try:
+            holders, mine = await asyncio.to_thread(lambda: (t.db.get_code_holders(), t.db.get_assigned_codes()))
+        except Exception as e:
+            logger.error(f'使用记录写入失败: {e}')
+            return
+        for code, was, now_in, exp, seen in changes:
+            if code not in mine:
+                continue
+            uid = holders.get(code)
+            if exp is not None:
+                t.db.events.emit('first_used', code, user_id=uid, detail=exp.isoformat(),
+                                 ts=exp - timedelta(minutes=AUTH_CODE_EXPIRES))
+            if now_in and not was:
+                t.db.events.emit('session_start', code, user_id=uid, ts=seen)
+            elif was and not now_in:
+                t.db.events.emit('session_end', code, user_id=uid, ts=seen)
+
+
+class StockForecast:
+    """库存耗尽预测：按 assigned_at 统计近 1 / 6 / 24 小时的领取速度，取最快的一档估算剩余可用多久
+
+    每次只读取水位线之后新出库的码，时间戳放在内存滑动窗口里，不重复扫描历史；
+    所有副本都维护预测（管理面板要用），只有 leader 发送预警。
+    预测低于 LOW_STOCK_HOURS（或库存清零）时提醒 Owner / Admin 一次，回升到 1.5 倍以上后重新武装。
+    """
+
+    WINDOWS = (3600, 6 * 3600, 24 * 3600)
+
+    def __init__(self, tenant: 'Tenant', threshold_hours: float = LOW_STOCK_HOURS):
+        self.tenant = tenant
+        self.threshold = threshold_hours * 3600
+        self._times = deque()
+        self._mark = None
+        self._alerted = False
+        self.available = None
+        self.rate = 0.0       # 个/小时
+        self.eta = None       # 预计多少秒后耗尽；没有领取时为 None
+
+    def _ingest(self, now: float):
+        if self._mark is None:
+            self._mark = datetime.fromtimestamp(now - self.WINDOWS[-1]).isoformat()
+        for ts in self.tenant.db.get_claims_since(self._mark):
+            try:
+                self._times.append(datetime.fromisoformat(ts).timestamp())
+            except (TypeError, ValueError):
+                continue
+            self._mark = ts
+        horizon = now - self.WINDOWS[-1]
+        while self._times and self._times[0] < horizon:
+            self._times.popleft()
+
+    def _rate(self, now: float) -> float:
+        """各窗口速度（个/秒）取最大值：突发领取时尽早预警"""
+        best, i, n = 0.0, len(self._times), 0
+        for w in self.WINDOWS:
+            start = now - w
+            while i > 0 and self._times[i - 1] >= start:
+                i -= 1
+                n += 1
+            best = max(best, n / w)
+        return best
+
+    def update(self):
+        now = time.time()
+        self._ingest(now)
+        rate = self._rate(now)
+        self.available = self.tenant.db.stock_stats()['available']
+        self.rate = rate * 3600
+        self.eta = self.available / rate if rate > 0 else None
+
+    def low(self) -> bool:
+        return self.available == 0 or (self.eta is not None and self.eta < self.threshold)
+
+    def summary(self) -> str:
+        if self.available is None:
+            return '📉 耗尽预测：统计中'
+        if self.eta is None:
+            return '📉 耗尽预测：近 24 小时无领取'
+        return f'📉 耗尽预测：约 {_fmt_secs(self.eta)}后（{self.rate:.1f} 个/小时）'
+
+    async def run(self, context):
+        t = self.tenant
+        try:
+            self.update()
+            if not self.low():
+                if self.eta is None or self.eta > self.threshold * 1.5:
+                    self._alerted = False
+                return
+            if self._alerted or not t.leader.is_leader:
+                return
+            self._alerted = True
+            msg = (
+                '⚠️ <b>库存预警</b>\n━━━━━━━━━━━━━━━\n\n'
+                f'🟢 剩余可分发：<b>{self.available}</b>\n{self.summary()}\n\n'
+                '请及时补充授权码'
+            )
+            outbox = outbox_of(context)
+            for admin_id in sorted(t.admin_ids):
+                outbox.send(admin_id, msg, priority=Outbox.BULK, parse_mode='HTML')
+            logger.warning(f'[{t.instance}] 库存预警：剩余 {self.available}，{self.summary()}')
+        except Exception as e:
+            logger.error(f'库存预测异常: {e}')
+
+
+class ClaimLimiter:
+    """领取限速 + 按角色的周期配额，全部在内存里判断
+
+    每个用户一个令牌桶（CLAIM_RATE / CLAIM_BURST），throttle() 不需要角色，被限速拒绝的点击不访问数据库；
+    配额为 CLAIM_QUOTA_HOURS 小时滑动窗口内的领取时间戳，reserve() 按角色判断（角色查询可能访问数据库），
+    通过即预占一个名额并返回它，领取失败（库存为空）时 refund() 只退回这一个。计数启动时按事件日志里的领取记录重建，
+    与重建完成前本进程已放行的领取合并；每个进程各自计数，多副本时按副本分别生效。
+    """
+
+    def __init__(self, rate: float = CLAIM_RATE, burst: int = CLAIM_BURST,
+                 quotas: dict = CLAIM_QUOTA, period_hours: float = CLAIM_QUOTA_HOURS):
+        self.rate = rate
+        self.burst = burst
+        self.quotas = quotas
+        self.period = period_hours * 3600
+        self._buckets = {}
+        self._claims = {}  # telegram_id -> deque[领取时刻 time.time()]
+        # 此后的领取由本进程在内存里计数，重建只取这之前的记录，避免重复计入
+        self._since = time.time()
+
+    def _window(self, uid: int, now: float) -> deque:
+        q = self._claims.setdefault(uid, deque())
+        while q and q[0] <= now - self.period:
+            q.popleft()
+        return q
+
+    def throttle(self, uid: int) -> str | None:
+        """令牌桶限速：放行返回 None，拒绝时返回提示文案"""
+        if self.rate > 0:
+            mono = time.monotonic()
+            bucket = self._buckets.get(uid)
+            if bucket is None:
+                if len(self._buckets) > 1000:
+                    self._buckets = {k: b for k, b in self._buckets.items() if not b.idle(mono)}
+                bucket = self._buckets[uid] = TokenBucket(self.rate, self.burst)
+            wait = bucket.delay(mono)
+            if wait > 0:
+                return f'⏳ 操作太频繁，请 {int(wait) + 1} 秒后再试'
+            bucket.take(mono)
+        return None
+
+    def reserve(self, uid: int, role: str | None) -> tuple:
+        """配额：返回 (拒绝文案或 None, 预占的领取时刻或 None)；角色没有配额时不预占"""
+        quota = self.quotas.get(role)
+        if not quota:
+            return None, None
+        now = time.time()
+        q = self._window(uid, now)
+        if len(q) >= quota:
+            resume = datetime.fromtimestamp(q[0] + self.period).strftime('%m-%d %H:%M')
+            return (f'⛔ 已达领取上限（{self.period / 3600:g} 小时内 {quota} 个）\n'
+                    f'{resume} 后可再次领取'), None
+        q.append(now)
+        return None, now
+
+    def refund(self, uid: int, reserved: float | None):
+        """退回 reserve() 预占的那一个名额；没有预占时什么也不做"""
+        q = self._claims.get(uid)
+        if reserved is None or not q:
+            return
+        try:
+            q.remove(reserved)
+        except ValueError:
+            pass  # 已滑出窗口
+
+    def restore(self, rows: list):
+        """rows 为 DB.get_user_claims_since 的结果，合并进已有的计数"""
+        claims = {}
+        for uid, at in rows:
+            if isinstance(at, datetime):
+                claims.setdefault(uid, []).append(at.timestamp())
+        for uid, ts in claims.items():
+            self._claims[uid] = deque(sorted([*ts, *self._claims.get(uid, ())]))
+
+    async def rebuild(self, db: 'DB'):
+        if not self.quotas:
+            return
+        since = datetime.fromtimestamp(self._since - self.period, timezone.utc)
+        before = datetime.fromtimestamp(self._since, timezone.utc)
+        self.restore(await asyncio.to_thread(db.get_user_claims_since, since, before))
+
+    def summary(self) -> str:
+        parts = []
+        if self.rate > 0:
+            parts.append(f'🚦 领取限速：每 {1 / self.rate:g} 秒 1 次（最多连续 {self.burst} 次）')
+        if self.quotas:
+            quotas = '，'.join(f'{role} {n} 个' for role, n in sorted(self.quotas.items()))
+            parts.append(f'🎟 领取配额：{self.period / 3600:g} 小时内 {quotas}')
+        return '\n'.join(parts) or '🚦 领取限制：未开启'
+
+
+class LiveDashboard:
+    """Owner 的实时面板：/admin live 发出一条消息并置顶，之后机器人原地编辑，不用再手动刷新
+
+    共享快照刷新（StatusSnapshot.listeners）或本租户库存变化（EventLog.listeners）只置脏标记；
+    定时任务每 LIVE_THROTTLE 秒最多渲染一次，同一份文本推给所有订阅的消息，
+    正文与上次推送的相同就不发（底部的数据时间不参与比较，使用中的码显示到期时刻而不是倒计时）。
+    有订阅者时保证快照不旧于 LIVE_MAX_AGE 秒。订阅关系存在数据库里，任一副本处理 /admin live 都写入同一张表；
+    只有 leader 编辑面板，成为 leader 时以及之后每 RELOAD 秒重新读取订阅。
+    编辑时消息已删除 / 机器人被拉黑的订阅自动取消。
+    """
+
+    POOL_EVENTS = {'added', 'claimed', 'released', 'force_ended', 'expired', 'deleted', 'reclaimed', 'archived'}
+    MAX_ROWS = 15
+    RELOAD = 30
+
+    def __init__(self, tenant: 'Tenant', max_age: float = LIVE_MAX_AGE):
+        self.tenant = tenant
+        self.max_age = max_age
+        self.viewers = {}  # chat_id -> message_id，数据库中订阅表的本地副本
+        self._dirty = True
+        self._body = None
+        self._term = None
+        self._loaded = 0.0
+        tenant.db.events.listeners.append(self._on_event)
+        status_snapshot.listeners.append(self._on_snapshot)
+
+    def _on_event(self, event: str):
+        if event in self.POOL_EVENTS:
+            self._dirty = True
+
+    def _on_snapshot(self, prev: dict, new: dict):
+        self._dirty = True
+
+    def subscribe(self, chat_id: int, message_id: int) -> int | None:
+        """返回该会话之前的面板消息 ID（需要取消置顶）"""
+        old = self.tenant.db.set_live_viewer(chat_id, message_id)
+        self.viewers[chat_id] = message_id
+        return old
+
+    def unsubscribe(self, chat_id: int) -> int | None:
+        self.viewers.pop(chat_id, None)
+        return self.tenant.db.delete_live_viewer(chat_id)
+
+    async def render(self) -> tuple:
+        """返回 (正文, 底部)；正文决定要不要编辑"""
+        t = self.tenant
+        body = '📡 <b>实时面板</b>\n━━━━━━━━━━━━━━━\n\n'
+        try:
+            total, v_avail, idle_count, in_use_count, expired_count = await _overview_stats(t.db)
+            active, expired_list = await _inuse_lists(t.db, t.owner_id)
+        except MeetUnavailable:
+            local = t.db.stock_stats()
+            body += (f'📋 总数 <b>{local["total"]}</b>｜未出库 <b>{local["available"]}</b>｜'
+                     f'出库 <b>{local["assigned"]}</b>\n\n' + _UNAVAILABLE_MSG)
+            return body, ''
+        body += (f'📋 总数 <b>{total}</b>｜未出库 <b>{v_avail}</b>｜出库未使用 <b>{idle_count}</b>｜'
+                 f'使用中 <b>{in_use_count}</b>｜到期 <b>{expired_count}</b>\n')
+        if active:
+            body += f'\n🔴 <b>使用中（{len(active)}）</b>\n'
+            active.sort(key=lambda a: a[1].exp_ts if a[1].exp_ts is not None else float('inf'))
+            for row, detail, _ in active[:self.MAX_ROWS]:
+                until = f' · 至 {detail.expires.strftime("%H:%M")}' if detail.exp_ts is not None else ''
+                body += f'<code>{row.code}</code> {_get_who(row)}{until}\n'
+            if len(active) > self.MAX_ROWS:
+                body += f'…另有 {len(active) - self.MAX_ROWS} 个\n'
+        if expired_list:
+            body += f'\n⌛ 已到期待释放：{len(expired_list)} 个\n'
+        snap = status_snapshot
+        footer = f'\n🕒 远程状态 {snap.fetched_wall:%H:%M:%S}' if snap.fetched_wall else ''
+        return body, footer + snap.stale_note()
+
+    async def tick(self, context):
+        t = self.tenant
+        if not t.leader.is_leader:
+            return
+        try:
+            if self._term != t.leader.term or time.monotonic() - self._loaded >= self.RELOAD:
+                self.viewers = await asyncio.to_thread(t.db.get_live_viewers)
+                self._loaded = time.monotonic()
+                if self._term != t.leader.term:
+                    # 之前由其他副本编辑，不知道面板当前内容，下一次必定推送
+                    self._term = t.leader.term
+                    self._dirty, self._body = True, None
+            if not self.viewers:
+                return
+            if status_snapshot.age() > self.max_age:
+                try:
+                    await status_snapshot.get(self.max_age)  # 刷新后经快照订阅置脏
+                except MeetUnavailable:
+                    pass
+            if not self._dirty:
+                return
+            self._dirty = False
+            body, footer = await self.render()
+            if body == self._body:
+                return
+            self._body = body
+            outbox = outbox_of(context)
+            for chat_id, message_id in list(self.viewers.items()):
+                outbox.edit(chat_id, message_id, body + footer, priority=Outbox.BULK, parse_mode='HTML',
+                            on_error=functools.partial(self._on_edit_failed, chat_id, message_id))
+        except Exception as e:
+            logger.error(f'实时面板更新异常: {e}')
+
+    # 面板消息被删除、会话不存在、机器人被拉黑 / 移出：以后每次编辑都会失败
+    _GONE = ('message to edit not found', "message can't be edited", 'chat not found')
+
+    def _on_edit_failed(self, chat_id: int, message_id: int, error: Exception):
+        if not isinstance(error, Forbidden) and not any(g in str(error).lower() for g in self._GONE):
+            return
+        if self.viewers.get(chat_id) == message_id:
+            del self.viewers[chat_id]
+            try:
+                self.tenant.db.delete_live_viewer(chat_id, message_id)
+            except Exception as e:
+                logger.warning(f'删除实时面板订阅失败: {e}')
+            logger.info(f'[{self.tenant.instance}] 实时面板已失效，取消订阅 chat={chat_id}: {error}')
+
+
+class WarmState:
+    """热启动检查点：状态快照、到期提醒排程、各租户角色缓存、自动释放计时
+
+    每 WARM_STATE_INTERVAL 秒和退出时写入本地文件：魔数 + 版本号 + zlib 压缩的 JSON，
+    先写临时文件再原子替换。启动时版本不符或超过 WARM_STATE_MAX_AGE 的检查点直接丢弃；
+    恢复的数据立即可用，随后在后台重新校验（快照重新拉取、角色重新查询）。
+    """
+
+    MAGIC = b'CMWS'
+    VERSION = 2
+
+    def __init__(self, path: str = WARM_STATE_PATH, max_age: float = WARM_STATE_MAX_AGE):
+        self.path = Path(path)
+        self.max_age = max_age
+        self.last_auto_release = None
+
+    def dump(self) -> bytes:
+        snap = status_snapshot
+        state = {
+            'saved': time.time(),
+            'auto_release': self.last_auto_release,
+            'snapshot': {
+                'wall': snap.fetched_wall.isoformat() if snap.fetched_wall else None,
+                'data': {c: d.to_list() for c, d in snap.data.items()} if snap.fetched_wall else {},
+            },
+            'tenants': {
+                t.instance: {'roles': t.db.cached_roles(), 'expiry': t.notifier.export()}
+                for t in tenants
+            },
+        }
+        body = zlib.compress(json.dumps(state, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        return self.MAGIC + struct.pack('>H', self.VERSION) + body
+
+    def save(self):
+        tmp = self.path.with_suffix('.tmp')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_bytes(self.dump())
+        os.replace(tmp, self.path)
+
+    def load(self) -> bool:
+        """恢复检查点；文件不存在、损坏、版本不符或过旧时返回 False"""
+        try:
+            raw = self.path.read_bytes()
+        except FileNotFoundError:
+            return False
+        try:
+            if raw[:4] != self.MAGIC or struct.unpack('>H', raw[4:6])[0] != self.VERSION:
+                logger.info('热启动检查点版本不符，忽略')
+                return False
+            state = json.loads(zlib.decompress(raw[6:]))
+            age = time.time() - state['saved']
+            if age > self.max_age:
+                logger.info(f'热启动检查点已过期（{age:.0f}s），忽略')
+                return False
+            self.last_auto_release = state.get('auto_release')
+            snap = state['snapshot']
+            if snap['wall'] and not status_snapshot.fetched_at:
+                data = {c: CodeStatus(c, *v) for c, v in snap['data'].items()}
+                status_snapshot.restore(data, datetime.fromisoformat(snap['wall']))
+            for t in tenants:
+                saved = state['tenants'].get(t.instance)
+                if saved:
+                    t.db.restore_roles({int(k): v for k, v in saved['roles'].items()})
+                    t.notifier.restore(saved['expiry'])
+        except Exception as e:
+            logger.warning(f'热启动检查点无法读取，忽略: {e}')
+            return False
+        logger.info(f'已从热启动检查点恢复（{age:.0f}s 前，{len(status_snapshot.data)} 个码）')
+        return True
+
+    def auto_release_delay(self, interval: float, default: float = 60) -> float:
+        """自动释放任务接着上次的节奏走，而不是每次重启都从头计时"""
+        if not self.last_auto_release:
+            return default
+        return max(5.0, interval - (time.time() - self.last_auto_release))
+
+    async def checkpoint(self, context=None):
+        try:
+            self.save()
+        except Exception as e:
+            logger.warning(f'热启动检查点写入失败: {e}')
+
+
+warm_state = WarmState()
+
+
+class Health:
+    """存活 / 就绪探针：HEALTH_PORT 上的 GET /healthz 与 /readyz，返回 JSON
+
+    - /healthz（存活）：事件循环延迟不超过 HEALTH_MAX_LAG、各机器人的轮询仍在运行；失败应重启进程
+    - /readyz（就绪）：另外要求每个租户的数据库探测都成功、连接池未占满；失败应把流量切到其他副本。
+      Meet API 是所有副本共用的外部依赖，默认只报告不参与判断（HEALTH_READY_MEET=1 时才参与），
+      且它不可用时机器人仍能用旧快照服务
+    两者都附带完整指标：循环延迟、距最近一次处理更新 / 成功自动释放的时间、连接池占用、依赖延迟。
+    依赖探测结果缓存 HEALTH_PROBE_INTERVAL 秒：Meet 直接沿用正常请求的耗时，区间内没有请求才补发一次单条查询；
+    请求探针本身只读缓存，不触发任何查询。
+    """
+
+    def __init__(self, port: int = HEALTH_PORT, interval: float = HEALTH_PROBE_INTERVAL,
+                 max_lag: float = HEALTH_MAX_LAG):
+        self.port = port
+        self.interval = interval
+        self.max_lag = max_lag
+        self.apps = []
+        self.loop_lag = 0.0
+        self._lags = deque(maxlen=60)
+        self.last_auto_release = None
+        self.probes = {}  # name -> {ok, latency_ms, error, at}
+        self._runner = None
+        self._tasks = []
+
+    def observe(self, name: str, ok: bool, latency: float, error: str = ''):
+        self.probes[name] = {'ok': ok, 'latency_ms': round(latency * 1000, 1), 'error': error,
+                             'at': time.monotonic()}
+
+    async def mark_update(self, update, context):
+        """group -1 的 TypeHandler：记录每个机器人最近一次收到更新的时刻"""
+        context.application.bot_data['last_update'] = time.monotonic()
+
+    # ---- 后台采样 ----
+    async def _watch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(1)
+            self.loop_lag = max(0.0, loop.time() - t0 - 1)
+            self._lags.append(self.loop_lag)
+
+    @staticmethod
+    async def _ping(db) -> tuple:
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.to_thread(db.ping), timeout=10)
+            return True, time.monotonic() - started, ''
+        except Exception as e:
+            return False, time.monotonic() - started, f'[{db.instance}] {str(e) or type(e).__name__}'
+
+    async def _probe_db(self):
+        """并发探测每个租户的数据库，汇总成一条 db 探针：任一失败即失败，延迟取最慢的"""
+        results = await asyncio.gather(*(self._ping(app.bot_data['tenant'].db) for app in self.apps))
+        self.observe('db', all(ok for ok, _, _ in results), max(lat for _, lat, _ in results),
+                     '; '.join(err for _, _, err in results if err))
+
+    async def _probe(self):
+        while True:
+            if self.apps:
+                await self._probe_db()
+            meet = self.probes.get('meet')
+            if meet is None or time.monotonic() - meet['at'] >= self.interval:
+                if meet_breaker.state == 'open':
+                    self.observe('meet', False, 0, '熔断中')
+                else:
+                    try:
+                        await _api_list_page(1, 0)
+                    except MeetUnavailable:
+                        pass  # _api_list_page 已记录
+            await asyncio.sleep(self.interval)
+
+    # ---- 报告 ----
+    def report(self) -> dict:
+        now = time.monotonic()
+        bots = {}
+        for app in self.apps:
+            last = app.bot_data.get('last_update')
+            bots[app.bot_data['tenant'].instance] = {
+                'polling': bool(app.updater and app.updater.running),
+                'last_update_s': round(now - last, 1) if last else None,
+                'updates': updates_summary(app),
+            }
+        usage = self.apps[0].bot_data['tenant'].db.pool_usage() if self.apps else None
+        probes = {}
+        for name, p in self.probes.items():
+            p = dict(p)
+            p['age_s'] = round(now - p.pop('at'), 1)
+            probes[name] = p
+        return {
+            'loop_lag_ms': round(self.loop_lag * 1000, 1),
+            'loop_lag_max_ms': round(max(self._lags, default=0.0) * 1000, 1),
+            'bots': bots,
+            'last_auto_release_s': round(time.time() - self.last_auto_release, 1) if self.last_auto_release else None,
+            'db_pool': {'used': usage[0], 'max': usage[1]} if usage else None,
+            'meet_breaker': meet_breaker.state,
+            'snapshot_age_s': round(status_snapshot.age(), 1) if status_snapshot.fetched_at else None,
+            'probes': probes,
+        }
+
+    def _live(self, r: dict) -> list:
+        problems = []
+        if self.loop_lag > self.max_lag:
+            problems.append('loop_lag')
+        # 启动完成后轮询停了（启动过程中 app.running 还是 False，不算）
+        problems += [f'polling:{app.bot_data["tenant"].instance}' for app in self.apps
+                     if app.running and not (app.updater and app.updater.running)]
+        return problems
+
+    def _ready(self, r: dict) -> list:
+        problems = self._live(r)
+        for name in ('db', 'meet') if HEALTH_READY_MEET else ('db',):
+            p = r['probes'].get(name)
+            if p is None or not p['ok']:
+                problems.append(name)
+        pool = r['db_pool']
+        if pool and pool['used'] >= pool['max']:
+            problems.append('db_pool')
+        return problems
+
+    async def _handle(self, request):
+        r = self.report()
+        problems = self._ready(r) if request.path == '/readyz' else self._live(r)
+        r['status'] = 'ok' if not problems else 'fail'
+        r['problems'] = problems
+        return aiohttp.web.json_response(r, status=200 if not problems else 503,
+                                         dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+    async def start(self, app: Application):
+        self.apps.append(app)
+        if not self.port or self._runner is not None:
+            return
+        web = aiohttp.web.Application()
+        web.router.add_get('/healthz', self._handle)
+        web.router.add_get('/readyz', self._handle)
+        self._runner = aiohttp.web.AppRunner(web, access_log=None)
+        await self._runner.setup()
+        await aiohttp.web.TCPSite(self._runner, HEALTH_HOST, self.port).start()
+        self._tasks = [asyncio.ensure_future(self._watch_loop()), asyncio.ensure_future(self._probe())]
+        logger.info(f'健康检查已启动 http://{HEALTH_HOST}:{self.port}/healthz /readyz')
+
+    async def stop(self, app: Application):
+        if app in self.apps:
+            self.apps.remove(app)
+        if self.apps or self._runner is None:
+            return
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        await self._runner.cleanup()
+        self._runner = None
+
+
+health = Health()
+
+
+async def _timed(instance: str, phase: str, aw):
+    """等待 aw 并记录耗时，失败时记日志后继续抛出"""
+    started = time.monotonic()
+    try:
+        return await aw
+    except Exception as e:
+        logger.error(f'[{instance}] 启动阶段「{phase}」失败: {e}')
+        raise
+    finally:
+        logger.info(f'[{instance}] 启动阶段「{phase}」{(time.monotonic() - started) * 1000:.0f}ms')
+
+
+async def _warm_snapshot():
+    try:
+        if status_snapshot._revalidating or not status_snapshot.fetched_at:
+            await status_snapshot.revalidate()
+    except MeetUnavailable as e:
+        logger.warning(f'状态快照预热失败: {e}')
+
+
+async def on_startup(app: Application):
+    """post_init：只等待开始处理更新前必须完成的建表，其余并行放到后台
+
+    模块导入和构造 Tenant 都不访问网络；预置码在成为 leader 后由租约任务在线程中写入。
+    """
+    t = app.bot_data['tenant']
+    started = time.monotonic()
+    app.bot_data['outbox'].start()
+    release_worker.start()
+    await health.start(app)
+    schema = asyncio.ensure_future(_timed(t.instance, '建表', asyncio.to_thread(t.db.init_schema)))
+    # 向主机器人注册自身、预热 / 校验状态快照：不影响处理更新，不等待
+    background = [
+        _timed(t.instance, '注册主机器人', asyncio.to_thread(register_to_master, t)),
+        _timed(t.instance, '状态快照预热', _warm_snapshot()),
+    ]
+    app.bot_data['warmup'] = asyncio.gather(*background, return_exceptions=True)
+    # 建表失败直接抛出，终止启动
+    await schema
+    # 领取配额计数按事件日志重建
+    app.bot_data['warmup'] = asyncio.gather(
+        app.bot_data['warmup'],
+        _timed(t.instance, '领取配额重建', t.limiter.rebuild(t.db)),
+        return_exceptions=True,
+    )
+    if t.db.cached_roles():
+        # 热启动恢复的角色缓存在后台重新校验
+        app.bot_data['warmup'] = asyncio.gather(
+            app.bot_data['warmup'],
+            _timed(t.instance, '角色缓存校验', asyncio.to_thread(t.db.refresh_roles)),
+            return_exceptions=True,
+        )
+    logger.info(f'[{t.instance}] 启动准备完成 {(time.monotonic() - started) * 1000:.0f}ms，'
+                f'距启动 {time.monotonic() - _BOOT:.2f}s')
+
+
+async def on_stop(app: Application):
+    """post_stop：已停止接收更新、bot 还未关闭，把排队中的结束会议和出站消息发完
+
+    结束会议队列和 Meet 会话是进程内共享的：单机器人模式在这里处理，
+    多租户模式由 run_host 在所有机器人都停止后统一处理一次。
+    """
+    if len(tenants) == 1:
+        await release_worker.stop()
+    await app.bot_data['outbox'].stop()
+    # 还没写进事件日志的开房 / 结束记录（租约在 post_shutdown 才释放）
+    await app.bot_data['tenant'].usage.flush()
+
+
+async def on_shutdown(app: Application):
+    """post_shutdown：bot 已关闭，只做资源清理"""
+    warmup = app.bot_data.get('warmup')
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+    app.bot_data['tenant'].db.events.flush()
+    app.bot_data['tenant'].leader.resign()
+    await warm_state.checkpoint()
+    await health.stop(app)
+    if len(tenants) == 1:
+        await close_meet_session()
+
+
 async def on_error(update, context):
     logger.exception('Unhandled exception', exc_info=context.error)
 
@@ -1224,16 +4695,16 @@ async def on_error(update, context):
 # ============================================================
 #  主函数
 # ============================================================
-def main():
-    if not BOT_TOKEN:
-        raise RuntimeError('BOT_TOKEN 未设置')
-
-    asyncio.set_event_loop(asyncio.new_event_loop())
-
-    # 向主机器人注册自身
-    register_to_master()
-
-    app = Application.builder().token(BOT_TOKEN).build()
+def build_app(t: Tenant, run_global_jobs: bool = True) -> Application:
+    builder = (Application.builder().token(t.token)
+               .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown))
+    if UPDATE_CONCURRENCY > 1:
+        builder = builder.concurrent_updates(KeyedUpdateProcessor())
+    app = builder.build()
+    app.bot_data['tenant'] = t
+    app.bot_data['outbox'] = Outbox(app.bot)
+    app.bot_data['coalescer'] = Coalescer()
+    app.add_handler(TypeHandler(Update, health.mark_update), group=-1)
     app.add_handler(CommandHandler('start', start_cmd))
     app.add_handler(CommandHandler('admin', admin_cmd))
     app.add_handler(CommandHandler('bind', bind_cmd))
@@ -1243,11 +4714,93 @@ def main():
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text))
     app.add_error_handler(on_error)
 
-    # 每5分钟自动释放 Vercel 侧过期的授权码
-    app.job_queue.run_repeating(auto_release_expired, interval=300, first=60)
+    # leader 选举：每 ttl/3 秒抢占/续期一次，只有 leader 执行下面的定时任务
+    app.job_queue.run_repeating(t.leader.tick, interval=max(1, LEADER_LEASE_SECONDS // 3), first=0)
+    # 事件日志批量落库（所有副本都会产生事件，不受 leader 限制）
+    app.job_queue.run_repeating(t.db.events.flush_job, interval=EVENT_FLUSH_INTERVAL, first=EVENT_FLUSH_INTERVAL)
+    # 每分钟检查一次到期提醒
+    app.job_queue.run_repeating(t.notifier.run, interval=60, first=30)
+    # 自动回收领取后一直未使用的码
+    app.job_queue.run_repeating(t.reclaimer.run, interval=Reclaimer.INTERVAL, first=120)
+    # 实时面板：有变化时最多每 LIVE_THROTTLE 秒编辑一次
+    app.job_queue.run_repeating(t.live.tick, interval=LIVE_THROTTLE, first=LIVE_THROTTLE)
+    # 到期已久的码移到归档表
+    app.job_queue.run_repeating(t.archiver.run, interval=Archiver.INTERVAL, first=300)
+    # 快照里观察到的开房 / 结束写进事件日志（仅 leader）
+    app.job_queue.run_repeating(t.usage.flush, interval=UsageTracker.INTERVAL, first=UsageTracker.INTERVAL)
+    # 库存耗尽预测 / 预警
+    app.job_queue.run_repeating(t.forecast.run, interval=60, first=10)
+    if run_global_jobs:
+        # 每5分钟自动释放 Vercel 侧过期的授权码（重启后接着上次的计时）
+        app.job_queue.run_repeating(auto_release_expired, interval=300, first=warm_state.auto_release_delay(300))
+        # 热启动检查点
+        app.job_queue.run_repeating(warm_state.checkpoint, interval=WARM_STATE_INTERVAL, first=WARM_STATE_INTERVAL)
+    return app
+
+
+async def run_host(apps: list):
+    """多租户模式：在同一个事件循环里托管多个 Application，共用连接池和状态快照"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    started = []
+
+    async def start(app):
+        await app.initialize()
+        started.append(app)
+        if app.post_init:
+            await app.post_init(app)
+        await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await app.start()
+
+    try:
+        # 各机器人互不依赖，并行启动
+        await asyncio.gather(*(start(app) for app in apps))
+        logger.info(f'☁️ 多租户模式：已托管 {len(apps)} 个机器人，距启动 {time.monotonic() - _BOOT:.2f}s')
+        await stop.wait()
+    finally:
+        stopped = []
+        for app in reversed(started):
+            try:
+                if app.updater.running:
+                    await app.updater.stop()
+                if app.running:
+                    await app.stop()
+                    stopped.append(app)
+            except Exception as e:
+                logger.error(f'[{app.bot_data["tenant"].instance}] 停止失败: {e}')
+        # 所有机器人都不再接收更新后再排空共享的结束会议队列，结果仍经各自的出站队列发出
+        await release_worker.stop()
+        for app in reversed(started):
+            try:
+                # 与 run_polling 一致：stop → post_stop → shutdown → post_shutdown
+                if app in stopped and app.post_stop:
+                    await app.post_stop(app)
+                await app.shutdown()
+                if app.post_shutdown:
+                    await app.post_shutdown(app)
+            except Exception as e:
+                logger.error(f'[{app.bot_data["tenant"].instance}] 关闭失败: {e}')
+        await close_meet_session()
+
 
-    logger.info('☁️ 自用型机器人启动中...')
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+def main():
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+    # 构造 Tenant 不访问网络；建表、注册主机器人等都在 post_init 中并行完成
+    tenants[:] = load_tenants()
+    # 本地文件，不访问网络；必须在 build_app 之前（自动释放任务的首次延迟取决于它）
+    warm_state.load()
+    apps = [build_app(t, run_global_jobs=(i == 0)) for i, t in enumerate(tenants)]
+    if len(apps) == 1:
+        logger.info('☁️ 自用型机器人启动中...')
+        apps[0].run_polling(allowed_updates=Update.ALL_TYPES)
+    else:
+        asyncio.get_event_loop().run_until_complete(run_host(apps))
 
 
 if __name__ == '__main__':
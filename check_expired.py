@@ -1,33 +1,187 @@
-﻿import urllib.request, json
+# -*- coding: utf-8 -*-
+"""
+授权码到期排查工具（事故处理时手动运行）
+
+与机器人共用同一套 Meet API 客户端（分页、熔断、并发释放），配置同样读取 .env。
+
+  python check_expired.py report                      # 文本报告：使用中 / 已过期
+  python check_expired.py --local report              # 同上，附带本地持码人
+  python check_expired.py export --format ndjson      # 全部码状态流式输出到 stdout（json / csv / ndjson）
+  python check_expired.py release --dry-run           # 列出将要结束的过期会议
+  python check_expired.py release -c 16               # 并发结束所有已过期会议
+
+--local 会连接 DATABASE_URL，按 BOT_INSTANCE（或 --instance）读取 auth_code_pool_{实例} 的持码人。
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
 from datetime import datetime
 
-url = "https://meet.f13f2f75.org/api/admin-code?action=list&limit=500"
-headers = {"User-Agent": "Mozilla/5.0", "Origin": "https://meet.f13f2f75.org"}
-req = urllib.request.Request(url, headers=headers)
-with urllib.request.urlopen(req, timeout=15) as r:
-    data = json.loads(r.read().decode())
-
-now = datetime.now().astimezone()
-codes = data["codes"]
-print(f"总in_use码数: {sum(1 for c in codes if int(c.get('in_use') or 0)==1)}")
-print()
-for c in codes:
-    if int(c.get("in_use") or 0) != 1:
-        continue
-    ea = c.get("expires_at") or ""
-    code = c["code"]
-    if ea:
-        try:
-            exp = datetime.fromisoformat(str(ea).replace("Z","+00:00"))
-            rem = exp - now
-            secs = rem.total_seconds()
-            if secs <= 0:
-                h=int(abs(secs)//3600); m=int(abs(secs)%3600//60)
-                print(f"[已过期] {code}  过期了{h}时{m}分前  expires_at={ea}")
+import bot
+
+EXPORT_FIELDS = ['code', 'in_use', 'bound_room', 'expires_at', 'state', 'remaining_min',
+                 'holder_id', 'holder_name', 'assigned_at']
+
+
+def _classify(detail: dict, now: datetime) -> tuple:
+    """返回 (state, remaining_min)：state 为 expired / in_use / idle / no_expiry"""
+    exp = bot._parse_expires(detail.get('expires_at'))
+    in_use = int(detail.get('in_use') or 0) == 1
+    if exp is None:
+        return ('no_expiry' if in_use else 'idle'), None
+    remaining = int((exp - now).total_seconds() // 60)
+    if remaining < 0:
+        return 'expired', remaining
+    return ('in_use' if in_use else 'idle'), remaining
+
+
+def _load_holders(instance: str) -> dict:
+    """本地库中已出库的码：code -> row（含持码人名称）"""
+    db = bot.open_db(bot._instance_name(instance))
+    return {r['code']: r for r in db.get_assigned_rows(0, all_users=True)}
+
+
+def _holder_fields(row) -> dict:
+    if row is None:
+        return {'holder_id': '', 'holder_name': '', 'assigned_at': ''}
+    return {
+        'holder_id': row['assigned_to'] if row['assigned_to'] is not None else '',
+        'holder_name': bot._get_who(row),
+        'assigned_at': row['assigned_at'] or '',
+    }
+
+
+def _record(detail: dict, now: datetime, holders: dict | None) -> dict:
+    state, remaining = _classify(detail, now)
+    rec = {
+        'code': detail['code'],
+        'in_use': int(detail.get('in_use') or 0),
+        'bound_room': detail.get('bound_room') or '',
+        'expires_at': detail.get('expires_at') or '',
+        'state': state,
+        'remaining_min': remaining if remaining is not None else '',
+    }
+    if holders is not None:
+        rec.update(_holder_fields(holders.get(detail['code'])))
+    return rec
+
+
+async def cmd_report(args, holders):
+    now = datetime.now().astimezone()
+    in_use_total = 0
+    lines = []
+    async for page in bot.api_iter_codes():
+        for c in page:
+            if int(c.get('in_use') or 0) != 1:
+                continue
+            in_use_total += 1
+            state, remaining = _classify(c, now)
+            who = ''
+            if holders is not None:
+                row = holders.get(c['code'])
+                who = f'  持码人={bot._get_who(row)}' if row else '  持码人=（非本库）'
+            if state == 'no_expiry':
+                lines.append(f'[无到期时间] {c["code"]}  expires_at=null{who}')
+            elif state == 'expired':
+                ago = -remaining
+                lines.append(f'[已过期] {c["code"]}  过期了{ago // 60}时{ago % 60}分前  expires_at={c["expires_at"]}{who}')
+            else:
+                lines.append(f'[使用中] {c["code"]}  剩余{remaining // 60}时{remaining % 60}分{who}')
+    print(f'总in_use码数: {in_use_total}')
+    print()
+    for line in lines:
+        print(line)
+
+
+async def cmd_export(args, holders):
+    """逐页流式写出，内存只保留当前一页"""
+    now = datetime.now().astimezone()
+    out = sys.stdout
+    fields = EXPORT_FIELDS if holders is not None else EXPORT_FIELDS[:6]
+    writer = None
+    first = True
+    if args.format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=fields)
+        writer.writeheader()
+    elif args.format == 'json':
+        out.write('[')
+    async for page in bot.api_iter_codes():
+        for c in page:
+            rec = _record(c, now, holders)
+            if args.state and rec['state'] not in args.state:
+                continue
+            if writer is not None:
+                writer.writerow(rec)
+            elif args.format == 'json':
+                out.write(('\n' if first else ',\n') + json.dumps(rec, ensure_ascii=False))
             else:
-                h=int(secs//3600); m=int(secs%3600//60)
-                print(f"[使用中] {code}  剩余{h}时{m}分")
-        except Exception as e:
-            print(f"[解析失败] {code}  {e}")
-    else:
-        print(f"[无到期时间] {code}  expires_at=null")
+                out.write(json.dumps(rec, ensure_ascii=False) + '\n')
+            first = False
+        out.flush()
+    if args.format == 'json':
+        out.write('\n]\n' if not first else ']\n')
+
+
+async def cmd_release(args, holders):
+    now = datetime.now().astimezone()
+    expired = []
+    async for page in bot.api_iter_codes():
+        for c in page:
+            if int(c.get('in_use') or 0) == 1 and _classify(c, now)[0] == 'expired':
+                if holders is None or c['code'] in holders:
+                    expired.append(c['code'])
+    if not expired:
+        print('没有需要结束的过期会议')
+        return
+    if args.dry_run:
+        print(f'将结束 {len(expired)} 个过期会议：')
+        for code in expired:
+            print(code)
+        return
+    released, failed = await bot.release_many(expired, args.concurrency)
+    print(f'已结束 {len(released)} 个，失败 {len(failed)} 个')
+    for code in failed:
+        print(f'[失败] {code}')
+    if failed:
+        sys.exit(1)
+
+
+async def main_async(args):
+    holders = _load_holders(args.instance) if args.local else None
+    try:
+        await {'report': cmd_report, 'export': cmd_export, 'release': cmd_release}[args.cmd](args, holders)
+    except bot.MeetUnavailable as e:
+        print(f'Meet API 不可用: {e}', file=sys.stderr)
+        sys.exit(2)
+    finally:
+        await bot.close_meet_session()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='授权码到期排查工具')
+    parser.add_argument('--local', action='store_true', help='关联本地 auth_code_pool 持码人（需要 DATABASE_URL）')
+    parser.add_argument('--instance', default=bot.BOT_INSTANCE, help='本地实例名，默认取 BOT_INSTANCE')
+    sub = parser.add_subparsers(dest='cmd')
+    sub.add_parser('report', help='文本报告（默认）')
+    p_export = sub.add_parser('export', help='导出全部码状态到 stdout')
+    p_export.add_argument('--format', choices=['json', 'csv', 'ndjson'], default='ndjson')
+    p_export.add_argument('--state', action='append', choices=['expired', 'in_use', 'idle', 'no_expiry'],
+                          help='只导出指定状态，可重复')
+    p_release = sub.add_parser('release', help='并发结束所有已过期会议（--local 时只处理本地库中的码）')
+    p_release.add_argument('-c', '--concurrency', type=int, default=bot.BULK_RELEASE_CONCURRENCY)
+    p_release.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+    args.cmd = args.cmd or 'report'
+    return args
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main_async(parse_args()))
+    except BrokenPipeError:
+        # 输出被 head 等提前关闭，静默退出
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+存储后端迁移工具：PostgreSQL ⇄ SQLite，配置同样读取 .env
+
+  python migrate_db.py --to sqlite                    # DATABASE_URL → SQLITE_PATH
+  python migrate_db.py --to postgres                  # SQLITE_PATH → DATABASE_URL
+  python migrate_db.py --to sqlite --instance bot2    # 只迁移指定实例（可重复）
+  python migrate_db.py --legacy data/bot.db --to sqlite   # 导入旧版无实例后缀的 users / auth_code_pool
+
+按原主键原样复制 users / auth_code_pool / auth_code_archive / code_events / expiry_notice / live_viewers
+（leader 租约不复制），目标端已存在的行跳过，可重复执行。迁移时请先停掉机器人。
+"""
+import argparse
+import sys
+
+import bot
+
+BATCH = 1000
+
+
+def _tables(db: bot.DB) -> list:
+    return [db.tbl_users, db.tbl_codes, db.tbl_archive, db.tbl_events, db.tbl_notices, db.tbl_live]
+
+
+def copy_table(src: bot.DB, dst: bot.DB, src_table: str, dst_table: str) -> int:
+    conn = src._conn()
+    try:
+        cur = src._cur(conn)
+        cur.execute(f'SELECT * FROM {src_table}')
+        cols = [d[0] for d in cur.description]
+        total = 0
+        while True:
+            rows = cur.fetchmany(BATCH)
+            if not rows:
+                break
+            dst.copy_rows(dst_table, cols, [tuple(r[c] for c in cols) for r in rows])
+            total += len(rows)
+        return total
+    finally:
+        src._put(conn)
+
+
+def migrate(src: bot.DB, dst: bot.DB, pairs: list):
+    dst.init_schema()
+    for src_table, dst_table in pairs:
+        n = copy_table(src, dst, src_table, dst_table)
+        print(f'{src_table} → {dst_table}: {n} 行')
+    dst.reset_sequences()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='存储后端迁移工具')
+    parser.add_argument('--to', choices=['sqlite', 'postgres'], required=True, help='目标后端')
+    parser.add_argument('--instance', action='append', help='实例名，默认取 BOT_INSTANCE，可重复')
+    parser.add_argument('--legacy', metavar='PATH', help='源为旧版 SQLite 文件（表名 users / auth_code_pool）')
+    args = parser.parse_args(argv)
+
+    source = 'sqlite' if args.to == 'postgres' else 'postgres'
+    instances = [bot._instance_name(i) for i in (args.instance or [bot.BOT_INSTANCE])]
+    for instance in instances:
+        dst = bot.open_db(instance, bot.OWNER_ID, backend=args.to)
+        if args.legacy:
+            src = bot.SqliteDB(instance, bot.OWNER_ID, path=args.legacy)
+            pairs = [('users', dst.tbl_users), ('auth_code_pool', dst.tbl_codes)]
+        else:
+            src = bot.open_db(instance, bot.OWNER_ID, backend=source)
+            pairs = list(zip(_tables(src), _tables(dst)))
+        print(f'[{instance}] {args.legacy or source} → {args.to}')
+        try:
+            migrate(src, dst, pairs)
+        except Exception as e:
+            print(f'[{instance}] 迁移失败: {e}', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# 导入 bot 之前设置：不连真实数据库 / 不读写项目 data 目录
+_tmp = tempfile.mkdtemp(prefix='cloudmeeting-test-')
+os.environ.setdefault('BOT_TOKEN', '1:test')
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ['SQLITE_PATH'] = str(Path(_tmp) / 'test.db')
+os.environ['WARM_STATE_PATH'] = str(Path(_tmp) / 'warm_state.bin')
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
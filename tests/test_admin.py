@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize('target, expected', [
+    ('12345', ('12345', 12345)),           # 纯数字：ID 和码都查
+    ('123456789012', ('123456789012', 123456789012)),
+    ('id:12345', (None, 12345)),
+    ('ID:42', (None, 42)),
+    ('code:12345', ('12345', None)),
+    ('ABC123', ('ABC123', None)),
+    ('id:abc', ('id:abc', None)),          # id: 后面不是数字，按码处理
+])
+def test_admin_target(target, expected):
+    assert bot._admin_target(target) == expected
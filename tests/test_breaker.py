@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def _opened(clock):
+    b = bot.CircuitBreaker(failures=3, reset_after=30)
+    for _ in range(3):
+        assert b.allow()
+        b.failure()
+    return b
+
+
+def test_opens_after_consecutive_failures(clock):
+    b = bot.CircuitBreaker(failures=3, reset_after=30)
+    b.failure()
+    b.failure()
+    b.success()
+    b.failure()
+    assert b.state == 'closed'
+    b = _opened(clock)
+    assert b.state == 'open'
+    assert not b.allow()
+
+
+def test_half_open_lets_exactly_one_probe_through(clock):
+    b = _opened(clock)
+    clock[0] += 30
+    assert b.state == 'half_open'
+    assert b.allow()
+    assert not b.allow()
+
+
+def test_probe_success_closes(clock):
+    b = _opened(clock)
+    clock[0] += 30
+    assert b.allow()
+    b.success()
+    assert b.state == 'closed'
+    assert b.allow() and b.allow()
+
+
+def test_probe_failure_reopens(clock):
+    b = _opened(clock)
+    clock[0] += 30
+    assert b.allow()
+    b.failure()
+    assert b.state == 'open'
+    assert not b.allow()
+
+
+def test_abandoned_probe_is_retried_after_timeout(clock):
+    b = _opened(clock)
+    clock[0] += 30
+    assert b.allow()  # 试探请求被取消，没有回调 success / failure
+    clock[0] += 29
+    assert not b.allow()
+    clock[0] += 1
+    assert b.allow()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import pytest
+
+import bot
+
+
+def _counting(result='ok', delay=0.0, error=None):
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+
+    return calls, factory
+
+
+def test_concurrent_duplicates_join_in_flight_run():
+    async def main():
+        c = bot.Coalescer(window=1)
+        calls, factory = _counting(delay=0.05)
+        results = await asyncio.gather(*(c.run('s', 'a', factory) for _ in range(3)))
+        return calls, results
+
+    calls, results = asyncio.run(main())
+    assert len(calls) == 1
+    assert results == ['ok'] * 3
+
+
+def test_finished_result_reused_within_window_only():
+    async def main():
+        c = bot.Coalescer(window=0.05)
+        calls, factory = _counting()
+        await c.run('s', 'a', factory)
+        await c.run('s', 'a', factory)
+        await asyncio.sleep(0.06)
+        await c.run('s', 'a', factory)
+        return calls
+
+    assert len(asyncio.run(main())) == 2
+
+
+def test_other_action_breaks_reuse():
+    async def main():
+        c = bot.Coalescer(window=1)
+        calls, factory = _counting()
+        await c.run('s', 'a', factory)
+        await c.run('s', 'b', factory)
+        await c.run('s', 'a', factory)
+        await c.run('other', 'a', factory)
+        return calls
+
+    assert len(asyncio.run(main())) == 4
+
+
+def test_failed_run_is_not_reused():
+    async def main():
+        c = bot.Coalescer(window=1)
+        _, failing = _counting(error=RuntimeError('boom'))
+        with pytest.raises(RuntimeError):
+            await c.run('s', 'a', failing)
+        calls, factory = _counting()
+        return await c.run('s', 'a', factory), calls
+
+    result, calls = asyncio.run(main())
+    assert result == 'ok' and len(calls) == 1
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import bot
+
+
+class FakeDB:
+    instance = 'test'
+
+    def __init__(self):
+        self.rows = []
+        self.fail = False
+
+    def insert_events(self, batch):
+        if self.fail:
+            raise RuntimeError('down')
+        self.rows.extend(batch)
+
+
+def test_emit_from_threads_while_flushing():
+    db = FakeDB()
+    log = bot.EventLog(db, max_buffer=10 ** 6)
+    stop = threading.Event()
+
+    def flusher():
+        while not stop.is_set():
+            log.flush()
+
+    def worker(n):
+        for i in range(2000):
+            log.emit('claimed', f'{n}-{i}')
+
+    f = threading.Thread(target=flusher)
+    f.start()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    stop.set()
+    f.join()
+    log.flush()
+    assert len(db.rows) == 8000
+    assert len({row[2] for row in db.rows}) == 8000
+
+
+def test_failed_flush_keeps_order_and_retries():
+    db = FakeDB()
+    log = bot.EventLog(db)
+    log.emit('claimed', 'A')
+    db.fail = True
+    log.flush()
+    log.emit('released', 'B')
+    db.fail = False
+    log.flush()
+    assert [row[2] for row in db.rows] == ['A', 'B']
+
+
+def test_buffer_drops_oldest_when_full():
+    db = FakeDB()
+    log = bot.EventLog(db, max_buffer=2)
+    seen = []
+    log.listeners.append(seen.append)
+    for code in 'ABC':
+        log.emit('added', code)
+    log.flush()
+    assert [row[2] for row in db.rows] == ['B', 'C']
+    assert seen == ['added'] * 3
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('=HYPERLINK("x")', '\'=HYPERLINK("x")'),
+    ('+1', "'+1"),
+    ('-1', "'-1"),
+    ('@SUM(A1)', "'@SUM(A1)"),
+    ('\tx', "'\tx"),
+    ('\rx', "'\rx"),
+    ('张三', '张三'),
+    ('a=b', 'a=b'),          # 只看开头
+    ('', ''),
+    (None, ''),
+])
+def test_csv_text(value, expected):
+    assert bot._csv_text(value) == expected
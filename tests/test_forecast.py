@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import bot
+
+
+class FakeDB:
+    def __init__(self, claims, available):
+        self.claims = claims
+        self.available = available
+
+    def get_claims_since(self, mark):
+        return [ts for ts in self.claims if ts > mark]
+
+    def stock_stats(self):
+        return {'available': self.available}
+
+
+def _forecast(claims, available, threshold_hours=2):
+    tenant = SimpleNamespace(db=FakeDB(claims, available))
+    return bot.StockForecast(tenant, threshold_hours=threshold_hours)
+
+
+def _ago(secs):
+    return datetime.fromtimestamp(time.time() - secs).isoformat()
+
+
+def test_empty_stock_is_low_without_claims():
+    f = _forecast([], 0)
+    f.update()
+    assert f.eta is None
+    assert f.low()
+
+
+def test_no_claims_is_not_low():
+    f = _forecast([], 100)
+    f.update()
+    assert f.eta is None
+    assert not f.low()
+
+
+def test_fast_burn_is_low():
+    # 近 1 小时领了 60 个，剩 60 个 → 约 1 小时耗尽，低于 2 小时阈值
+    f = _forecast([_ago(i * 60 + 1) for i in range(60)], 60)
+    f.update()
+    assert 0.9 * 3600 < f.eta < 1.1 * 3600
+    assert f.low()
+
+
+def test_slow_burn_is_not_low():
+    # 近 24 小时领了 24 个，剩 1000 个
+    f = _forecast([_ago(i * 3600 + 1) for i in range(24)], 1000)
+    f.update()
+    assert f.eta > f.threshold
+    assert not f.low()
+
+
+def test_burst_uses_fastest_window():
+    # 24 小时前段平静，最近 1 小时突发 30 个：按 1 小时窗口估算
+    f = _forecast([_ago(i * 60 + 1) for i in range(30)], 30)
+    f.update()
+    assert abs(f.rate - 30) < 1
+    assert f.low()
+
+
+def test_incremental_ingest():
+    db_claims = [_ago(30)]
+    f = _forecast(db_claims, 100)
+    f.update()
+    assert len(f._times) == 1
+    db_claims.append(_ago(1))
+    f.update()
+    assert len(f._times) == 2
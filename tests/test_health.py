@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from types import SimpleNamespace
+
+import bot
+
+
+class FakeDB:
+    def __init__(self, instance, error=None):
+        self.instance = instance
+        self.error = error
+        self.pinged = 0
+
+    def ping(self):
+        self.pinged += 1
+        if self.error:
+            raise self.error
+
+
+def _health(*dbs):
+    h = bot.Health(port=0)
+    h.apps = [SimpleNamespace(bot_data={'tenant': SimpleNamespace(db=db, instance=db.instance)}, running=False)
+              for db in dbs]
+    return h
+
+
+def test_probe_db_pings_every_tenant():
+    dbs = [FakeDB('a'), FakeDB('b')]
+    h = _health(*dbs)
+    asyncio.run(h._probe_db())
+    assert [db.pinged for db in dbs] == [1, 1]
+    assert h.probes['db']['ok']
+    assert h.probes['db']['error'] == ''
+
+
+def test_probe_db_fails_when_any_tenant_fails():
+    h = _health(FakeDB('a'), FakeDB('b', RuntimeError('gone')))
+    asyncio.run(h._probe_db())
+    assert not h.probes['db']['ok']
+    assert h.probes['db']['error'] == '[b] gone'
+    assert 'db' in h._ready({'bots': {}, 'loop_lag_ms': 0, 'probes': h.probes, 'db_pool': None})
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta, timezone
+
+import bot
+
+
+def _limiter(**kwargs):
+    kwargs.setdefault('rate', 0)
+    kwargs.setdefault('quotas', {'user': 2})
+    kwargs.setdefault('period_hours', 24)
+    return bot.ClaimLimiter(**kwargs)
+
+
+def _count(limiter, uid):
+    return len(limiter._claims.get(uid, ()))
+
+
+def test_throttle_allows_burst_then_rejects():
+    lim = _limiter(rate=0.1, burst=2)
+    assert lim.throttle(1) is None
+    assert lim.throttle(1) is None
+    assert lim.throttle(1).startswith('⏳')
+    assert lim.throttle(2) is None
+
+
+def test_reserve_enforces_quota_per_role():
+    lim = _limiter()
+    assert lim.reserve(1, 'user')[0] is None
+    assert lim.reserve(1, 'user')[0] is None
+    denied, reserved = lim.reserve(1, 'user')
+    assert denied.startswith('⛔') and reserved is None
+    assert lim.reserve(1, 'admin') == (None, None)
+
+
+def test_refund_removes_only_the_reserved_entry():
+    lim = _limiter(quotas={'user': 3})
+    _, first = lim.reserve(1, 'user')
+    _, second = lim.reserve(1, 'user')
+    lim.refund(1, first)
+    assert list(lim._claims[1]) == [second]
+
+
+def test_refund_without_reservation_keeps_restored_history():
+    lim = _limiter()
+    lim.restore([(1, datetime.now(timezone.utc) - timedelta(hours=1))])
+    _, reserved = lim.reserve(1, 'admin')  # 没有配额的角色不预占
+    lim.refund(1, reserved)
+    assert _count(lim, 1) == 1
+
+
+def test_restore_merges_with_live_counts():
+    lim = _limiter(quotas={'user': 3})
+    lim.reserve(1, 'user')
+    lim.restore([
+        (1, datetime.now(timezone.utc) - timedelta(hours=2)),
+        (2, datetime.now(timezone.utc) - timedelta(hours=3)),
+        (3, 'not a timestamp'),
+    ])
+    assert _count(lim, 1) == 2
+    assert _count(lim, 2) == 1
+    assert 3 not in lim._claims
+    assert list(lim._claims[1]) == sorted(lim._claims[1])
+
+
+def test_old_claims_slide_out_of_window():
+    lim = _limiter(quotas={'user': 1}, period_hours=1)
+    lim.restore([(1, datetime.now(timezone.utc) - timedelta(hours=2))])
+    assert lim.reserve(1, 'user')[0] is None
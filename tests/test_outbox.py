@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from datetime import timedelta
+
+from telegram.error import Forbidden, RetryAfter
+
+import bot
+
+
+class FakeBot:
+    """按调用顺序记录请求；fail 里放好的异常依次抛出"""
+
+    def __init__(self, fail=()):
+        self.calls = []
+        self.fail = list(fail)
+
+    async def _call(self, kind, chat_id, text):
+        self.calls.append((kind, chat_id, text))
+        if self.fail:
+            raise self.fail.pop(0)
+        return f'{kind}:{chat_id}:{text}'
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._call('send', chat_id, text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return await self._call('edit', chat_id, text)
+
+
+def _outbox(fake):
+    return bot.Outbox(fake, global_rate=1000, chat_rate=1000, chat_burst=1000)
+
+
+def test_token_bucket_delay():
+    b = bot.TokenBucket(rate=2, burst=1)
+    assert b.delay(b.ts) == 0
+    b.take(b.ts)
+    assert b.delay(b.ts) == 0.5
+    assert b.delay(b.ts + 0.5) == 0
+
+
+def test_pending_edits_collapse_to_last():
+    async def main():
+        fake = FakeBot()
+        ob = _outbox(fake)
+        first = ob.edit(1, 10, 'a')
+        second = ob.edit(1, 10, 'b')
+        ob.start()
+        results = await asyncio.gather(first, second)
+        await ob.stop()
+        return fake.calls, results
+
+    calls, results = asyncio.run(main())
+    assert calls == [('edit', 1, 'b')]
+    assert results == ['edit:1:b', 'edit:1:b']
+
+
+def test_identical_edit_is_skipped():
+    async def main():
+        fake = FakeBot()
+        ob = _outbox(fake)
+        ob.start()
+        await ob.edit(1, 10, 'same')
+        again = await ob.edit(1, 10, 'same')
+        await ob.stop()
+        return fake.calls, again
+
+    calls, again = asyncio.run(main())
+    assert calls == [('edit', 1, 'same')]
+    assert again is None
+
+
+def test_interactive_lane_goes_first():
+    async def main():
+        fake = FakeBot()
+        ob = _outbox(fake)
+        bulk = ob.send(1, 'bulk', priority=bot.Outbox.BULK)
+        interactive = ob.send(2, 'reply')
+        ob.start()
+        await asyncio.gather(bulk, interactive)
+        await ob.stop()
+        return fake.calls
+
+    assert [c[2] for c in asyncio.run(main())] == ['reply', 'bulk']
+
+
+def test_retry_after_pauses_and_retries():
+    async def main():
+        fake = FakeBot(fail=[RetryAfter(timedelta(milliseconds=50))])
+        ob = _outbox(fake)
+        ob.start()
+        result = await asyncio.wait_for(ob.send(1, 'hi'), 2)
+        await ob.stop()
+        return fake.calls, result
+
+    calls, result = asyncio.run(main())
+    assert calls == [('send', 1, 'hi'), ('send', 1, 'hi')]
+    assert result == 'send:1:hi'
+
+
+def test_failure_resolves_none_and_calls_on_error():
+    async def main():
+        fake = FakeBot(fail=[Forbidden('bot was blocked by the user')])
+        ob = _outbox(fake)
+        errors = []
+        ob.start()
+        result = await ob.edit(1, 10, 'x', on_error=errors.append)
+        await ob.stop()
+        return result, errors
+
+    result, errors = asyncio.run(main())
+    assert result is None
+    assert len(errors) == 1 and isinstance(errors[0], Forbidden)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from telegram import CallbackQuery, Update, User
+
+import bot
+
+
+def _update(uid: int, n: int = 1) -> Update:
+    user = User(uid, f'u{uid}', False)
+    return Update(n, callback_query=CallbackQuery(str(n), user, chat_instance='c'))
+
+
+def test_same_user_keeps_arrival_order():
+    async def main():
+        p = bot.KeyedUpdateProcessor(concurrency=4, max_pending=16, per_user=8)
+        done = []
+
+        async def handler(i, delay):
+            await asyncio.sleep(delay)
+            done.append(i)
+
+        await asyncio.gather(*(p.do_process_update(_update(1, i), handler(i, d))
+                               for i, d in enumerate([0.03, 0.01, 0.0])))
+        return done, p.stats()
+
+    done, stats = asyncio.run(main())
+    assert done == [0, 1, 2]
+    assert stats['pending'] == 0 and stats['users'] == 0
+
+
+def test_different_users_run_concurrently():
+    async def main():
+        p = bot.KeyedUpdateProcessor(concurrency=2, max_pending=16, per_user=8)
+        a_started, b_started = asyncio.Event(), asyncio.Event()
+
+        async def a():
+            a_started.set()
+            await b_started.wait()
+
+        async def b():
+            b_started.set()
+            await a_started.wait()
+
+        await asyncio.wait_for(asyncio.gather(p.do_process_update(_update(1), a()),
+                                              p.do_process_update(_update(2), b())), 1)
+
+    asyncio.run(main())
+
+
+def test_drops_updates_beyond_per_user_depth():
+    async def main():
+        p = bot.KeyedUpdateProcessor(concurrency=4, max_pending=16, per_user=2)
+        gate = asyncio.Event()
+        ran = []
+
+        async def handler(i):
+            ran.append(i)
+            await gate.wait()
+
+        tasks = [asyncio.ensure_future(p.do_process_update(_update(1, i), handler(i))) for i in range(3)]
+        await asyncio.sleep(0.01)
+        depth = p.depths()
+        gate.set()
+        await asyncio.gather(*tasks)
+        return ran, depth, p.dropped
+
+    ran, depth, dropped = asyncio.run(main())
+    assert ran == [0, 1]
+    assert depth == {1: 2}
+    assert dropped == 1
+
+
+def test_cancelled_queued_update_never_runs():
+    async def main():
+        p = bot.KeyedUpdateProcessor(concurrency=4, max_pending=16, per_user=8)
+        gate = asyncio.Event()
+        ran = []
+
+        async def handler(i):
+            ran.append(i)
+            await gate.wait()
+
+        first = asyncio.ensure_future(p.do_process_update(_update(1, 0), handler(0)))
+        queued = asyncio.ensure_future(p.do_process_update(_update(1, 1), handler(1)))
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        await first
+        return ran, queued.cancelled(), p.stats()
+
+    ran, cancelled, stats = asyncio.run(main())
+    assert ran == [0]
+    assert cancelled
+    assert stats['pending'] == 0 and stats['users'] == 0